@@ -1,62 +1,171 @@
+import asyncio
 import os
-import re
+import signal
+import sys
+import threading
 import time
-import requests
 import json
 import urllib.parse
 from datetime import datetime
 from typing import Dict, List, Optional
 
+from board_parser import parse_board, rules_fingerprint
+from log_reader import CursorStore, FileCursor
+from case_monitor import CaseMonitor, RigChannel
+from log_watcher import LogPair
+from metrics import CycleMetrics
+from parse_pool import ParsePool
+from scheduler import ScanCandidate, ScanScheduler, select_within_budget
+from spool import Spool, SpoolSender
+from transport import Transport
+
 # --- 版本信息 ---
 AGENT_VERSION = "2.1.0"
-print(f"🚀 Titan Node Agent v{AGENT_VERSION} - 启动中...")
-print(f"📅 启动时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-print("=" * 60)
 
 # --- 配置管理 ---
 def load_config():
     config_path = os.path.join(os.path.dirname(__file__), "config.json")
     default_config = {
         "BACKEND_URL": "http://localhost:8000/api/report",
-        "SCAN_INTERVAL": 30
+        "SCAN_INTERVAL": 30,
+        "HTTP_TIMEOUT": 10,
+        "HTTP_GZIP": True,
+        "TEMP_WINDOW_SECONDS": 300,
+        # 温度曲线保留时长（秒），默认 7 天；与窗口宽度无关
+        "TEMP_RETENTION_SECONDS": 7 * 24 * 3600,
+        "PARSE_WORKERS": min(4, os.cpu_count() or 1),
+        "PARSE_TIMEOUT": 60,
+        # 日志扫描模式: auto (新增内容超过阈值时使用 mmap) / stream (按块读取) / mmap
+        "SCAN_MODE": "auto",
+        "MMAP_THRESHOLD_MB": 64,
+        # 日志目录监听模式: auto (优先 inotify，不可用时轮询) / inotify / poll / off (每轮全量 listdir)
+        "WATCH_MODE": "auto",
+        # 日志无变化的板子扫描间隔逐次翻倍，最长 IDLE_REPARSE_SECONDS；已完成的板子每 FINISHED_REPARSE_SECONDS 复查一次
+        "IDLE_REPARSE_SECONDS": 60,
+        "FINISHED_REPARSE_SECONDS": 600,
+        # 调度循环的最短间隔（秒）：即将挂起的板子、上一轮超出预算的板子最快在这个间隔后扫描
+        "SCAN_MIN_INTERVAL": 5,
+        # 每轮解析预算：新增日志量（MB）和估算解析耗时（秒），超出的板子顺延到下一轮；0 表示不限制
+        "SCAN_BUDGET_MB": 256,
+        "SCAN_BUDGET_SECONDS": 15,
+        # 单条规则正则每次执行的时间上限（毫秒）：RULE_TIME_LIMIT_MS + 每 MB 新增日志 RULE_TIME_LIMIT_MS_PER_MB，
+        # 超时的规则被中断并跳过，直到规则更新
+        "RULE_TIME_LIMIT_MS": 2000,
+        "RULE_TIME_LIMIT_MS_PER_MB": 200,
+        # 同时监控多个用例目录: [{"case_dir": "...", "task_type": "循环启动任务", "rig_id": "Rig-01"}]
+        # 为空时启动后交互式选择一个目录；rig_id 省略时使用 RIG_ID 环境变量或默认台架名
+        "CASES": [],
+        "STATE_FILE": os.path.join(os.path.dirname(os.path.abspath(__file__)), "agent_state.json"),
+        # 离线上报队列目录及其大小上限、每批重放条数、最大重试间隔（秒）
+        "SPOOL_DIR": os.path.join(os.path.dirname(os.path.abspath(__file__)), "spool"),
+        "SPOOL_MAX_MB": 256,
+        "SPOOL_BATCH_SIZE": 50,
+        "SPOOL_MAX_BACKOFF": 300,
+        # 后台运行模式：不做任何交互，直接按 CASES 开始扫描（也可以用 --daemon 参数开启）
+        "DAEMON": False,
+        # 最近一次从后端获取的规则，启动时先用它开始扫描，再在后台刷新
+        "RULES_CACHE_FILE": os.path.join(os.path.dirname(os.path.abspath(__file__)), "agent_rules.json")
     }
+    config = default_config
     if os.path.exists(config_path):
         try:
             with open(config_path, "r") as f:
                 content = json.load(f)
-                return {**default_config, **content}
+                config = {**default_config, **content}
         except Exception as e:
             print(f"Warning: Failed to load config.json: {e}")
-    return default_config
+    # 环境变量 TITAN_<配置项> 覆盖配置文件，值按 JSON 解析（失败时作为字符串），便于由进程管理器批量启动
+    for key in default_config:
+        raw = os.environ.get(f"TITAN_{key}")
+        if raw is None:
+            continue
+        try:
+            config[key] = json.loads(raw)
+        except ValueError:
+            config[key] = raw
+    return config
 
 AGENT_CONFIG = load_config()
 BACKEND_URL = AGENT_CONFIG["BACKEND_URL"]
 SCAN_INTERVAL = AGENT_CONFIG["SCAN_INTERVAL"]
+HTTP_TIMEOUT = float(AGENT_CONFIG["HTTP_TIMEOUT"])
+HTTP_GZIP = bool(AGENT_CONFIG["HTTP_GZIP"])
+STATE_FILE = AGENT_CONFIG["STATE_FILE"]
+TEMP_WINDOW_MS = int(AGENT_CONFIG["TEMP_WINDOW_SECONDS"]) * 1000
+TEMP_RETENTION_MS = int(AGENT_CONFIG["TEMP_RETENTION_SECONDS"]) * 1000
+PARSE_WORKERS = int(AGENT_CONFIG["PARSE_WORKERS"])
+PARSE_TIMEOUT = float(AGENT_CONFIG["PARSE_TIMEOUT"])
+SCAN_MODE = AGENT_CONFIG["SCAN_MODE"]
+MMAP_THRESHOLD = {
+    "stream": None,
+    "mmap": 0
+}.get(SCAN_MODE, int(AGENT_CONFIG["MMAP_THRESHOLD_MB"] * 1024 * 1024))
+WATCH_MODE = AGENT_CONFIG["WATCH_MODE"]
+SPOOL_DIR = AGENT_CONFIG["SPOOL_DIR"]
+SPOOL_MAX_BYTES = int(AGENT_CONFIG["SPOOL_MAX_MB"] * 1024 * 1024)
+SPOOL_BATCH_SIZE = int(AGENT_CONFIG["SPOOL_BATCH_SIZE"])
+SPOOL_MAX_BACKOFF = float(AGENT_CONFIG["SPOOL_MAX_BACKOFF"])
+IDLE_REPARSE_SECONDS = float(AGENT_CONFIG["IDLE_REPARSE_SECONDS"])
+FINISHED_REPARSE_SECONDS = float(AGENT_CONFIG["FINISHED_REPARSE_SECONDS"])
+SCAN_MIN_INTERVAL = float(AGENT_CONFIG["SCAN_MIN_INTERVAL"])
+SCAN_BUDGET_BYTES = int(AGENT_CONFIG["SCAN_BUDGET_MB"] * 1024 * 1024)
+SCAN_BUDGET_MS = float(AGENT_CONFIG["SCAN_BUDGET_SECONDS"]) * 1000
+RULE_TIME_LIMIT_MS = float(AGENT_CONFIG["RULE_TIME_LIMIT_MS"])
+RULE_TIME_LIMIT_MS_PER_MB = float(AGENT_CONFIG["RULE_TIME_LIMIT_MS_PER_MB"])
+CASES = AGENT_CONFIG["CASES"]
+DAEMON = bool(AGENT_CONFIG["DAEMON"])
+RULES_CACHE_FILE = AGENT_CONFIG["RULES_CACHE_FILE"]
+
+
+def print_banner():
+    print(f"🚀 Titan Node Agent v{AGENT_VERSION} - 启动中...")
+    print(f"📅 启动时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("=" * 60)
 
 TASK_TYPES = [
     "循环启动任务",
     "固定时长任务"
 ]
 
-class LogPair:
-    def __init__(self, task_desc: str):
-        self.task_desc = task_desc
-        self.kernel_file: Optional[str] = None
-        self.cm55_file: Optional[str] = None
-
 class Agent:
     def __init__(self):
         self.rig_id = os.environ.get("RIG_ID", "Rig-01")
         self.root_dir = ""
         self.selected_case_dir = ""
         self.selected_task_type = ""
-        self.log_pairs: Dict[str, LogPair] = {}
         # 状态追踪：记录每个板子的上一次 Loop 编号
         self.prev_loops: Dict[str, int] = {}
         # 规则配置缓存
         self.rules_cache: Dict[str, dict] = {}
-        self.last_rules_update: float = 0
+        # 每个任务类型已缓存规则的版本、ETag 和内容指纹（指纹每个规则版本只计算一次）
+        self.rules_versions: Dict[str, str] = {}
+        self.rules_etags: Dict[str, str] = {}
+        self.rules_fingerprints: Dict[str, str] = {}
+        # 每个任务类型规则的最近更新时间
+        self.rules_updated_at: Dict[str, float] = {}
         self.rules_update_interval = 300  # 5分钟更新一次规则
+        # 规则在后台线程中刷新，扫描循环在每轮开始时取一份规则及其指纹的快照
+        self.rules_lock = threading.Lock()
+        self.rules_refreshing: set = set()
+        # 按板子并行解析
+        self.parse_pool = ParsePool(PARSE_WORKERS, PARSE_TIMEOUT)
+        # 被监控的用例目录，以及各台架的上报通道（多个目录可以上报到同一个台架）
+        self.cases: List[CaseMonitor] = []
+        self.rigs: Dict[str, RigChannel] = {}
+        # 已提示过编号冲突的 (台架, 板子)
+        self.board_conflicts: set = set()
+        # 日志读取游标：只解析新追加的内容，重启后从上次位置继续
+        self.cursors = CursorStore(STATE_FILE)
+        # 与后端的长连接传输层
+        self.transport = Transport(BACKEND_URL, timeout=HTTP_TIMEOUT, compress=HTTP_GZIP)
+        # 后端不可达时的离线队列，由后台线程（使用独立连接）按顺序重放
+        self.spool = Spool(SPOOL_DIR, SPOOL_MAX_BYTES)
+        self.spool_sender = SpoolSender(
+            self.spool,
+            Transport(BACKEND_URL, timeout=HTTP_TIMEOUT, compress=HTTP_GZIP),
+            batch_size=SPOOL_BATCH_SIZE,
+            max_backoff=SPOOL_MAX_BACKOFF
+        )
 
     def interactive_setup(self):
         """交互式启动流程"""
@@ -97,27 +206,37 @@ class Agent:
         self.fetch_rules()
         return True
 
-    def fetch_rules(self):
+    def fetch_rules(self, task_type: Optional[str] = None):
         """从后端获取规则配置"""
+        task_type = task_type or self.selected_task_type
         try:
             # 对任务类型进行URL编码，解决中文字符问题
-            encoded_task_type = urllib.parse.quote(self.selected_task_type)
-            rules_url = BACKEND_URL.replace('/api/report', f'/api/rules/{encoded_task_type}')
-            response = requests.get(rules_url, timeout=10)
-            if response.status_code == 200:
+            encoded_task_type = urllib.parse.quote(task_type)
+            # 条件请求：规则未变化时后端返回 304，不重复下载
+            headers = {}
+            etag = self.rules_etags.get(task_type)
+            if etag and task_type in self.rules_cache:
+                headers["If-None-Match"] = etag
+            response = self.transport.get(f"/api/rules/{encoded_task_type}", headers=headers)
+            if response.status_code == 304:
+                self.rules_updated_at[task_type] = time.time()
+            elif response.status_code == 200:
                 rules_data = response.json()
-                self.rules_cache[self.selected_task_type] = rules_data['rules']
-                self.last_rules_update = time.time()
-                print(f"✅ 已获取 {self.selected_task_type} 规则配置 v{rules_data.get('version', 'unknown')}")
+                self.set_rules(task_type, rules_data['rules'], rules_data.get('version', 'unknown'),
+                               response.headers.get("ETag"))
+                self.rules_updated_at[task_type] = time.time()
+                print(f"✅ 已获取 {task_type} 规则配置 v{rules_data.get('version', 'unknown')}")
             else:
                 print(f"⚠️ 获取规则失败: HTTP {response.status_code}")
         except Exception as e:
             print(f"⚠️ 获取规则失败: {e}")
-            # 如果获取失败，使用默认规则
-            self._load_default_rules()
+            # 如果获取失败且没有已知规则（含本地缓存），使用默认规则
+            if task_type not in self.rules_cache:
+                self._load_default_rules(task_type)
 
-    def _load_default_rules(self):
+    def _load_default_rules(self, task_type: Optional[str] = None):
         """加载默认规则（作为后备）"""
+        task_type = task_type or self.selected_task_type
         default_rules = {
             "循环启动任务": {
                 "time_calculation": {
@@ -167,481 +286,402 @@ class Agent:
             }
         }
         
-        if self.selected_task_type in default_rules:
-            self.rules_cache[self.selected_task_type] = default_rules[self.selected_task_type]
-            print(f"✅ 已加载 {self.selected_task_type} 默认规则")
-
-    def get_current_rules(self) -> dict:
-        """获取当前任务类型的规则，定期更新"""
-        current_time = time.time()
-        
-        # 检查是否需要更新规则
-        if (current_time - self.last_rules_update > self.rules_update_interval or 
-            self.selected_task_type not in self.rules_cache):
-            self.fetch_rules()
-        
-        return self.rules_cache.get(self.selected_task_type, {})
+        if task_type in default_rules:
+            self.set_rules(task_type, default_rules[task_type], "default")
+            print(f"✅ 已加载 {task_type} 默认规则")
+
+    def set_rules(self, task_type: str, rules: dict, version: str, etag: Optional[str] = None):
+        """缓存一个规则版本；内容指纹在此计算一次，解析进程按指纹缓存编译后的模式"""
+        fingerprint = rules_fingerprint(task_type, rules)
+        with self.rules_lock:
+            self.rules_cache[task_type] = rules
+            self.rules_versions[task_type] = version
+            self.rules_fingerprints[task_type] = fingerprint
+            if etag:
+                self.rules_etags[task_type] = etag
+            else:
+                self.rules_etags.pop(task_type, None)
+        if version != "default":
+            self.save_rules_cache()
 
-    def scan_and_pair_logs(self):
-        """扫描选中的目录并进行日志配对"""
+    def load_rules_cache(self):
+        """加载上次从后端获取的规则，启动后无需等待后端即可开始扫描；规则视为已过期，首轮在后台刷新"""
         try:
-            all_files = os.listdir(self.selected_case_dir)
-        except Exception as e:
-            print(f"无法读取目录: {e}")
-            return {}
-            
-        pairs: Dict[str, LogPair] = {}
-
-        for f in all_files:
-            # 判定路径是否为文件
-            if not os.path.isfile(os.path.join(self.selected_case_dir, f)):
+            with open(RULES_CACHE_FILE, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return
+        for task_type, entry in cached.items():
+            if task_type in self.rules_cache:
                 continue
-
-            # 灵活匹配逻辑：
-            # CM55 匹配关键词: id + (下划线或横杠) + cm55 (忽略大小写)
-            # $ 用于确保匹配文件结尾部分
-            cm55_match = re.search(r'_(\d+)[-_]cm55(?:\.log)?$', f, re.IGNORECASE)
-            
-            # Kernel 匹配关键词: id + .log
-            kernel_match = re.search(r'_(\d+)\.log$', f)
-            
-            board_id = None
-            is_cm55 = False
-            
-            if cm55_match:
-                board_id = cm55_match.group(1)
-                is_cm55 = True
-            elif kernel_match:
-                # 注意：kernel 匹配应当排除已经符合 CM55 特征的文件
-                if not re.search(r'cm55', f, re.IGNORECASE):
-                    board_id = kernel_match.group(1)
-                    is_cm55 = False
-            
-            if board_id:
-                # 排除版本号干扰 (如 V2107)，逻辑：数字前不能紧接 V
-                if re.search(r'V' + board_id, f): 
-                    continue
-                
-                if board_id not in pairs:
-                    pairs[board_id] = LogPair(board_id)
-                
-                if is_cm55:
-                    pairs[board_id].cm55_file = f
-                else:
-                    pairs[board_id].kernel_file = f
-        
-        self.log_pairs = pairs
-        return pairs
-
-    def parse_logs(self, pair: LogPair):
-        """解析日志对并返回板子状态"""
-        board_id = pair.task_desc  # 现在 task_desc 就是 board_id
-        print(f"[🔍 {board_id}] 开始解析日志，任务类型: {self.selected_task_type}")
-        
-        status_data = {
-            "board_id": board_id,
-            "status": "Running",
-            "task_type": self.selected_task_type,
-            "temperature": 0.0,
-            "temp_min": 0.0,
-            "temp_max": 0.0,
-            "temp_ddr": 0.0,
-            "voltage": 0.0,
-            "start_time": "Unknown",
-            "elapsed_hours": 0.0,
-            "remaining_hours": 48.0,
-            "remaining_seconds": 0,
-            "last_kernel_log": "",
-            "current_loop": 0,
-            "total_loops": 0,  # 新增总循环次数
-            "is_hang": False,
-            "temp_warning": False,
-            "kernel_heartbeat": None,
-            "cm55_heartbeat": None,
-            "kernel_stream": [],
-            "temp_points": [],
-            "errors": []
-        }
-
-        # 1. 解析 CM55 日志获取全量温度历史
-        if pair.cm55_file:
-            path = os.path.join(self.selected_case_dir, pair.cm55_file)
             try:
-                # 从头开始读取全量日志以获取完整历史曲线
-                with open(path, "r", encoding='utf-8', errors='ignore') as f:
-                    full_content = f.read()
-                    
-                    # --- CM55 历史错误检测 ---
-                    print(f"[🔍 {board_id}] 开始CM55日志历史检测...")
-                    
-                    # 检查超温警告 (扫描全文)
-                    if "W/NO_TAG THM_INFO: warning:check_temp exceed!!!" in full_content:
-                        status_data["temp_warning"] = True
-                        if "超温警告" not in status_data["errors"]:
-                            status_data["errors"].append("超温警告")
-                        print(f"[❌ {board_id}] CM55历史日志中发现超温警告")
-                    
-                    # 提取最新心跳时间
-                    cm_ts_match = re.findall(r'\[(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})\]', full_content)
-                    if cm_ts_match:
-                        status_data["cm55_heartbeat"] = cm_ts_match[-1]
-
-                    # --- 改进：Agent 本地全量解析并抽样 ---
-                    # 匹配核心温度传感器 (排除硬件ADC、PMIC等)
-                    regex = re.compile(r'\[(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})\].*?\[(PVTC_TS_(?:SOC|DDR)_[^\]]+)\]\s*[:：]?\s*([-+]?\d*\.?\d+)\s*C')
-                    all_matches = regex.findall(full_content)
-                    
-                    raw_points = []
-                    sensor_history = {}  # 存储每个传感器的所有历史温度值
-                    sensor_latest = {}   # 仍然保留最后一次值用于仪表盘显示
-                    
-                    for timeStr, sensorName, valStr in all_matches:
-                        val = float(valStr)
-                        
-                        # 记录最后一次值用于仪表盘
-                        sensor_latest[sensorName] = val
-                        
-                        # 记录历史温度值用于计算最大最小值
-                        if sensorName not in sensor_history:
-                            sensor_history[sensorName] = []
-                        sensor_history[sensorName].append(val)
-                        
-                        # 仅保留核心传感器的数据点用于绘图
-                        # 包含 CPU, DDR, SOC 以及 MIN 结尾的核心温度传感器
-                        if any(x in sensorName.upper() for x in ["CPU", "DDR", "SOC", "MIN"]) and "PVTC_TS_" in sensorName:
-                            try:
-                                dt = datetime.strptime(timeStr, "%Y-%m-%d %H:%M:%S")
-                                ts = int(dt.timestamp() * 1000)
-                                raw_points.append({"ts": ts, "name": sensorName.replace("PVTC_TS_", ""), "val": val})
-                            except ValueError:
-                                pass
-                    
-                    # 计算核心传感器的温度最大值和最小值
-                    if sensor_history:
-                        core_temps = []
-                        for sensor_name, temps in sensor_history.items():
-                            # 只计算核心传感器的温度统计
-                            if any(x in sensor_name.upper() for x in ["CPU", "DDR", "SOC", "MIN"]):
-                                core_temps.extend(temps)
-                        
-                        if core_temps:
-                            status_data["temp_min"] = min(core_temps)
-                            status_data["temp_max"] = max(core_temps)
-                            status_data["temperature"] = status_data["temp_min"]  # 使用历史最低温度作为主要显示值
-                        
-                        # 特别记录 DDR 细节 (TS1-6) - 只从核心传感器中获取
-                        core_ddr_sensors = {k: v for k, v in sensor_latest.items() if "DDR" in k.upper() and "PVTC_TS_" in k}
-                        if core_ddr_sensors:
-                            status_data["ddr_details"] = core_ddr_sensors
-                        else:
-                            status_data["ddr_details"] = {}
-                        
-                        # 兼容旧字段：查找 TS6_DDR 或主 DDR 温度 - 只从核心传感器中获取
-                        if core_ddr_sensors:
-                            ddr_val = max(core_ddr_sensors.values())
-                        else:
-                            ddr_val = 0.0
-                        status_data["temp_ddr"] = ddr_val
-
-                    # 收集温度曲线数据用于独立API - 按时间窗口计算
-                    temp_points = []
-                    if raw_points:
-                        # 按5分钟时间窗口分组计算温度统计
-                        time_windows = {}
-                        
-                        for point in raw_points:
-                            # 将时间戳向下取整到5分钟边界
-                            window_time = (point["ts"] // 300000) * 300000  # 5分钟 = 300000毫秒
-                            if window_time not in time_windows:
-                                time_windows[window_time] = []
-                            time_windows[window_time].append(point["val"])
-                        
-                        # 为每个时间窗口计算最高温、最低温和DDR温度
-                        for window_timestamp, temps in time_windows.items():
-                            max_temp = max(temps)
-                            min_temp = min(temps)
-                            
-                            # 查找该时间窗口的DDR温度
-                            ddr_temp = 0.0
-                            for point in raw_points:
-                                if abs(point["ts"] - window_timestamp) < 300000 and "DDR" in point["name"].upper():
-                                    ddr_temp = point["val"]
-                                    break
-                            
-                            temp_time = datetime.fromtimestamp(window_timestamp / 1000).isoformat()
-                            temp_points.append({
-                                "timestamp": temp_time,
-                                "max_temperature": max_temp,
-                                "min_temperature": min_temp,
-                                "ddr_temperature": ddr_temp
-                            })
-                        
-                        status_data["temp_points"] = temp_points
-                    else:
-                        status_data["temp_points"] = []
-
-            except Exception as e:
-                print(f"[❌ {board_id}] CM55 全量解析失败: {e}")
+                self.set_rules(task_type, entry["rules"], entry.get("version", "unknown"), entry.get("etag"))
+            except (KeyError, TypeError):
+                continue
+            print(f"📦 使用本地缓存的 {task_type} 规则 v{self.rules_versions[task_type]}")
+
+    def save_rules_cache(self):
+        with self.rules_lock:
+            cached = {
+                task_type: {
+                    "rules": rules,
+                    "version": self.rules_versions.get(task_type),
+                    "etag": self.rules_etags.get(task_type)
+                }
+                for task_type, rules in self.rules_cache.items()
+                if self.rules_versions.get(task_type) != "default"
+            }
+        tmp_path = RULES_CACHE_FILE + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(cached, f, ensure_ascii=False)
+            os.replace(tmp_path, RULES_CACHE_FILE)
+        except OSError as e:
+            print(f"⚠️ 保存规则缓存失败: {e}")
+
+    def rules_snapshot(self, task_type: str) -> tuple:
+        """规则及其指纹的一致快照 (rules, fingerprint)"""
+        with self.rules_lock:
+            rules = self.rules_cache.get(task_type, {})
+            fingerprint = self.rules_fingerprints.get(task_type)
+        return rules, fingerprint or rules_fingerprint(task_type, rules)
+
+    async def refresh_rules(self, task_type: str):
+        """规则过期时在后台线程中刷新，不阻塞本轮扫描；还没有任何规则时等待获取完成"""
+        if task_type not in self.rules_cache:
+            await asyncio.to_thread(self.get_current_rules, task_type)
+            return
+        if task_type in self.rules_refreshing:
+            return
+        if time.time() - self.rules_updated_at.get(task_type, 0) <= self.rules_update_interval:
+            return
+        self.rules_refreshing.add(task_type)
 
-        # 2. 解析 Kernel 日志
-        if pair.kernel_file:
-            path = os.path.join(self.selected_case_dir, pair.kernel_file)
+        async def refresh():
             try:
-                with open(path, "r", encoding='utf-8', errors='ignore') as f:
-                    # 获取开始时间
-                    first_line = f.readline()
-                    start_time_match = re.search(r'log (\d{4}\.\d{2}\.\d{2} \d{2}:\d{2}:\d{2})', first_line)
-                    if start_time_match:
-                        status_data["start_time"] = start_time_match.group(1).replace(".", "-")
-                        start_dt = datetime.strptime(status_data["start_time"], "%Y-%m-%d %H:%M:%S")
-
-                    # --- 全量历史错误检测（冷启动时重要）---
-                    print(f"[🔍 {board_id}] 开始全量历史错误检测...")
-                    f.seek(0)  # 回到文件开头
-                    full_kernel_content = f.read()
-                    
-                    # 获取当前规则进行历史检测
-                    rules = self.get_current_rules()
-                    if rules:
-                        # 检查所有错误模式
-                        error_patterns = rules.get("error_patterns", [])
-                        for error_rule in error_patterns:
-                            pattern = error_rule.get("pattern", "")
-                            name = error_rule.get("name", "Unknown Error")
-                            if pattern in full_kernel_content:
-                                status_data["status"] = "Error"
-                                if name not in status_data["errors"]:
-                                    status_data["errors"].append(name)
-                                print(f"[❌ {board_id}] 历史日志中发现错误: {name}")
-                        
-                        # 检查严重错误
-                        critical_keywords = rules.get("critical_keywords", ["KERNEL PANIC", "MACHINE CHECK", "REBOOTING", "OUT OF MEMORY", "SEGMENTATION FAULT"])
-                        if any(kw in full_kernel_content.upper() for kw in critical_keywords):
-                            status_data["status"] = "Error"
-                            critical_error = f"Critical error detected in history"
-                            if critical_error not in status_data["errors"]:
-                                status_data["errors"].append(critical_error)
-                            print(f"[❌ {board_id}] 历史日志中发现严重错误")
-                        
-                        # 循环任务检查脚本错误
-                        if self.selected_task_type == "循环启动任务":
-                            script_error_patterns = rules.get("script_error_patterns", [])
-                            for pattern in script_error_patterns:
-                                if re.search(pattern, full_kernel_content, re.IGNORECASE):
-                                    status_data["status"] = "Error"
-                                    if "Reboot Script Error" not in status_data["errors"]:
-                                        status_data["errors"].append("Reboot Script Error")
-                                    print(f"[❌ {board_id}] 历史日志中发现脚本错误")
-
-                    # 读取尾部内容进行实时分析
-                    f.seek(0, os.SEEK_END)
-                    f.seek(max(0, f.tell() - 30000)) # 增加读取量以确保覆盖100行
-                    tail = f.read()
-                    lines = tail.splitlines()
-                    status_data["last_kernel_log"] = lines[-1] if lines else ""
-                    # 移除kernel_stream上传以减少数据量
-                    # status_data["kernel_stream"] = lines[-100:] if len(lines) > 100 else lines
-
-                    # --- Hang & Heartbeat 检测 ---
-                    ts_matches = re.findall(r'\[(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})\]', tail)
-                    if ts_matches:
-                        last_ts = ts_matches[-1]
-                        status_data["kernel_heartbeat"] = last_ts
-                        last_log_dt = datetime.strptime(last_ts, "%Y-%m-%d %H:%M:%S")
-                        
-                        # 固定时长任务进度计算（如果还没匹配到 Seconds remaining，用时间估算作为保底）
-                        if start_time_match:
-                            elapsed = (last_log_dt - start_dt).total_seconds() / 3600
-                            status_data["elapsed_hours"] = round(min(48.0, elapsed), 2)
-                            status_data["remaining_hours"] = max(0, round(48.0 - elapsed, 2))
-                            if elapsed >= 48 and status_data["status"] != "Error":
-                                status_data["status"] = "Finished"
-
-                    # --- 使用动态规则进行检查 ---
-                    rules = self.get_current_rules()
-                    
-                    if not rules:
-                        print(f"[⚠️ {board_id}] 无可用规则，跳过解析")
-                        return status_data
-                    
-                    # 1. 时间计算规则
-                    time_rules = rules.get("time_calculation", {})
-                    if time_rules.get("method") == "reboot_script":
-                        # 循环启动任务：基于reboot脚本时间
-                        script_pattern = time_rules.get("script_pattern", r"\[(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})\].*bmx7_ddr_setup_reboot\.sh")
-                        reboot_script_matches = re.findall(script_pattern, tail)
-                        if reboot_script_matches:
-                            script_time_str = reboot_script_matches[-1]
-                            try:
-                                script_dt = datetime.strptime(script_time_str, "%Y-%m-%d %H:%M:%S")
-                                now = datetime.now()
-                                elapsed = (now - script_dt).total_seconds() / 3600
-                                total_hours = time_rules.get("total_hours", 48)
-                                
-                                status_data["elapsed_hours"] = round(min(total_hours, elapsed), 2)
-                                status_data["remaining_hours"] = max(0, round(total_hours - elapsed, 2))
-                                
-                                if elapsed >= total_hours and status_data["status"] != "Error":
-                                    status_data["status"] = "Finished"
-                            except ValueError:
-                                pass
-                        else:
-                            status_data["remaining_hours"] = time_rules.get("total_hours", 48)
-                            status_data["elapsed_hours"] = 0.0
-                            
-                    elif time_rules.get("method") == "remaining_seconds":
-                        # 固定时长任务：基于remaining seconds，使用全文搜索确保不遗漏
-                        pattern = time_rules.get("pattern", r"Log: Seconds remaining: (\d+)")
-                        # 使用全文内容搜索，而不是只搜索尾部
-                        rem_match = re.findall(pattern, full_kernel_content)
-                        if rem_match:
-                            remaining_sec = int(rem_match[-1])
-                            status_data["remaining_seconds"] = remaining_sec
-                            total_hours = time_rules.get("total_hours", 48)
-                            if remaining_sec == 0 and status_data["status"] != "Error":
-                                status_data["status"] = "Finished"
-                                status_data["elapsed_hours"] = total_hours
-                                status_data["remaining_hours"] = 0.0
-                            else:
-                                status_data["remaining_hours"] = round(remaining_sec / 3600.0, 2)
-                                status_data["elapsed_hours"] = round(total_hours - status_data["remaining_hours"], 2)
-                            print(f"[✅ {board_id}] 找到剩余时间: {remaining_sec}秒 ({status_data['remaining_hours']}小时)")
-                        else:
-                            print(f"[⚠️ {board_id}] 未找到Seconds remaining信息")
-
-                # 2. 循环检测规则（仅循环任务）
-                print(f"[🔍 {board_id}] 准备进行循环检测，任务类型: {self.selected_task_type}")
-                if self.selected_task_type == "循环启动任务":
-                    print(f"[🔍 {board_id}] 进入循环检测逻辑")
-                    print(f"[🔍 {board_id}] 当前rules keys: {list(rules.keys())}")
-                    loop_rules = rules.get("loop_detection", {})
-                    print(f"[🔍 {board_id}] loop_rules: {loop_rules}")
-                    if loop_rules:
-                        # 修正模式：Loop后面可能没有空格
-                        loop_pattern = loop_rules.get("pattern", r"BMX7 DDR Reboot Test: Loop(\d+)")
-                        # 使用全量历史日志检测循环次数
-                        loop_matches = re.findall(loop_pattern, full_kernel_content)
-                        print(f"[🔍 {board_id}] 循环匹配结果: {len(loop_matches)} 个")
-                        if len(loop_matches) > 0:
-                            print(f"[🔍 {board_id}] 前5个匹配: {loop_matches[:5]}")
-                            current_loop = int(loop_matches[-1])
-                            total_loops = max([int(loop) for loop in loop_matches])  # 获取最大循环次数
-                            status_data["current_loop"] = current_loop
-                            status_data["total_loops"] = total_loops  # 新增总循环次数
-                            print(f"[🔄 {board_id}] 检测到循环: {current_loop}/{total_loops}")
-                        else:
-                            print(f"[⚠️ {board_id}] 未找到循环信息，搜索关键词 'BMX7 DDR Reboot Test'")
-                            # 搜索包含关键词的行
-                            sample_lines = [line for line in full_kernel_content.split('\n') if 'BMX7 DDR Reboot Test' in line][:3]
-                            for line in sample_lines:
-                                print(f"[📝 {board_id}] 示例行: {line.strip()}")
-
-                    # 3. 错误模式检测
-                    error_patterns = rules.get("error_patterns", [])
-                    for error_rule in error_patterns:
-                        pattern = error_rule.get("pattern", "")
-                        name = error_rule.get("name", "Unknown Error")
-                        if pattern in tail:
-                            status_data["status"] = "Error"
-                            if name not in status_data["errors"]:
-                                status_data["errors"].append(name)
-
-                    # 4. 脚本错误检测（仅循环任务）
-                    if self.selected_task_type == "循环启动任务":
-                        script_error_patterns = rules.get("script_error_patterns", [])
-                        for pattern in script_error_patterns:
-                            if re.search(pattern, tail, re.IGNORECASE):
-                                status_data["status"] = "Error"
-                                if "Reboot Script Error" not in status_data["errors"]:
-                                    status_data["errors"].append("Reboot Script Error")
-
-                    # 5. 严重错误检测
-                    critical_keywords = rules.get("critical_keywords", ["KERNEL PANIC", "MACHINE CHECK", "REBOOTING", "OUT OF MEMORY", "SEGMENTATION FAULT"])
-                    if any(kw in tail.upper() for kw in critical_keywords):
-                        status_data["status"] = "Error"
-                        status_data["errors"].append(f"Critical error: {status_data['last_kernel_log']}")
-
-                    # 6. 挂起检测
-                    hang_rules = rules.get("hang_detection", {})
-                    threshold = hang_rules.get("threshold_seconds", 300)
-                    check_kernel = hang_rules.get("check_kernel", True)
-                    check_cm55 = hang_rules.get("check_cm55", True)
-                    
-                    now = datetime.now()
-                    if check_kernel and status_data.get("kernel_heartbeat"):
-                        k_dt = datetime.strptime(status_data["kernel_heartbeat"], "%Y-%m-%d %H:%M:%S")
-                        if (now - k_dt).total_seconds() > threshold and status_data["status"] not in ["Finished", "Error"]:
-                            status_data["is_hang"] = True
-                            status_data["status"] = "Error"
-                            if "Kernel Hang Detected (>5min)" not in status_data["errors"]:
-                                status_data["errors"].append("Kernel Hang Detected (>5min)")
-
-                    if check_cm55 and status_data.get("cm55_heartbeat"):
-                        c_dt = datetime.strptime(status_data["cm55_heartbeat"], "%Y-%m-%d %H:%M:%S")
-                        if (now - c_dt).total_seconds() > threshold and status_data["status"] not in ["Finished", "Error"]:
-                            status_data["status"] = "Error"
-                            if "CM55 Hang Detected (>5min)" not in status_data["errors"]:
-                                status_data["errors"].append("CM55 Hang Detected (>5min)")
+                await asyncio.to_thread(self.fetch_rules, task_type)
+            finally:
+                self.rules_refreshing.discard(task_type)
 
-            except Exception as e:
-                print(f"解析 Kernel 失败: {e}")
+        asyncio.get_running_loop().create_task(refresh())
+
+    def get_current_rules(self, task_type: Optional[str] = None) -> dict:
+        """获取任务类型的规则（默认为当前选择的任务类型），定期更新"""
+        task_type = task_type or self.selected_task_type
+        current_time = time.time()
+        
+        # 检查是否需要更新规则
+        if (current_time - self.rules_updated_at.get(task_type, 0) > self.rules_update_interval or
+            task_type not in self.rules_cache):
+            self.fetch_rules(task_type)
+        
+        return self.rules_cache.get(task_type, {})
+
+    def add_case(self, case_dir: str, task_type: str, rig_id: str) -> CaseMonitor:
+        scheduler = ScanScheduler(SCAN_INTERVAL, IDLE_REPARSE_SECONDS, FINISHED_REPARSE_SECONDS)
+        case = CaseMonitor(case_dir, task_type, rig_id, WATCH_MODE, scheduler)
+        self.cases.append(case)
+        if rig_id not in self.rigs:
+            self.rigs[rig_id] = RigChannel(rig_id)
+        return case
+
+    def setup_cases(self) -> bool:
+        """确定要监控的用例目录：配置了 CASES 时直接使用，否则走交互式启动流程（后台模式下直接报错）"""
+        if not CASES:
+            if DAEMON:
+                print("错误: 后台模式需要在 config.json 或 TITAN_CASES 环境变量中配置 CASES。")
+                return False
+            if not self.interactive_setup():
+                return False
+            self.add_case(self.selected_case_dir, self.selected_task_type, self.rig_id)
+            return True
+
+        for item in CASES:
+            case_dir = item.get("case_dir", "")
+            task_type = item.get("task_type", "")
+            rig_id = item.get("rig_id") or self.rig_id
+            if not os.path.isdir(case_dir):
+                print(f"错误: 路径 '{case_dir}' 不是一个有效的目录，已跳过。")
+                continue
+            if task_type not in TASK_TYPES:
+                print(f"错误: 未知的任务类型 '{task_type}'，已跳过 {case_dir}")
+                continue
+            # 日志游标按文件路径保存，同一个目录只能由一个用例监控
+            if any(os.path.abspath(c.case_dir) == os.path.abspath(case_dir) for c in self.cases):
+                print(f"错误: 路径 '{case_dir}' 重复配置，已跳过。")
+                continue
+            self.add_case(case_dir, task_type, rig_id)
+            print(f"📂 监控路径: {case_dir} | 任务类型: {task_type} | 台架: {rig_id}")
+        if not self.cases:
+            print("错误: CASES 中没有可用的用例目录。")
+            return False
+        return True
 
-        return status_data
+    def build_parse_job(self, pair: LogPair, rules: dict, case: Optional[CaseMonitor] = None,
+                        fingerprint: Optional[str] = None) -> dict:
+        """构建可在子进程中执行的解析任务（只包含可序列化的数据）"""
+        case = case or self.cases[0]
+        fingerprint = fingerprint or rules_fingerprint(case.task_type, rules)
+        job = {
+            "board_id": pair.task_desc,  # 现在 task_desc 就是 board_id
+            "task_type": case.task_type,
+            "rules": rules,
+            "rules_fingerprint": fingerprint,
+            "temp_window_ms": TEMP_WINDOW_MS,
+            "temp_retention_ms": TEMP_RETENTION_MS,
+            "mmap_threshold": MMAP_THRESHOLD,
+            "rule_time_limit_ms": RULE_TIME_LIMIT_MS,
+            "rule_time_limit_ms_per_mb": RULE_TIME_LIMIT_MS_PER_MB,
+            # 后端没有完整曲线时上报全量温度窗口，否则只上报有变化的窗口
+            "temp_full": pair.task_desc not in self.rigs[case.rig_id].temp_synced,
+            "kernel_path": None,
+            "cm55_path": None,
+            "cursors": {}
+        }
+        for key, filename in (("kernel_path", pair.kernel_file), ("cm55_path", pair.cm55_file)):
+            if filename:
+                cursor = self.cursors.get(os.path.join(case.case_dir, filename))
+                job[key] = cursor.path
+                job["cursors"][cursor.path] = cursor.to_dict()
+        return job
+
+    def apply_parse_result(self, result: dict) -> dict:
+        """写回解析后的游标并返回板子状态"""
+        for path, data in result["cursors"].items():
+            self.cursors.put(FileCursor.from_dict(path, data))
+        return result["status"]
+
+    def parse_logs(self, pair: LogPair, case: Optional[CaseMonitor] = None):
+        """解析日志对并返回板子状态（当前进程内执行）"""
+        if case is None and not self.cases:
+            self.add_case(self.selected_case_dir, self.selected_task_type, self.rig_id)
+        case = case or self.cases[0]
+        self.get_current_rules(case.task_type)
+        rules, fingerprint = self.rules_snapshot(case.task_type)
+        return self.apply_parse_result(parse_board(self.build_parse_job(pair, rules, case, fingerprint)))
 
     def run(self):
-        if not self.interactive_setup():
+        if DAEMON:
+            # 由进程管理器采集输出时按行刷新日志
+            sys.stdout.reconfigure(line_buffering=True)
+            if threading.current_thread() is threading.main_thread():
+                signal.signal(signal.SIGTERM, self._on_sigterm)
+        self.load_rules_cache()
+        if not self.setup_cases():
             return
-
+        self.cursors.load()
+        self.spool_sender.start()
+        try:
+            asyncio.run(self.run_async())
+        except KeyboardInterrupt:
+            print("🛑 Agent 正在退出...")
+        finally:
+            self.cursors.save()
+            self.parse_pool.shutdown()
+
+    def _on_sigterm(self, signum, frame):
+        # 退出过程中（保存游标等）不再被重复的 SIGTERM 打断
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        raise KeyboardInterrupt
+
+    async def run_async(self):
+        """所有用例目录共享一个事件循环、一个连接池、一个规则缓存和一个解析进程池"""
         while True:
-            pairs = self.scan_and_pair_logs()
-            # 调试：打印配对结果
-            for bid, p in pairs.items():
+            await self.run_cycle()
+            await asyncio.sleep(self.next_cycle_delay())
+
+    def next_cycle_delay(self) -> float:
+        """距离最早到期的板子还有多久，限制在 [SCAN_MIN_INTERVAL, SCAN_INTERVAL] 之间"""
+        wakeups = [w for w in (case.scheduler.next_wakeup() for case in self.cases) if w is not None]
+        if not wakeups:
+            return SCAN_INTERVAL
+        return min(SCAN_INTERVAL, max(SCAN_MIN_INTERVAL, min(wakeups) - time.time()))
+
+    def pending_bytes(self, case: CaseMonitor, pair: LogPair) -> int:
+        """板子日志中尚未解析的字节数"""
+        pending = 0
+        for filename in (pair.kernel_file, pair.cm55_file):
+            if not filename:
+                continue
+            cursor = self.cursors.get(os.path.join(case.case_dir, filename))
+            try:
+                pending += max(0, os.path.getsize(cursor.path) - cursor.offset)
+            except OSError:
+                pass
+        return pending
+
+    async def run_cycle(self):
+        # 每个台架一份本轮指标，随上报发送
+        cycle = {rig_id: CycleMetrics() for rig_id in self.rigs}
+        stage_started = time.perf_counter()
+
+        def end_stage(name: str):
+            nonlocal stage_started
+            ms = (time.perf_counter() - stage_started) * 1000
+            for metrics in cycle.values():
+                metrics.add_stage(name, ms)
+            stage_started = time.perf_counter()
+
+        # 各任务类型的规则并发刷新，每轮只获取一次；已有规则（含本地缓存）时在后台刷新，本轮直接使用
+        task_types = sorted({case.task_type for case in self.cases})
+        await asyncio.gather(*(self.refresh_rules(t) for t in task_types))
+        snapshots = {t: self.rules_snapshot(t) for t in task_types}
+        rules_by_type = {t: rules for t, (rules, _) in snapshots.items()}
+        # 各任务类型的挂起阈值（秒），调度器据此在心跳即将超时时安排扫描
+        hang_thresholds = {}
+        for task_type, rules in rules_by_type.items():
+            hang_rules = rules.get("hang_detection", {})
+            enabled = hang_rules.get("check_kernel", True) or hang_rules.get("check_cm55", True)
+            hang_thresholds[task_type] = hang_rules.get("threshold_seconds", 300) if enabled else None
+        end_stage("rules")
+
+        # 发现各目录的日志变化，汇总所有目录中到期的板子
+        candidates: List[ScanCandidate] = []
+        owners: Dict[str, tuple] = {}
+        now = time.time()
+        for case in self.cases:
+            pairs, changed = case.discover()
+            # 调试：打印有变化的配对结果
+            for bid in sorted(changed):
+                p = pairs[bid]
                 print(f"[{bid}] kernel={p.kernel_file is not None} cm55={p.cm55_file is not None} | cm55_file={p.cm55_file}")
-            board_statuses = []
-            temperature_reports = []  # 温度数据单独上报
-            for key, pair in pairs.items():
-                if pair.kernel_file or pair.cm55_file:
-                    status = self.parse_logs(pair)
-                    
-                    # 分离温度数据
-                    temp_data = {
-                        "rig_id": self.rig_id,
-                        "board_id": status["board_id"],
-                        "temp_points": status.pop("temp_points", []),  # 从主要状态中移除
-                        "temp_min": status["temp_min"],
-                        "temp_max": status["temp_max"],
-                        "current_temp": status["temperature"]
-                    }
-                    temperature_reports.append(temp_data)
-                    board_statuses.append(status)
-            
-            # 上报主要状态数据（不包含温度曲线）
-            report = {
-                "rig_id": self.rig_id,
-                "boards": board_statuses
-            }
-            
-            # 上报温度数据到独立API
-            if temperature_reports:
-                try:
-                    temp_url = BACKEND_URL.replace("/api/report", "/api/temperature")
-                    requests.post(temp_url, json={"temperature_data": temperature_reports})
-                    print(f"[{datetime.now()}] 上报温度数据: {len(temperature_reports)} 个板子")
-                except Exception as e:
-                    print(f"温度数据上报失败: {e}")
-            
+            rules, fingerprint = snapshots[case.task_type]
+            # 日志有变化的板子按扫描间隔解析；无变化的板子逐步退避，仍定期重新解析以刷新挂起检测
+            for priority, next_due, key in case.due_boards(changed, fingerprint, now):
+                job_key = case.job_key(key)
+                pending = self.pending_bytes(case, pairs[key])
+                candidates.append(ScanCandidate(priority, next_due, job_key, pending,
+                                                case.scheduler.estimate_ms(key, pending)))
+                owners[job_key] = (case, pairs[key], rules, fingerprint)
+        self.cursors.prune(path for case in self.cases for path in case.live_paths())
+
+        # 按优先级在本轮预算内选出要解析的板子，其余顺延到下一轮
+        selected = select_within_budget(candidates, SCAN_BUDGET_BYTES, SCAN_BUDGET_MS)
+        if len(selected) < len(candidates):
+            print(f"⏳ 本轮解析预算已用完，{len(candidates) - len(selected)} 块板子顺延到下一轮")
+        jobs = {
+            c.key: (lambda owner=owners[c.key]: self.build_parse_job(owner[1], owner[2], owner[0], owner[3]))
+            for c in selected
+        }
+        pending_by_key = {c.key: c.pending_bytes for c in candidates}
+        end_stage("discover")
+
+        # 所有目录的板子在同一个进程池中并行解析，不阻塞事件循环
+        results = await asyncio.to_thread(self.parse_pool.run, jobs)
+        end_stage("parse")
+
+        reports: Dict[str, tuple] = {rig_id: ([], []) for rig_id in self.rigs}
+        seen: Dict[str, set] = {rig_id: set() for rig_id in self.rigs}
+        parsed_rigs = set()
+        for case in self.cases:
+            board_statuses, temperature_reports = reports[case.rig_id]
+            for key, pair in case.log_pairs.items():
+                if not (pair.kernel_file or pair.cm55_file):
+                    continue
+                conflict = key in seen[case.rig_id]
+                if conflict and (case.rig_id, key) not in self.board_conflicts:
+                    self.board_conflicts.add((case.rig_id, key))
+                    print(f"⚠️ 台架 {case.rig_id} 的多个目录中都有板子 {key}，仅上报第一个目录中的板子 ({case.case_dir} 已忽略)")
+                seen[case.rig_id].add(key)
+
+                result = results.get(case.job_key(key))
+                if result is None:
+                    # 解析超时、失败或日志无变化：沿用上次状态，不阻塞其它板子上报
+                    if key in case.last_statuses and not conflict:
+                        board_statuses.append(case.last_statuses[key])
+                    continue
+                status = self.apply_parse_result(result)
+                metrics = result.get("metrics")
+                cycle[case.rig_id].add_board(key, metrics)
+                parsed_rigs.add(case.rig_id)
+                case.scheduler.on_parsed(
+                    key, status, pending_by_key.get(case.job_key(key), 0),
+                    sum(metrics["ms"].values()) if metrics else None,
+                    hang_thresholds[case.task_type]
+                )
+                if conflict:
+                    case.last_statuses[key] = status
+                    continue
+
+                # 分离温度数据
+                temp_data = {
+                    "rig_id": case.rig_id,
+                    "board_id": status["board_id"],
+                    "temp_points": status.pop("temp_points", []),  # 从主要状态中移除
+                    "incremental": status.pop("temp_incremental", False),
+                    "temp_min": status["temp_min"],
+                    "temp_max": status["temp_max"],
+                    "current_temp": status["temperature"]
+                }
+                temperature_reports.append(temp_data)
+                board_statuses.append(status)
+                case.last_statuses[key] = status
+        if results:
+            self.cursors.save()
+        end_stage("collect")
+
+        for case in self.cases:
+            cycle[case.rig_id].rules[case.task_type] = self.rules_versions.get(case.task_type)
+        for rig_id, metrics in cycle.items():
+            # 上报耗时只能在下一轮的指标中体现
+            metrics.add_stage("upload", self.rigs[rig_id].last_upload_ms)
+
+        # 有板子被解析的台架立即上报，其余台架至少每个 SCAN_INTERVAL 上报一次保持在线；各台架并发上报，共享同一个连接池
+        now = time.time()
+        due_rigs = [
+            rig_id for rig_id in reports
+            if rig_id in parsed_rigs or now - self.rigs[rig_id].last_report_at >= SCAN_INTERVAL
+        ]
+        for rig_id in due_rigs:
+            self.rigs[rig_id].last_report_at = now
+        await asyncio.gather(*(
+            asyncio.to_thread(self.report, self.rigs[rig_id], *reports[rig_id], cycle[rig_id].to_dict())
+            for rig_id in due_rigs
+        ))
+
+    def report(self, rig: RigChannel, board_statuses: List[dict], temperature_reports: List[dict],
+               agent_metrics: Optional[dict] = None):
+        """上报一个台架本轮的数据；后端不可达或离线队列尚未重放完时写入离线队列，保证按顺序送达"""
+        # 离线重放中后端缺少历史曲线的板子，下一轮全量重传
+        rig.temp_synced.difference_update(self.spool_sender.pop_temperature_resync(rig.rig_id))
+
+        if self.spool.empty():
+            # 状态与温度数据一次往返上报
+            started = time.perf_counter()
             try:
-                requests.post(BACKEND_URL, json=report)
-                print(f"[{datetime.now()}] 上报状态数据: {len(board_statuses)} 个板子已在线 (任务: {self.selected_task_type})。")
+                delta = rig.board_delta.build(board_statuses) if self.transport.ingest_supported else None
+                result = self.transport.ingest(rig.rig_id, board_statuses, temperature_reports, delta, agent_metrics)
+                rig.last_upload_ms = (time.perf_counter() - started) * 1000
+                print(f"[{datetime.now()}] [{rig.rig_id}] 上报状态数据: {len(board_statuses)} 个板子已在线, 温度数据: {len(temperature_reports)} 个板子。")
+                if self.transport.ingest_supported:
+                    rig.board_delta.ack(result)
+                    rig.temp_synced.update(t["board_id"] for t in temperature_reports)
+                    # 后端缺少这些板子的历史曲线（如重启），下一轮全量重传
+                    rig.temp_synced.difference_update(result.get("temperature_resync", []))
+                return
             except Exception as e:
-                print(f"状态数据上报失败: {e}")
-            
-            time.sleep(SCAN_INTERVAL)
+                rig.last_upload_ms = (time.perf_counter() - started) * 1000
+                print(f"[{rig.rig_id}] 数据上报失败，写入离线队列: {e}")
+
+        # 队列中的记录都是全量板子状态；恢复直连后第一轮同样全量上报
+        rig.board_delta.fail()
+        self.spool.append({
+            "rig_id": rig.rig_id,
+            "boards": board_statuses,
+            "temperature_data": temperature_reports,
+            "agent_metrics": agent_metrics
+        })
+        # 温度增量按顺序重放后由后端合并，视为已同步
+        rig.temp_synced.update(t["board_id"] for t in temperature_reports)
+        self.spool_sender.notify()
 
 if __name__ == "__main__":
+    if "--daemon" in sys.argv[1:]:
+        DAEMON = True
+    print_banner()
     print(f"🎯 Titan Node Agent v{AGENT_VERSION} - 开始运行")
     print(f"🔧 硬件传感器过滤: 已启用 (排除ADC、PMIC等硬件监控)")
-    print(f"📊 温度数据采样: 5分钟时间窗口分组")
+    print(f"📊 温度数据采样: {TEMP_WINDOW_MS // 1000}秒时间窗口分组")
     print("=" * 60)
     agent = Agent()
     agent.run()
@@ -0,0 +1,258 @@
+"""Agent 日志解析吞吐量基准测试
+
+对每个日志规模在独立子进程中依次执行以下周期，报告吞吐量（MB/s）、各阶段耗时和峰值内存：
+
+- scan:    CaseMonitor.scan_and_pair_logs 全量扫描并配对目录
+- cold:    游标为空，全量解析全部历史日志
+- append:  每块板子追加 --append 字节后增量解析
+- idle:    日志无变化时重新解析（仅尾部分析）
+- restart: 从状态文件恢复游标后解析（模拟 Agent 重启）
+
+与 baseline.json 比较，吞吐量下降或耗时增加超过 --tolerance 时以非零状态码退出。
+
+用法:
+    python bench_parse.py --sizes 16MB,256MB,1GB
+    python bench_parse.py --save-baseline
+"""
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import re
+import sys
+import time
+from datetime import timedelta
+
+AGENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if AGENT_DIR not in sys.path:
+    sys.path.insert(0, AGENT_DIR)
+
+from log_generator import generate_case, parse_size  # noqa: E402
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+CYCLES = ["scan", "cold", "append", "idle", "restart"]
+# 这些周期以吞吐量衡量，其余周期以耗时衡量
+THROUGHPUT_CYCLES = {"cold", "append"}
+LOOP_RE = re.compile(rb"BMX7 DDR Reboot Test: Loop(\d+)")
+
+
+def _reset_peak_rss():
+    """Linux 下重置进程的峰值内存（VmHWM），使每个周期的峰值互不影响"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _prepare_case(workdir: str, size: int, boards: int, task_type: str, extra_files: int) -> str:
+    """生成（或复用已生成的）用例目录，并把被追加过的日志截回原始长度"""
+    case_dir = os.path.join(workdir, f"{task_type}-{boards}x{size}")
+    marker = os.path.join(case_dir, ".generated.json")
+    try:
+        with open(marker, "r", encoding="utf-8") as f:
+            sizes = json.load(f)
+        for path, length in sizes.items():
+            os.truncate(path, length)
+        return case_dir
+    except (OSError, ValueError):
+        pass
+
+    print(f"📝 生成测试日志: {boards} 块板子 x {size / 1024 / 1024:.0f}MB -> {case_dir}")
+    writers = generate_case(case_dir, boards, size, task_type, extra_files=extra_files)
+    sizes = {path: os.path.getsize(path) for w in writers for path in (w.kernel_path, w.cm55_path)}
+    with open(marker, "w", encoding="utf-8") as f:
+        json.dump(sizes, f)
+    return case_dir
+
+
+def run_scenario(case_dir: str, boards: int, task_type: str, append_bytes: int, scan_mode: str) -> dict:
+    """在当前（全新的）进程中对一个用例目录执行全部周期"""
+    import agent
+    from board_parser import parse_board
+    from log_generator import START_TIME, BoardLogWriter
+    from log_reader import find_last
+    from timestamps import last_timestamp, parse_timestamp
+    from metrics import peak_rss_kb
+
+    state_dir = os.path.join(case_dir, ".agent")
+    os.makedirs(state_dir, exist_ok=True)
+    state_file = os.path.join(state_dir, "agent_state.json")
+    if os.path.exists(state_file):
+        os.remove(state_file)
+    agent.STATE_FILE = state_file
+    agent.SPOOL_DIR = os.path.join(state_dir, "spool")
+    agent.MMAP_THRESHOLD = {"stream": None, "mmap": 0}.get(scan_mode, agent.MMAP_THRESHOLD)
+
+    def new_agent():
+        with contextlib.redirect_stdout(io.StringIO()):
+            a = agent.Agent()
+            a._load_default_rules(task_type)
+        a.rules_update_interval = float("inf")
+        a.rules_updated_at[task_type] = time.time()
+        return a, a.add_case(case_dir, task_type, a.rig_id)
+
+    def parse_cycle(a, case) -> dict:
+        """与 Agent.parse_logs 相同的解析路径，额外收集每块板子的解析指标"""
+        _reset_peak_rss()
+        started = time.perf_counter()
+        rules = a.get_current_rules(task_type)
+        stages, bytes_read, matches = {}, 0, 0
+        with contextlib.redirect_stdout(io.StringIO()):
+            for pair in case.scan_and_pair_logs().values():
+                result = parse_board(a.build_parse_job(pair, rules, case))
+                a.apply_parse_result(result)
+                metrics = result["metrics"]
+                bytes_read += metrics["bytes"]
+                matches += metrics["matches"]
+                for name, ms in metrics["ms"].items():
+                    stages[name] = stages.get(name, 0.0) + ms
+        save_started = time.perf_counter()
+        a.cursors.save()
+        stages["save"] = (time.perf_counter() - save_started) * 1000
+        elapsed = time.perf_counter() - started
+        return {
+            "ms": round(elapsed * 1000, 1),
+            "bytes": bytes_read,
+            "mb_s": round(bytes_read / 1024 / 1024 / elapsed, 1) if elapsed else None,
+            "matches": matches,
+            "stages": {name: round(ms, 1) for name, ms in stages.items()},
+            "peak_rss_kb": peak_rss_kb()
+        }
+
+    results = {}
+    a, case = new_agent()
+
+    _reset_peak_rss()
+    reps = 20
+    started = time.perf_counter()
+    for _ in range(reps):
+        with contextlib.redirect_stdout(io.StringIO()):
+            case.scan_and_pair_logs()
+    results["scan"] = {
+        "ms": round((time.perf_counter() - started) * 1000 / reps, 2),
+        "boards": len(case.log_pairs),
+        "peak_rss_kb": peak_rss_kb()
+    }
+
+    results["cold"] = parse_cycle(a, case)
+
+    # 模拟运行中的增长：每块板子从已有日志的最后时间和循环编号继续追加 append_bytes
+    for pair in case.log_pairs.values():
+        kernel_path = os.path.join(case_dir, pair.kernel_file)
+        last = last_timestamp(kernel_path)
+        loop = find_last(kernel_path, LOOP_RE)
+        writer = BoardLogWriter(case_dir, pair.task_desc, task_type, seed=1,
+                                start=parse_timestamp(last) + timedelta(seconds=1) if last else START_TIME,
+                                first_loop=int(loop.group(1)) if loop else 0)
+        writer.write(append_bytes * 3 // 4, append_bytes // 4, append=True)
+    results["append"] = parse_cycle(a, case)
+    results["idle"] = parse_cycle(a, case)
+
+    a.parse_pool.shutdown()
+    a, case = new_agent()
+    with contextlib.redirect_stdout(io.StringIO()):
+        a.cursors.load()
+    results["restart"] = parse_cycle(a, case)
+    a.parse_pool.shutdown()
+    return results
+
+
+def _run_isolated(args: tuple) -> dict:
+    return run_scenario(*args)
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """返回相对基线退化超过 tolerance 的指标 [(场景/周期, 当前值, 基线值, 单位)]"""
+    regressions = []
+    for key, current in results.items():
+        base = baseline.get(key)
+        if not base:
+            continue
+        cycle = key.rsplit("/", 1)[-1]
+        if cycle in THROUGHPUT_CYCLES:
+            if base.get("mb_s") and current.get("mb_s") is not None and current["mb_s"] < base["mb_s"] * (1 - tolerance):
+                regressions.append((key, current["mb_s"], base["mb_s"], "MB/s"))
+        elif base.get("ms") and current["ms"] > base["ms"] * (1 + tolerance) and current["ms"] - base["ms"] > 1:
+            # 毫秒级的抖动不计入退化
+            regressions.append((key, current["ms"], base["ms"], "ms"))
+    return regressions
+
+
+def print_table(results: dict):
+    print(f"{'场景/周期':<28}{'耗时(ms)':>12}{'MB/s':>10}{'峰值内存(MB)':>14}  阶段耗时(ms)")
+    for key, r in results.items():
+        rss = f"{r['peak_rss_kb'] / 1024:.0f}" if r.get("peak_rss_kb") else "-"
+        mb_s = r.get("mb_s")
+        stages = " ".join(f"{k}={v}" for k, v in r.get("stages", {}).items())
+        print(f"{key:<28}{r['ms']:>12}{mb_s if mb_s is not None else '-':>10}{rss:>14}  {stages}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Agent 日志解析吞吐量基准测试")
+    parser.add_argument("--sizes", default="16MB,128MB", help="每块板子的日志大小，逗号分隔，如 16MB,256MB,1GB")
+    parser.add_argument("--boards", type=int, default=4)
+    parser.add_argument("--task", default="循环启动任务", choices=["循环启动任务", "固定时长任务"])
+    parser.add_argument("--append", default="1MB", help="append 周期每块板子追加的日志量")
+    parser.add_argument("--scan-mode", default="auto", choices=["auto", "stream", "mmap"])
+    parser.add_argument("--extra-files", type=int, default=2000, help="目录中不属于任何板子的干扰文件数")
+    parser.add_argument("--workdir", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), ".data"),
+                        help="生成日志的目录，重复运行时复用")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true", help="把本次结果保存为新的基线")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="允许的退化比例，默认 20%%")
+    parser.add_argument("--json", help="把结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    results = {}
+    # 每个规模在独立的子进程中运行，峰值内存和编译缓存互不影响
+    ctx = multiprocessing.get_context("spawn")
+    for size_text in args.sizes.split(","):
+        size = parse_size(size_text)
+        case_dir = _prepare_case(args.workdir, size, args.boards, args.task, args.extra_files)
+        print(f"⏱️ 基准测试: {args.boards} 块板子 x {size_text.strip()} ({args.task}, {args.scan_mode})")
+        with ctx.Pool(1) as pool:
+            cycles = pool.apply(_run_isolated, ((case_dir, args.boards, args.task, parse_size(args.append), args.scan_mode),))
+        for cycle in CYCLES:
+            results[f"{args.boards}x{size_text.strip()}/{cycle}"] = cycles[cycle]
+
+    print()
+    print_table(results)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({
+                "machine": f"{platform.system()} {platform.machine()} / Python {platform.python_version()}",
+                "recorded_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "task_type": args.task,
+                "scan_mode": args.scan_mode,
+                "results": results
+            }, f, ensure_ascii=False, indent=2)
+        print(f"\n💾 基线已保存: {args.baseline}")
+        return
+
+    try:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    except (OSError, ValueError):
+        print("\nℹ️ 没有基线数据，使用 --save-baseline 记录一次")
+        return
+    regressions = compare(results, baseline.get("results", {}), args.tolerance)
+    print(f"\n对比基线 ({baseline.get('machine')}, {baseline.get('recorded_at')}):")
+    if not regressions:
+        print("✅ 没有超过阈值的性能退化")
+        return
+    for key, current, base, unit in regressions:
+        print(f"❌ {key}: {current} {unit} (基线 {base} {unit})")
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
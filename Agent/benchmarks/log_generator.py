@@ -0,0 +1,169 @@
+"""生成与台架格式一致的合成 Kernel / CM55 日志，用于解析性能基准测试
+
+用法:
+    python log_generator.py OUT_DIR --boards 4 --size 256MB --task 循环启动任务
+"""
+import argparse
+import os
+import random
+from datetime import datetime, timedelta
+from typing import Iterator, List
+
+# 每次写入磁盘的块大小，生成 GB 级日志时内存占用保持恒定
+WRITE_BLOCK_BYTES = 4 * 1024 * 1024
+# 相邻两行日志的时间间隔（秒）
+LINE_INTERVAL = 0.2
+START_TIME = datetime(2026, 1, 1, 8, 0, 0)
+
+# 常见的无关内核输出，占日志的绝大部分
+KERNEL_NOISE = [
+    "[{ts}] [  {up:>10.6f}] mmc0: new HS400 MMC card at address 0001",
+    "[{ts}] [  {up:>10.6f}] ddr_test: pattern 0x{word:08x} addr 0x{addr:010x} pass",
+    "[{ts}] [  {up:>10.6f}] usb 1-1: USB disconnect, device number {num}",
+    "[{ts}] [  {up:>10.6f}] thermal thermal_zone{num}: trip point updated",
+    "[{ts}] [  {up:>10.6f}] bmx7: memtester loop {num} bank {bank} ok",
+]
+CM55_NOISE = [
+    "[{ts}] I/NO_TAG PMIC_INFO: vbat={num}mV ibat={bank}mA",
+    "[{ts}] [PVTC_HW_ADC_{bank}] : {temp:.2f} C",
+    "[{ts}] I/NO_TAG THM_INFO: fan duty {num}%",
+]
+CM55_SENSORS = ["PVTC_TS_SOC_TS1", "PVTC_TS_SOC_TS2", "PVTC_TS_DDR_TS1", "PVTC_TS_DDR_TS3", "PVTC_TS_DDR_TS6"]
+# 低频注入的规则命中，确保匹配路径被真实执行
+KERNEL_EVENTS = [
+    "[{ts}] Error: Miscompare at 0x{addr:010x}",
+    "[{ts}] bmx7_ddr_setup_reboot.sh: Permission denied",
+]
+
+
+def parse_size(text: str) -> int:
+    """'64MB' / '1.5GB' / '512KB' / 纯数字（字节）转换为字节数"""
+    text = text.strip().upper()
+    for suffix, factor in (("GB", 1024 ** 3), ("MB", 1024 ** 2), ("KB", 1024), ("B", 1)):
+        if text.endswith(suffix):
+            return int(float(text[:-len(suffix)]) * factor)
+    return int(text)
+
+
+def _timestamps(start: datetime) -> Iterator[str]:
+    step = timedelta(seconds=LINE_INTERVAL)
+    current = start
+    while True:
+        yield current.strftime("%Y-%m-%d %H:%M:%S")
+        current += step
+
+
+def kernel_lines(rng: random.Random, task_type: str, event_every: int = 200000,
+                 start: datetime = START_TIME, first_loop: int = 0) -> Iterator[str]:
+    """无限产出 Kernel 日志行；从头生成时以包含启动时间的文件头行开始"""
+    if start == START_TIME:
+        yield f"Boot log {START_TIME.strftime('%Y.%m.%d %H:%M:%S')}"
+    remaining = 48 * 3600 - int((start - START_TIME).total_seconds() / LINE_INTERVAL / 5)
+    loop = first_loop
+    for i, ts in enumerate(_timestamps(start), 1):
+        up = i * LINE_INTERVAL
+        if task_type == "循环启动任务" and i % 5000 == 0:
+            loop += 1
+            yield f"[{ts}] BMX7 DDR Reboot Test: Loop{loop}"
+            yield f"[{ts}] run bmx7_ddr_setup_reboot.sh"
+        elif task_type == "固定时长任务" and i % 5 == 0:
+            remaining = max(0, remaining - 1)
+            yield f"[{ts}] Log: Seconds remaining: {remaining}"
+        elif i % event_every == 0:
+            yield rng.choice(KERNEL_EVENTS).format(ts=ts, addr=rng.getrandbits(36))
+        else:
+            yield rng.choice(KERNEL_NOISE).format(
+                ts=ts, up=up, word=rng.getrandbits(32), addr=rng.getrandbits(36),
+                num=rng.randint(0, 99), bank=rng.randint(0, 7)
+            )
+
+
+def cm55_lines(rng: random.Random, start: datetime = START_TIME) -> Iterator[str]:
+    """无限产出 CM55 日志行：核心温度传感器读数与 PMIC/ADC 等干扰行交替出现"""
+    for i, ts in enumerate(_timestamps(start)):
+        if i % 3 == 0:
+            yield rng.choice(CM55_NOISE).format(ts=ts, num=rng.randint(0, 4200), bank=rng.randint(0, 7),
+                                                temp=rng.uniform(30, 60))
+        else:
+            sensor = CM55_SENSORS[i % len(CM55_SENSORS)]
+            base = 45.0 if "SOC" in sensor else 40.0
+            yield f"[{ts}] [{sensor}] : {base + rng.uniform(-5, 15):.2f} C"
+
+
+def write_lines(path: str, lines: Iterator[str], size: int, mode: str = "w") -> int:
+    """把 lines 写入 path，直到写满 size 字节（按整行截止），返回实际写入的字节数"""
+    written = 0
+    block: List[str] = []
+    block_bytes = 0
+    with open(path, mode, encoding="utf-8", newline="\n") as f:
+        for line in lines:
+            line += "\n"
+            block.append(line)
+            block_bytes += len(line.encode("utf-8"))
+            if written + block_bytes >= size or block_bytes >= WRITE_BLOCK_BYTES:
+                f.write("".join(block))
+                written += block_bytes
+                block, block_bytes = [], 0
+                if written >= size:
+                    break
+    return written
+
+
+class BoardLogWriter:
+    """一块板子的日志对；可以先生成历史内容，再多次追加模拟运行中的增长
+
+    start / first_loop 用于在已有日志之后继续生成，时间戳和循环编号与真实运行一样递增。
+    """
+
+    def __init__(self, directory: str, board_id: str, task_type: str, seed: int = 0, prefix: str = "DDR_Test",
+                 start: datetime = START_TIME, first_loop: int = 0):
+        self.kernel_path = os.path.join(directory, f"{prefix}_{board_id}.log")
+        self.cm55_path = os.path.join(directory, f"{prefix}_{board_id}_cm55.log")
+        rng = random.Random(f"{seed}:{board_id}")
+        self.kernel = kernel_lines(rng, task_type, start=start, first_loop=first_loop)
+        self.cm55 = cm55_lines(rng, start)
+
+    def write(self, kernel_bytes: int, cm55_bytes: int, append: bool = False) -> int:
+        mode = "a" if append else "w"
+        return (write_lines(self.kernel_path, self.kernel, kernel_bytes, mode) +
+                write_lines(self.cm55_path, self.cm55, cm55_bytes, mode))
+
+
+def generate_case(directory: str, boards: int, size: int, task_type: str = "循环启动任务",
+                  seed: int = 0, extra_files: int = 0) -> List[BoardLogWriter]:
+    """生成一个用例目录：boards 块板子，每块板子的 Kernel + CM55 日志合计约 size 字节
+
+    extra_files 个不属于任何板子的文件（固件包、带版本号的日志等）用于模拟真实目录中的干扰项。
+    """
+    os.makedirs(directory, exist_ok=True)
+    writers = []
+    for n in range(1, boards + 1):
+        writer = BoardLogWriter(directory, str(n), task_type, seed)
+        # Kernel 日志约占 3/4，CM55 温度日志约占 1/4
+        writer.write(size * 3 // 4, size // 4)
+        writers.append(writer)
+    for n in range(extra_files):
+        # 带版本号的日志（如 V2107）不应被识别为板子日志
+        name = f"Firmware_V{2100 + n}_{2100 + n}.log" if n % 2 else f"uart_dump_{n}.bin"
+        with open(os.path.join(directory, name), "w") as f:
+            f.write("noise\n")
+    return writers
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成合成台架日志")
+    parser.add_argument("out_dir")
+    parser.add_argument("--boards", type=int, default=4)
+    parser.add_argument("--size", default="64MB", help="每块板子的日志大小，如 64MB、1GB")
+    parser.add_argument("--task", default="循环启动任务", choices=["循环启动任务", "固定时长任务"])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--extra-files", type=int, default=0)
+    args = parser.parse_args()
+
+    size = parse_size(args.size)
+    generate_case(args.out_dir, args.boards, size, args.task, args.seed, args.extra_files)
+    print(f"✅ 已生成 {args.boards} 块板子的日志，每块约 {size / 1024 / 1024:.1f}MB: {args.out_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+from typing import Dict, List, Optional
+
+
+class BoardDelta:
+    """板子状态的增量上报
+
+    每轮只上报相对后端已确认状态发生变化的字段，并附带递增的序号（seq）。
+    后端发现序号不连续（丢包、后端重启）时在响应中返回 board_resync，
+    Agent 下一轮改为全量上报。首次上报和上报失败后同样全量上报。
+    """
+
+    def __init__(self):
+        self.seq = 0
+        # 后端已确认的各板子状态，key: board_id
+        self.acked: Dict[str, dict] = {}
+        # 本轮已发送、等待确认的状态
+        self.pending: Optional[Dict[str, dict]] = None
+        self.need_full = True
+
+    def build(self, boards: List[dict]) -> dict:
+        """生成本轮上报的 delta 字段：全量时由调用方携带 boards，增量时只携带 board_patches"""
+        self.seq += 1
+        current = {board["board_id"]: dict(board) for board in boards}
+        self.pending = current
+        if self.need_full:
+            return {"seq": self.seq, "full": True}
+
+        patches = {}
+        for board_id, board in current.items():
+            old = self.acked.get(board_id)
+            if old is None:
+                patches[board_id] = board
+                continue
+            diff = {k: v for k, v in board.items() if k not in old or old[k] != v}
+            if diff:
+                patches[board_id] = diff
+        return {
+            "seq": self.seq,
+            "full": False,
+            "board_patches": patches,
+            "removed_boards": [board_id for board_id in self.acked if board_id not in current]
+        }
+
+    def ack(self, response: dict):
+        """根据后端响应确认本轮上报；后端要求重传或不认识增量协议时下一轮全量上报"""
+        if response.get("board_resync", True):
+            self.need_full = True
+            return
+        self.acked = self.pending or {}
+        self.pending = None
+        self.need_full = False
+
+    def fail(self):
+        """上报失败：后端状态未知，下一轮全量上报"""
+        self.pending = None
+        self.need_full = True
@@ -0,0 +1,438 @@
+import hashlib
+import json
+import os
+import re
+import time
+from datetime import datetime
+from typing import Dict
+
+from log_reader import FileCursor
+from loop_tracker import LoopTracker
+from metrics import ParseMetrics
+from rule_guard import RULE_LOOP, RULE_REMAINING, RULE_SCRIPT_TIME, RuleGuard
+from rule_matcher import KIND_CRITICAL, KIND_ERROR, KIND_SCRIPT, RuleMatcher, encode_pattern
+from temperature import RETENTION_MS, TemperatureAggregator
+from timestamps import last_timestamp, parse_timestamp
+
+# --- 日志匹配模式 ---
+TIMESTAMP_PATTERN = r'\[(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})\]'
+CM55_TEMP_PATTERN = r'\[(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})\].*?\[(PVTC_TS_(?:SOC|DDR)_[^\]]+)\]\s*[:：]?\s*([-+]?\d*\.?\d+)\s*C'
+START_TIME_PATTERN = r'log (\d{4}\.\d{2}\.\d{2} \d{2}:\d{2}:\d{2})'
+TEMP_WARNING_KEYWORD = "W/NO_TAG THM_INFO: warning:check_temp exceed!!!"
+TIMESTAMP_RE = re.compile(TIMESTAMP_PATTERN)
+
+
+class CompiledPatterns:
+    """一份规则在 str 或 bytes 模式下编译好的全部匹配模式"""
+
+    def __init__(self, rules: dict, task_type: str, binary: bool):
+        def compile_(pattern: str):
+            return re.compile(encode_pattern(pattern, binary))
+
+        self.newline = encode_pattern("\n", binary)
+        self.timestamp = compile_(TIMESTAMP_PATTERN)
+        self.cm55_temp = compile_(CM55_TEMP_PATTERN)
+        self.start_time = compile_(START_TIME_PATTERN)
+        self.temp_warning = encode_pattern(TEMP_WARNING_KEYWORD, binary)
+        self.matcher = RuleMatcher(rules, include_script_errors=task_type == "循环启动任务", binary=binary)
+
+        time_rules = rules.get("time_calculation", {})
+        self.remaining = None
+        if time_rules.get("method") == "remaining_seconds":
+            self.remaining = compile_(time_rules.get("pattern", r"Log: Seconds remaining: (\d+)"))
+        loop_rules = rules.get("loop_detection", {})
+        self.loop = None
+        if task_type == "循环启动任务" and loop_rules:
+            self.loop = compile_(loop_rules.get("pattern", r"BMX7 DDR Reboot Test: Loop(\d+)"))
+
+
+# 每个进程内按规则指纹缓存编译结果，规则不变时不重复编译
+_compiled_patterns: Dict[tuple, CompiledPatterns] = {}
+
+
+def rules_fingerprint(task_type: str, rules: dict) -> str:
+    """规则内容指纹，用于判断历史扫描结论是否仍然有效"""
+    payload = json.dumps([task_type, rules], sort_keys=True, ensure_ascii=False)
+    return hashlib.md5(payload.encode("utf-8")).hexdigest()
+
+
+def get_patterns(fingerprint: str, rules: dict, task_type: str, binary: bool = False) -> CompiledPatterns:
+    key = (fingerprint, binary)
+    if key not in _compiled_patterns:
+        for stale in [k for k in _compiled_patterns if k[0] != fingerprint]:
+            del _compiled_patterns[stale]
+        _compiled_patterns[key] = CompiledPatterns(rules, task_type, binary)
+    return _compiled_patterns[key]
+
+
+def _text(value) -> str:
+    """mmap 模式下匹配结果是 bytes，只在需要时解码匹配到的片段"""
+    return value.decode("utf-8", errors="ignore") if isinstance(value, bytes) else value
+
+
+def parse_board(job: dict) -> dict:
+    """解析一块板子的日志对并返回板子状态及更新后的游标
+
+    job 只包含可序列化的数据（路径、规则、游标状态），可以在子进程中执行：
+    {board_id, task_type, rules, rules_fingerprint, temp_window_ms, temp_retention_ms,
+     kernel_path, cm55_path, cursors: {path: cursor_dict}}
+    可选的 rule_time_limit_ms / rule_time_limit_ms_per_mb 限制单条规则正则的执行时间。
+    """
+    cursors = {path: FileCursor.from_dict(path, data) for path, data in job["cursors"].items()}
+    metrics = ParseMetrics()
+    status_data = _parse_board(job, cursors, metrics)
+    return {
+        "board_id": job["board_id"],
+        "status": status_data,
+        "cursors": {path: cursor.to_dict() for path, cursor in cursors.items()},
+        "metrics": metrics.to_dict()
+    }
+
+
+def _parse_board(job: dict, cursors: Dict[str, FileCursor], metrics: ParseMetrics) -> dict:
+    board_id = job["board_id"]
+    task_type = job["task_type"]
+    rules = job["rules"]
+    print(f"[🔍 {board_id}] 开始解析日志，任务类型: {task_type}")
+
+    status_data = {
+        "board_id": board_id,
+        "status": "Running",
+        "task_type": task_type,
+        "temperature": 0.0,
+        "temp_min": 0.0,
+        "temp_max": 0.0,
+        "temp_ddr": 0.0,
+        "voltage": 0.0,
+        "start_time": "Unknown",
+        "elapsed_hours": 0.0,
+        "remaining_hours": 48.0,
+        "remaining_seconds": 0,
+        "last_kernel_log": "",
+        "current_loop": 0,
+        "total_loops": 0,  # 新增总循环次数
+        # 循环耗时与重启频率（循环启动任务）
+        "loop_started_at": None,
+        "last_loop_seconds": None,
+        "avg_loop_seconds": None,
+        "loops_per_hour": None,
+        "is_hang": False,
+        "temp_warning": False,
+        "kernel_heartbeat": None,
+        "cm55_heartbeat": None,
+        "kernel_stream": [],
+        "temp_points": [],
+        "errors": []
+    }
+
+    # 1. 增量解析 CM55 日志，温度统计由流式聚合器维护
+    if job.get("cm55_path"):
+        path = job["cm55_path"]
+        started = time.perf_counter()
+        try:
+            cursor = cursors[path]
+            cursor.refresh()
+            retention_ms = job.get("temp_retention_ms", RETENTION_MS)
+            aggregator = TemperatureAggregator.from_dict(cursor.state.get("temperature"), job["temp_window_ms"],
+                                                         retention_ms)
+            if aggregator is None:
+                # 窗口宽度配置变更，已聚合的窗口无法拆分，重新解析一次
+                print(f"[♻️ {board_id}] 温度窗口宽度已变更，重新解析CM55日志")
+                cursor.reset()
+                cursor.refresh()
+                aggregator = TemperatureAggregator(job["temp_window_ms"], retention_ms)
+            cm55_state = cursor.state
+            cm55_state.setdefault("temp_warning", False)
+            cm55_state.setdefault("heartbeat", None)
+            # 本次新内容在当前文件中的起始位置（含上次未完成的尾行），用于查找最新心跳
+            scan_from = cursor.offset - len(cursor.partial)
+
+            # --- CM55 增量错误检测：只处理上次偏移之后的新内容 ---
+            for buf, start, end in cursor.read_new_regions(job.get("mmap_threshold")):
+                patterns = get_patterns(job["rules_fingerprint"], rules, task_type, binary=not isinstance(buf, str))
+                metrics.bytes_read += end - start
+
+                # 检查超温警告
+                if not cm55_state["temp_warning"] and buf.find(patterns.temp_warning, start, end) >= 0:
+                    cm55_state["temp_warning"] = True
+                    print(f"[❌ {board_id}] CM55日志中发现超温警告")
+
+                # 匹配核心温度传感器 (排除硬件ADC、PMIC等)，只解码匹配到的字段
+                metrics.matches += aggregator.add_many(
+                    (_text(m.group(1)), _text(m.group(2)), float(m.group(3)))
+                    for m in patterns.cm55_temp.finditer(buf, start, end)
+                )
+
+            # 最新心跳时间：从文件末尾向前查找本次新内容中的最后一个时间戳，只读取末尾少量数据
+            heartbeat = last_timestamp(path, scan_from, cursor.offset)
+            if heartbeat:
+                cm55_state["heartbeat"] = heartbeat
+
+            if cm55_state["temp_warning"]:
+                status_data["temp_warning"] = True
+                if "超温警告" not in status_data["errors"]:
+                    status_data["errors"].append("超温警告")
+            status_data["cm55_heartbeat"] = cm55_state["heartbeat"]
+
+            # 核心传感器的温度最大值和最小值
+            core_range = aggregator.core_range()
+            if core_range:
+                status_data["temp_min"], status_data["temp_max"] = core_range
+                status_data["temperature"] = status_data["temp_min"]  # 使用历史最低温度作为主要显示值
+
+            if aggregator.sensor_latest:
+                # 特别记录 DDR 细节 (TS1-6) - 只从核心传感器中获取
+                core_ddr_sensors = aggregator.ddr_details()
+                status_data["ddr_details"] = core_ddr_sensors
+                # 兼容旧字段：查找 TS6_DDR 或主 DDR 温度
+                status_data["temp_ddr"] = max(core_ddr_sensors.values()) if core_ddr_sensors else 0.0
+
+            # 温度曲线数据用于独立API - 按时间窗口统计，默认只上报有变化的窗口
+            if job.get("temp_full", True):
+                status_data["temp_points"] = aggregator.points()
+                aggregator.drain_changed()
+            else:
+                status_data["temp_points"] = aggregator.drain_changed()
+                status_data["temp_incremental"] = True
+            cm55_state["temperature"] = aggregator.to_dict()
+
+        except Exception as e:
+            print(f"[❌ {board_id}] CM55 增量解析失败: {e}")
+        metrics.record("cm55", started)
+
+    # 2. 解析 Kernel 日志
+    if job.get("kernel_path"):
+        path = job["kernel_path"]
+        started = time.perf_counter()
+        try:
+            cursor = cursors[path]
+            cursor.refresh()
+
+            # 规则变更后历史结论不再可信，需要用新规则重新扫描一次
+            fingerprint = job["rules_fingerprint"]
+            if cursor.state.get("rules_fingerprint") != fingerprint:
+                if cursor.offset:
+                    print(f"[♻️ {board_id}] 规则已变更，重新扫描历史日志")
+                cursor.reset()
+                cursor.refresh()
+            kernel_state = cursor.state
+            kernel_state["rules_fingerprint"] = fingerprint
+            kernel_state.setdefault("start_time", None)
+            kernel_state.setdefault("errors", [])
+            kernel_state.setdefault("critical", False)
+            kernel_state.setdefault("script_error", False)
+            kernel_state.setdefault("remaining_seconds", None)
+            loops = LoopTracker.from_dict(kernel_state.get("loops") or {
+                # 旧版本的游标状态只记录了循环编号
+                "current": kernel_state.pop("current_loop", 0),
+                "max": kernel_state.pop("total_loops", 0)
+            })
+            # 超时的规则正则被跳过，直到规则变更
+            guard = RuleGuard(kernel_state.setdefault("slow_rules", {}),
+                              job.get("rule_time_limit_ms", 2000), job.get("rule_time_limit_ms_per_mb", 200))
+
+            time_rules = rules.get("time_calculation", {})
+            loop_rules = rules.get("loop_detection", {})
+
+            # --- 增量历史错误检测：只扫描上次偏移之后新追加的内容 ---
+            for buf, start, end in cursor.read_new_regions(job.get("mmap_threshold")):
+                patterns = get_patterns(fingerprint, rules, task_type, binary=not isinstance(buf, str))
+                metrics.bytes_read += end - start
+
+                # 获取开始时间（文件第一行）
+                if kernel_state["start_time"] is None:
+                    line_end = buf.find(patterns.newline, start, end)
+                    first_line = _text(buf[start:line_end if line_end >= 0 else end])
+                    start_time_match = get_patterns(fingerprint, rules, task_type).start_time.search(first_line)
+                    kernel_state["start_time"] = start_time_match.group(1).replace(".", "-") if start_time_match else ""
+
+                if not rules:
+                    continue
+
+                # 错误模式、严重错误、脚本错误由编译后的匹配器一次扫描完成
+                for hit in patterns.matcher.scan(buf, start, end, guard):
+                    metrics.matches += 1
+                    if hit.kind == KIND_ERROR and hit.name not in kernel_state["errors"]:
+                        kernel_state["errors"].append(hit.name)
+                        print(f"[❌ {board_id}] 历史日志中发现错误: {hit.name}")
+                    elif hit.kind == KIND_CRITICAL and not kernel_state["critical"]:
+                        kernel_state["critical"] = True
+                        print(f"[❌ {board_id}] 历史日志中发现严重错误")
+                    elif hit.kind == KIND_SCRIPT and not kernel_state["script_error"]:
+                        kernel_state["script_error"] = True
+                        print(f"[❌ {board_id}] 历史日志中发现脚本错误")
+
+                # 固定时长任务：记录最后一次 remaining seconds
+                if patterns.remaining is not None and guard.allowed(RULE_REMAINING):
+                    last = None
+                    with guard.run(RULE_REMAINING, end - start):
+                        for last in patterns.remaining.finditer(buf, start, end):
+                            metrics.matches += 1
+                    if last is not None:
+                        kernel_state["remaining_seconds"] = int(last.group(1))
+
+                # 循环任务：记录当前与最大循环次数，以及每次循环所在行的时间
+                if patterns.loop is not None and guard.allowed(RULE_LOOP):
+                    loop_matches = []
+                    with guard.run(RULE_LOOP, end - start):
+                        loop_matches.extend(patterns.loop.finditer(buf, start, end))
+                    for m in loop_matches:
+                        metrics.matches += 1
+                        line_start = buf.rfind(patterns.newline, start, m.start())
+                        ts = patterns.timestamp.search(buf, line_start + 1 if line_start >= 0 else start, m.start())
+                        loops.observe(int(m.group(1)), _text(ts.group(1)) if ts else None)
+            kernel_state["loops"] = loops.to_dict()
+
+            # 汇总历史检测结论
+            if kernel_state["start_time"]:
+                status_data["start_time"] = kernel_state["start_time"]
+                start_dt = parse_timestamp(status_data["start_time"])
+            for name in kernel_state["errors"]:
+                status_data["status"] = "Error"
+                if name not in status_data["errors"]:
+                    status_data["errors"].append(name)
+            if kernel_state["critical"]:
+                status_data["status"] = "Error"
+                status_data["errors"].append("Critical error detected in history")
+            if kernel_state["script_error"]:
+                status_data["status"] = "Error"
+                status_data["errors"].append("Reboot Script Error")
+
+            metrics.record("kernel_scan", started)
+            started = time.perf_counter()
+
+            # 读取尾部内容进行实时分析（固定大小，与文件总长度无关）
+            with open(path, "rb") as f:
+                f.seek(0, os.SEEK_END)
+                f.seek(max(0, f.tell() - 30000)) # 增加读取量以确保覆盖100行
+                tail_bytes = f.read()
+            metrics.bytes_read += len(tail_bytes)
+            tail = tail_bytes.decode("utf-8", errors="ignore")
+            lines = tail.splitlines()
+            status_data["last_kernel_log"] = lines[-1] if lines else ""
+            # 移除kernel_stream上传以减少数据量
+            # status_data["kernel_stream"] = lines[-100:] if len(lines) > 100 else lines
+
+            # --- Hang & Heartbeat 检测 ---
+            ts_matches = TIMESTAMP_RE.findall(tail)
+            if ts_matches:
+                last_ts = ts_matches[-1]
+                status_data["kernel_heartbeat"] = last_ts
+                last_log_dt = parse_timestamp(last_ts)
+
+                # 固定时长任务进度计算（如果还没匹配到 Seconds remaining，用时间估算作为保底）
+                if kernel_state["start_time"]:
+                    elapsed = (last_log_dt - start_dt).total_seconds() / 3600
+                    status_data["elapsed_hours"] = round(min(48.0, elapsed), 2)
+                    status_data["remaining_hours"] = max(0, round(48.0 - elapsed, 2))
+                    if elapsed >= 48 and status_data["status"] != "Error":
+                        status_data["status"] = "Finished"
+
+            # --- 使用动态规则进行检查 ---
+            if not rules:
+                print(f"[⚠️ {board_id}] 无可用规则，跳过解析")
+                metrics.record("tail", started)
+                return status_data
+
+            # 1. 时间计算规则
+            if time_rules.get("method") == "reboot_script":
+                # 循环启动任务：基于reboot脚本时间
+                script_pattern = time_rules.get("script_pattern", r"\[(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})\].*bmx7_ddr_setup_reboot\.sh")
+                reboot_script_matches = []
+                if guard.allowed(RULE_SCRIPT_TIME):
+                    with guard.run(RULE_SCRIPT_TIME, len(tail)):
+                        reboot_script_matches = re.findall(script_pattern, tail)
+                if reboot_script_matches:
+                    script_time_str = reboot_script_matches[-1]
+                    try:
+                        script_dt = parse_timestamp(script_time_str)
+                        now = datetime.now()
+                        elapsed = (now - script_dt).total_seconds() / 3600
+                        total_hours = time_rules.get("total_hours", 48)
+
+                        status_data["elapsed_hours"] = round(min(total_hours, elapsed), 2)
+                        status_data["remaining_hours"] = max(0, round(total_hours - elapsed, 2))
+
+                        if elapsed >= total_hours and status_data["status"] != "Error":
+                            status_data["status"] = "Finished"
+                    except ValueError:
+                        pass
+                else:
+                    status_data["remaining_hours"] = time_rules.get("total_hours", 48)
+                    status_data["elapsed_hours"] = 0.0
+
+            elif time_rules.get("method") == "remaining_seconds":
+                # 固定时长任务：基于remaining seconds，取增量扫描记录的最后一次值，确保不遗漏
+                remaining_sec = kernel_state["remaining_seconds"]
+                if remaining_sec is not None:
+                    status_data["remaining_seconds"] = remaining_sec
+                    total_hours = time_rules.get("total_hours", 48)
+                    if remaining_sec == 0 and status_data["status"] != "Error":
+                        status_data["status"] = "Finished"
+                        status_data["elapsed_hours"] = total_hours
+                        status_data["remaining_hours"] = 0.0
+                    else:
+                        status_data["remaining_hours"] = round(remaining_sec / 3600.0, 2)
+                        status_data["elapsed_hours"] = round(total_hours - status_data["remaining_hours"], 2)
+                    print(f"[✅ {board_id}] 找到剩余时间: {remaining_sec}秒 ({status_data['remaining_hours']}小时)")
+                else:
+                    print(f"[⚠️ {board_id}] 未找到Seconds remaining信息")
+
+            # 2. 循环检测规则（仅循环任务）
+            if task_type == "循环启动任务" and loop_rules:
+                if loops.current or loops.max:
+                    status_data["current_loop"] = loops.current
+                    status_data["total_loops"] = loops.max  # 新增总循环次数
+                    status_data.update(loops.summary())
+                    print(f"[🔄 {board_id}] 检测到循环: {status_data['current_loop']}/{status_data['total_loops']}")
+                else:
+                    print(f"[⚠️ {board_id}] 未找到循环信息，搜索关键词 'BMX7 DDR Reboot Test'")
+
+            # 3-6. 尾部检测与挂起检测只用于循环启动任务（固定时长任务只使用上面的历史检测结论）
+            if task_type == "循环启动任务":
+                # 3-5. 尾部错误模式、脚本错误、严重错误检测
+                for hit in get_patterns(fingerprint, rules, task_type).matcher.scan(tail, guard=guard):
+                    metrics.matches += 1
+                    status_data["status"] = "Error"
+                    if hit.kind == KIND_ERROR:
+                        if hit.name not in status_data["errors"]:
+                            status_data["errors"].append(hit.name)
+                    elif hit.kind == KIND_SCRIPT:
+                        if "Reboot Script Error" not in status_data["errors"]:
+                            status_data["errors"].append("Reboot Script Error")
+                    elif hit.kind == KIND_CRITICAL:
+                        critical_error = f"Critical error: {status_data['last_kernel_log']}"
+                        if critical_error not in status_data["errors"]:
+                            status_data["errors"].append(critical_error)
+
+                # 6. 挂起检测
+                hang_rules = rules.get("hang_detection", {})
+                threshold = hang_rules.get("threshold_seconds", 300)
+                check_kernel = hang_rules.get("check_kernel", True)
+                check_cm55 = hang_rules.get("check_cm55", True)
+
+                now = datetime.now()
+                if check_kernel and status_data.get("kernel_heartbeat"):
+                    k_dt = parse_timestamp(status_data["kernel_heartbeat"])
+                    if (now - k_dt).total_seconds() > threshold and status_data["status"] not in ["Finished", "Error"]:
+                        status_data["is_hang"] = True
+                        status_data["status"] = "Error"
+                        if "Kernel Hang Detected (>5min)" not in status_data["errors"]:
+                            status_data["errors"].append("Kernel Hang Detected (>5min)")
+
+                if check_cm55 and status_data.get("cm55_heartbeat"):
+                    c_dt = parse_timestamp(status_data["cm55_heartbeat"])
+                    if (now - c_dt).total_seconds() > threshold and status_data["status"] not in ["Finished", "Error"]:
+                        status_data["status"] = "Error"
+                        if "CM55 Hang Detected (>5min)" not in status_data["errors"]:
+                            status_data["errors"].append("CM55 Hang Detected (>5min)")
+
+            for rule in guard.flagged:
+                print(f"[⚠️ {board_id}] 规则 {rule} 执行超时 ({guard.slow_rules[rule]}ms)，在规则更新前跳过")
+            metrics.slow_rules = dict(guard.slow_rules)
+
+        except Exception as e:
+            print(f"解析 Kernel 失败: {e}")
+        metrics.record("tail", started)
+
+    return status_data
@@ -0,0 +1,95 @@
+from typing import Dict, List, Sequence
+
+# NumPy 为可选依赖，首次需要向量化时才导入（None: 尚未导入，False: 未安装，缺失时使用纯 Python 实现）
+_np = None
+
+# 批量读数达到该数量时使用 NumPy 向量化路径（冷启动追赶大段历史时）
+NUMPY_THRESHOLD = 50000
+
+# 每个窗口的统计量下标：[max, min, ddr, sum, count]
+MAX, MIN, DDR, SUM, COUNT = range(5)
+
+
+def _numpy():
+    global _np
+    if _np is None:
+        try:
+            import numpy
+            _np = numpy
+        except ImportError:
+            _np = False
+    return _np or None
+
+
+def bucket_readings(ts_ms: Sequence[int], vals: Sequence[float], is_ddr: Sequence[bool],
+                    window_ms: int) -> Dict[int, list]:
+    """单次遍历将温度读数按时间窗口分组
+
+    返回 {窗口起始时间戳(ms): [max, min, ddr, sum, count]}，
+    其中 ddr 为该窗口内最后一次 DDR 读数（窗口内没有 DDR 读数时为 None）。
+    """
+    if len(ts_ms) >= NUMPY_THRESHOLD and _numpy() is not None:
+        return _bucket_numpy(ts_ms, vals, is_ddr, window_ms)
+
+    buckets: Dict[int, list] = {}
+    for ts, val, ddr in zip(ts_ms, vals, is_ddr):
+        window = (ts // window_ms) * window_ms
+        bucket = buckets.get(window)
+        if bucket is None:
+            buckets[window] = [val, val, val if ddr else None, val, 1]
+            continue
+        if val > bucket[MAX]:
+            bucket[MAX] = val
+        if val < bucket[MIN]:
+            bucket[MIN] = val
+        if ddr:
+            bucket[DDR] = val
+        bucket[SUM] += val
+        bucket[COUNT] += 1
+    return buckets
+
+
+def _bucket_numpy(ts_ms, vals, is_ddr, window_ms) -> Dict[int, list]:
+    np = _numpy()
+    windows = (np.asarray(ts_ms, dtype=np.int64) // window_ms) * window_ms
+    values = np.asarray(vals, dtype=np.float64)
+    ddr_mask = np.asarray(is_ddr, dtype=bool)
+
+    # 稳定排序保证同一窗口内读数保持原始顺序，"最后一次 DDR 读数"语义不变
+    order = np.argsort(windows, kind="stable")
+    windows, values, ddr_mask = windows[order], values[order], ddr_mask[order]
+    keys, starts, counts = np.unique(windows, return_index=True, return_counts=True)
+
+    maxs = np.maximum.reduceat(values, starts)
+    mins = np.minimum.reduceat(values, starts)
+    sums = np.add.reduceat(values, starts)
+
+    # 每个窗口最后一个 DDR 读数：在 DDR 子集上取各窗口最后出现的位置
+    ddr_windows = windows[ddr_mask]
+    ddr_values = values[ddr_mask]
+    ddr_last: Dict[int, float] = {}
+    if len(ddr_windows):
+        rev_keys, rev_idx = np.unique(ddr_windows[::-1], return_index=True)
+        last_idx = len(ddr_windows) - 1 - rev_idx
+        ddr_last = dict(zip(rev_keys.tolist(), ddr_values[last_idx].tolist()))
+
+    return {
+        key: [mx, mn, ddr_last.get(key), sm, int(cnt)]
+        for key, mx, mn, sm, cnt in zip(keys.tolist(), maxs.tolist(), mins.tolist(), sums.tolist(), counts.tolist())
+    }
+
+
+def merge_buckets(target: Dict[int, list], batch: Dict[int, list]) -> List[int]:
+    """把一批窗口统计合并进已有统计，返回被修改的窗口"""
+    for window, new in batch.items():
+        old = target.get(window)
+        if old is None:
+            target[window] = list(new)
+            continue
+        old[MAX] = max(old[MAX], new[MAX])
+        old[MIN] = min(old[MIN], new[MIN])
+        if new[DDR] is not None:
+            old[DDR] = new[DDR]
+        old[SUM] += new[SUM]
+        old[COUNT] += new[COUNT]
+    return list(batch)
@@ -0,0 +1,95 @@
+import os
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from board_delta import BoardDelta
+from log_watcher import LogPair, LogWatcher, pair_log_entries, scan_log_entries
+from scheduler import ScanScheduler
+
+
+class CaseMonitor:
+    """一个被监控的用例目录：目录路径、任务类型、所属台架，以及该目录下各板子的解析进度"""
+
+    def __init__(self, case_dir: str, task_type: str, rig_id: str, watch_mode: str = "auto",
+                 scheduler: Optional[ScanScheduler] = None):
+        self.case_dir = case_dir
+        self.task_type = task_type
+        self.rig_id = rig_id
+        self.watch_mode = watch_mode
+        self.watcher: Optional[LogWatcher] = None
+        self.log_pairs: Dict[str, LogPair] = {}
+        # 每块板子最近一次成功解析的状态，解析超时或日志无变化时沿用
+        self.last_statuses: Dict[str, dict] = {}
+        # 每块板子的扫描计划
+        self.scheduler = scheduler or ScanScheduler()
+        # 上一轮解析所用规则的指纹，规则变化时所有板子重新解析
+        self.parsed_fingerprint: Optional[str] = None
+
+    def job_key(self, board_id: str) -> str:
+        """解析进程池中的任务 key，多个目录下可能有相同编号的板子"""
+        return f"{self.case_dir}#{board_id}"
+
+    def scan_and_pair_logs(self) -> Dict[str, LogPair]:
+        """全量扫描目录并进行日志配对"""
+        try:
+            pairs = pair_log_entries(scan_log_entries(self.case_dir))
+        except Exception as e:
+            print(f"无法读取目录: {e}")
+            return {}
+        self.log_pairs = pairs
+        return pairs
+
+    def discover(self) -> Tuple[Dict[str, LogPair], Set[str]]:
+        """返回当前的日志配对以及日志有变化的板子
+
+        watch_mode 为 off 时每轮全量扫描目录，所有板子都视为有变化。
+        """
+        if self.watch_mode == "off":
+            pairs = self.scan_and_pair_logs()
+            return pairs, set(pairs)
+        if self.watcher is None:
+            self.watcher = LogWatcher(self.case_dir, self.watch_mode)
+        pairs, changed = self.watcher.poll()
+        self.log_pairs = pairs
+        return pairs, changed
+
+    def live_paths(self):
+        for pair in self.log_pairs.values():
+            for filename in (pair.kernel_file, pair.cm55_file):
+                if filename:
+                    yield os.path.join(self.case_dir, filename)
+
+    def due_boards(self, changed: Set[str], fingerprint: str, now: Optional[float] = None) -> List[tuple]:
+        """本轮到期的板子 [(优先级, 到期时间, board_id)]，由调度器按日志变化、规则变化和各板子的扫描间隔决定"""
+        live = [key for key, pair in self.log_pairs.items() if pair.kernel_file or pair.cm55_file]
+        self.scheduler.forget(live)
+        if fingerprint != self.parsed_fingerprint:
+            for key in live:
+                self.scheduler.force(key)
+            self.parsed_fingerprint = fingerprint
+        for key in changed:
+            if key in self.log_pairs:
+                self.scheduler.mark_changed(key)
+        for key in list(self.last_statuses):
+            if key not in self.log_pairs:
+                self.last_statuses.pop(key, None)
+        return self.scheduler.due(live, time.time() if now is None else now)
+
+    def close(self):
+        if self.watcher is not None:
+            self.watcher.close()
+
+
+class RigChannel:
+    """一个台架的上报通道：多个用例目录可以上报到同一个台架，共享增量协议和温度同步状态"""
+
+    def __init__(self, rig_id: str):
+        self.rig_id = rig_id
+        # 后端已持有完整温度曲线的板子，这些板子只上报有变化的时间窗口
+        self.temp_synced: Set[str] = set()
+        # 板子状态只上报变化的字段
+        self.board_delta = BoardDelta()
+        # 上一轮上报的耗时（毫秒），计入下一轮的 agent_metrics
+        self.last_upload_ms = 0.0
+        # 最近一次上报的时间；没有板子被解析的轮次中，至少每个 SCAN_INTERVAL 上报一次保持在线
+        self.last_report_at = 0.0
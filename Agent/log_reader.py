@@ -0,0 +1,346 @@
+import gzip
+import hashlib
+import json
+import mmap
+import os
+import re
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# 每次从磁盘读取的块大小，限制单次解析的内存占用
+READ_CHUNK_SIZE = 4 * 1024 * 1024
+# 未换行的尾部残片上限，防止异常日志（无换行）无限占用内存
+MAX_PARTIAL_BYTES = 1024 * 1024
+# 用文件开头这么多字节的摘要识别同一段日志内容（轮转改名、压缩后仍可识别）
+HEAD_BYTES = 4096
+# 从文件末尾向前查找时每次读取的块大小
+REVERSE_BLOCK_SIZE = 64 * 1024
+# 相邻两块之间的重叠字节数，保证跨块的匹配（如时间戳）不被切断
+REVERSE_OVERLAP = 256
+
+
+def _open_segment(path: str):
+    """打开日志段；.gz 归档以流式方式解压，不落盘"""
+    return gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")
+
+
+def _head_digest(path: str, length: int) -> Optional[str]:
+    """日志段开头 length 字节的摘要，内容不足 length 字节或无法读取时返回 None"""
+    try:
+        with _open_segment(path) as f:
+            data = f.read(length)
+    except (OSError, EOFError):
+        return None
+    if len(data) < length:
+        return None
+    return hashlib.md5(data).hexdigest()
+
+
+def segment_id(path: str) -> Optional[str]:
+    """已轮转日志段的内容标识：开头至多 HEAD_BYTES 字节的摘要及长度，与文件名无关"""
+    try:
+        with _open_segment(path) as f:
+            data = f.read(HEAD_BYTES)
+    except (OSError, EOFError):
+        return None
+    return f"{hashlib.md5(data).hexdigest()}:{len(data)}"
+
+
+def find_rotated_segments(path: str) -> List[str]:
+    """查找日志文件被轮转出的历史段（如 x.log.1、x.log.2.gz、x.log-20260101.gz），按修改时间从旧到新排序"""
+    directory, name = os.path.split(path)
+    try:
+        names = os.listdir(directory or ".")
+    except OSError:
+        return []
+    segments = [
+        os.path.join(directory, n) for n in names
+        if n.startswith(name + ".") or n.startswith(name + "-")
+    ]
+
+    def mtime(segment: str) -> float:
+        try:
+            return os.path.getmtime(segment)
+        except OSError:
+            return 0.0
+
+    return sorted(segments, key=mtime)
+
+
+def find_last(path: str, pattern, start: int = 0, end: Optional[int] = None,
+              block_size: int = REVERSE_BLOCK_SIZE) -> Optional[re.Match]:
+    """从 end（默认文件末尾）向前按块查找 [start, end) 范围内 bytes 模式的最后一次匹配
+
+    匹配通常位于最后一块中，耗时与文件大小无关；范围内没有匹配时返回 None。
+    """
+    if end is not None and end <= start:
+        return None
+    try:
+        with open(path, "rb") as f:
+            if end is None:
+                end = f.seek(0, os.SEEK_END)
+            pos, carry = end, b""
+            while pos > start:
+                size = min(block_size, pos - start)
+                pos -= size
+                f.seek(pos)
+                data = f.read(size) + carry
+                last = None
+                for m in pattern.finditer(data):
+                    last = m
+                if last is not None:
+                    return last
+                carry = data[:REVERSE_OVERLAP]
+    except OSError:
+        pass
+    return None
+
+
+class FileCursor:
+    """单个日志文件的读取游标：字节偏移、inode、未完成的尾行以及检测器状态
+
+    日志被轮转（改名后新建、copytruncate 截断）或旧段被 gzip 压缩时，按文件开头的
+    内容摘要找到轮转出去的旧段，先读完上次偏移之后的剩余内容，再从头继续读新文件，
+    检测器状态保持不变。首次解析（或规则变更后重新解析）时，先按从旧到新的顺序
+    流式读取一遍已轮转的历史段（含 .gz），已读过的段记录在 archives 中，不会重复读取。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.offset = 0
+        self.inode: Optional[int] = None
+        self.partial = b""
+        # 检测器在该文件上累积的状态（错误、心跳、循环等），随游标一同持久化
+        self.state: dict = {}
+        # 当前文件开头 head_len 字节的摘要，用于在轮转后识别旧段
+        self.head: Optional[str] = None
+        self.head_len = 0
+        # 已读过的历史段标识（segment_id）
+        self.archives: List[str] = []
+        # 本次需要在读取当前文件之前读完的旧段: [(路径, 起始偏移, 未完成的尾行)]
+        self.pending: List[Tuple[str, int, bytes]] = []
+
+    def reset(self):
+        """回到文件开头重新解析（文件被替换且无法找回旧段、或规则变更）"""
+        self.offset = 0
+        self.inode = None
+        self.partial = b""
+        self.state = {}
+        self.head = None
+        self.head_len = 0
+        self.archives = []
+        self.pending = []
+
+    def refresh(self) -> bool:
+        """检查文件是否被轮转、替换或截断。返回当前文件是否需要从头读取"""
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return False
+
+        if self.inode is None and self.offset == 0:
+            # 首次解析：先读取已轮转的历史段
+            self._queue_archives()
+            self.inode = st.st_ino
+            return False
+
+        replaced = self.inode is not None and st.st_ino != self.inode
+        truncated = st.st_size < self.offset
+        rewritten = (not replaced and not truncated and self.head_len
+                     and _head_digest(self.path, self.head_len) != self.head)
+        if not (replaced or truncated or rewritten):
+            self.inode = st.st_ino
+            return False
+
+        previous = self._find_previous_segment()
+        if previous:
+            print(f"[♻️] 日志已轮转，先读完旧段 {os.path.basename(previous)} 再继续: {self.path}")
+            self.pending.append((previous, self.offset, self.partial))
+            sid = segment_id(previous)
+            if sid and sid not in self.archives:
+                self.archives.append(sid)
+        else:
+            print(f"[♻️] 日志文件被替换或截断，从头读取新内容: {self.path}")
+        self.offset = 0
+        self.partial = b""
+        self.head = None
+        self.head_len = 0
+        self.inode = st.st_ino
+        return True
+
+    def _queue_archives(self):
+        for segment in find_rotated_segments(self.path):
+            sid = segment_id(segment)
+            if sid and sid not in self.archives:
+                self.pending.append((segment, 0, b""))
+                self.archives.append(sid)
+
+    def _find_previous_segment(self) -> Optional[str]:
+        """按开头内容摘要找到当前读取位置所在的旧段（轮转后的新名字，可能已被压缩）"""
+        if not self.head_len:
+            return None
+        for segment in reversed(find_rotated_segments(self.path)):
+            if _head_digest(segment, self.head_len) == self.head:
+                return segment
+        return None
+
+    def _update_head(self, chunk: bytes, chunk_start: int):
+        """记录当前文件开头至多 HEAD_BYTES 字节的摘要"""
+        if self.head_len >= HEAD_BYTES or chunk_start > self.head_len:
+            return
+        length = min(HEAD_BYTES, chunk_start + len(chunk))
+        if length > self.head_len:
+            self.head_len = length
+            self.head = _head_digest(self.path, length)
+
+    def _drain_pending(self) -> Iterator[str]:
+        """流式读取旧段中尚未解析的内容（.gz 边解压边读，不落盘）"""
+        while self.pending:
+            path, offset, partial = self.pending.pop(0)
+            try:
+                with _open_segment(path) as f:
+                    if offset:
+                        # gzip 流不支持随机访问，按块跳过已解析的部分
+                        f.seek(offset)
+                    while True:
+                        chunk = f.read(READ_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        data = partial + chunk
+                        cut = data.rfind(b"\n")
+                        if cut < 0 and len(data) < MAX_PARTIAL_BYTES:
+                            partial = data
+                            continue
+                        if cut < 0:
+                            cut = len(data) - 1
+                        partial = data[cut + 1:]
+                        yield data[:cut + 1].decode("utf-8", errors="ignore")
+            except (OSError, EOFError) as e:
+                print(f"⚠️ 读取历史日志段失败 {path}: {e}")
+            # 旧段不会再增长，末尾没有换行的内容也是完整的一行
+            if partial:
+                yield partial.decode("utf-8", errors="ignore") + "\n"
+
+    def read_new(self) -> Iterator[str]:
+        """按块读取上次偏移之后新追加的完整行，尾部不完整的行留到下次"""
+        yield from self._drain_pending()
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            while True:
+                chunk = f.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                self._update_head(chunk, self.offset)
+                self.offset += len(chunk)
+
+                data = self.partial + chunk
+                cut = data.rfind(b"\n")
+                if cut < 0:
+                    if len(data) < MAX_PARTIAL_BYTES:
+                        self.partial = data
+                        continue
+                    cut = len(data) - 1
+                self.partial = data[cut + 1:]
+                yield data[:cut + 1].decode("utf-8", errors="ignore")
+
+    def read_new_regions(self, mmap_threshold: Optional[int] = None) -> Iterator[Tuple[object, int, int]]:
+        """以 (buf, start, end) 区间的形式产出新追加的完整行
+
+        待解析的新内容不少于 mmap_threshold 字节时（如冷启动追赶大日志），将文件
+        映射到内存并直接产出 mmap 上的区间，由调用方用 bytes 正则扫描，不做整段
+        解码和复制；否则按块读取并解码为 str。mmap_threshold 为 None 时不使用 mmap。
+        """
+        try:
+            pending = os.path.getsize(self.path) - self.offset
+        except OSError:
+            pending = 0
+        for text in self._drain_pending():
+            yield text, 0, len(text)
+        if mmap_threshold is None or pending <= 0 or pending < mmap_threshold:
+            for text in self.read_new():
+                yield text, 0, len(text)
+            return
+
+        with open(self.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            size = len(mm)
+            # 未完成的尾行仍在文件中，直接从它的起始位置开始扫描
+            start = self.offset - len(self.partial)
+            cut = mm.rfind(b"\n", start, size)
+            end = cut + 1 if cut >= 0 else start
+            if size - end >= MAX_PARTIAL_BYTES:
+                end = size
+            self._update_head(mm[self.offset:min(size, HEAD_BYTES)], self.offset)
+            self.partial = mm[end:size]
+            self.offset = size
+            if end > start:
+                yield mm, start, end
+
+    def to_dict(self) -> dict:
+        return {
+            "offset": self.offset,
+            "inode": self.inode,
+            # latin-1 可无损往返任意字节
+            "partial": self.partial.decode("latin-1"),
+            "state": self.state,
+            "head": self.head,
+            "head_len": self.head_len,
+            "archives": self.archives
+        }
+
+    @classmethod
+    def from_dict(cls, path: str, data: dict) -> "FileCursor":
+        cursor = cls(path)
+        cursor.offset = data.get("offset", 0)
+        cursor.inode = data.get("inode")
+        cursor.partial = data.get("partial", "").encode("latin-1")
+        cursor.state = data.get("state", {})
+        cursor.head = data.get("head")
+        cursor.head_len = data.get("head_len", 0)
+        cursor.archives = data.get("archives", [])
+        return cursor
+
+
+class CursorStore:
+    """所有日志游标的集合，持久化到本地状态文件，重启后可从上次位置继续"""
+
+    def __init__(self, state_file: str):
+        self.state_file = state_file
+        self.cursors: Dict[str, FileCursor] = {}
+
+    def get(self, path: str) -> FileCursor:
+        key = os.path.abspath(path)
+        if key not in self.cursors:
+            self.cursors[key] = FileCursor(key)
+        return self.cursors[key]
+
+    def put(self, cursor: FileCursor):
+        """写回在其它进程中推进过的游标"""
+        self.cursors[cursor.path] = cursor
+
+    def prune(self, live_paths: Iterable[str]):
+        """移除已不存在于监控目录中的文件游标"""
+        live = {os.path.abspath(p) for p in live_paths}
+        for key in list(self.cursors):
+            if key not in live:
+                del self.cursors[key]
+
+    def load(self):
+        if not os.path.exists(self.state_file):
+            return
+        try:
+            with open(self.state_file, "r", encoding="utf-8") as f:
+                raw = json.load(f)
+            self.cursors = {path: FileCursor.from_dict(path, item) for path, item in raw.items()}
+            print(f"✅ 已恢复 {len(self.cursors)} 个日志游标")
+        except Exception as e:
+            print(f"⚠️ 加载游标状态失败，将全量解析: {e}")
+            self.cursors = {}
+
+    def save(self):
+        """先写临时文件再原子替换，避免写到一半崩溃导致状态文件损坏"""
+        tmp_path = self.state_file + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({path: c.to_dict() for path, c in self.cursors.items()}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.state_file)
+        except Exception as e:
+            print(f"⚠️ 保存游标状态失败: {e}")
@@ -0,0 +1,227 @@
+import ctypes
+import ctypes.util
+import os
+import re
+import struct
+import sys
+from functools import lru_cache
+from typing import Dict, List, Optional, Set, Tuple
+
+# 灵活匹配逻辑：
+# CM55 匹配关键词: id + (下划线或横杠) + cm55 (忽略大小写)，$ 用于确保匹配文件结尾部分
+CM55_FILE_RE = re.compile(r'_(\d+)[-_]cm55(?:\.log)?$', re.IGNORECASE)
+# Kernel 匹配关键词: id + .log
+KERNEL_FILE_RE = re.compile(r'_(\d+)\.log$')
+CM55_WORD_RE = re.compile(r'cm55', re.IGNORECASE)
+
+# inotify 事件掩码（见 linux/inotify.h）
+IN_MODIFY = 0x00000002
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+# 文件增删改名：需要更新文件索引
+ENTRY_EVENTS = IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+# 事件丢失或目录本身被删除/移动：需要重新全量扫描
+RESCAN_EVENTS = IN_Q_OVERFLOW | IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class LogPair:
+    def __init__(self, task_desc: str):
+        self.task_desc = task_desc
+        self.kernel_file: Optional[str] = None
+        self.cm55_file: Optional[str] = None
+
+
+@lru_cache(maxsize=65536)
+def classify_log_file(name: str) -> Optional[Tuple[str, bool]]:
+    """根据文件名判断所属板子，返回 (board_id, is_cm55)；不是板子日志时返回 None"""
+    cm55_match = CM55_FILE_RE.search(name)
+    if cm55_match:
+        board_id, is_cm55 = cm55_match.group(1), True
+    else:
+        kernel_match = KERNEL_FILE_RE.search(name)
+        # 注意：kernel 匹配应当排除已经符合 CM55 特征的文件
+        if not kernel_match or CM55_WORD_RE.search(name):
+            return None
+        board_id, is_cm55 = kernel_match.group(1), False
+
+    # 排除版本号干扰 (如 V2107)，逻辑：数字前不能紧接 V
+    if "V" + board_id in name:
+        return None
+    return board_id, is_cm55
+
+
+def scan_log_entries(directory: str) -> Dict[str, Tuple[str, bool]]:
+    """列出目录中所有板子日志文件 {文件名: (board_id, is_cm55)}"""
+    entries = {}
+    for name in os.listdir(directory):
+        info = classify_log_file(name)
+        # 只对文件名匹配的条目做 stat，判定路径是否为文件
+        if info and os.path.isfile(os.path.join(directory, name)):
+            entries[name] = info
+    return entries
+
+
+def pair_log_entries(entries: Dict[str, Tuple[str, bool]]) -> Dict[str, LogPair]:
+    pairs: Dict[str, LogPair] = {}
+    for name in sorted(entries):
+        board_id, is_cm55 = entries[name]
+        if board_id not in pairs:
+            pairs[board_id] = LogPair(board_id)
+        if is_cm55:
+            pairs[board_id].cm55_file = name
+        else:
+            pairs[board_id].kernel_file = name
+    return pairs
+
+
+class _Inotify:
+    """通过 libc 的 inotify 接口监听单个目录（仅 Linux，无需第三方依赖）"""
+
+    def __init__(self, directory: str):
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify 仅支持 Linux")
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, os.strerror(errno))
+
+    def read_events(self) -> List[Tuple[str, int]]:
+        """非阻塞地取出所有待处理事件 [(文件名, mask)]"""
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                _, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b"\0")
+                offset += length
+                events.append((os.fsdecode(name), mask))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class LogWatcher:
+    """增量维护日志目录的板子配对，并报告哪些板子的日志发生了变化
+
+    - inotify 模式：由内核推送文件增删改事件，空闲周期不做任何 listdir/stat
+    - poll 模式：目录 mtime 变化时才重新 listdir；内容变化只对已配对的日志文件做 stat
+    mode 为 auto 时优先使用 inotify，不可用（非 Linux、句柄数超限等）时退回 poll。
+    """
+
+    def __init__(self, directory: str, mode: str = "auto"):
+        self.directory = directory
+        self.entries: Dict[str, Tuple[str, bool]] = {}
+        self.pairs: Dict[str, LogPair] = {}
+        self.dir_mtime: Optional[int] = None
+        # 已配对文件的 (inode, size, mtime)，poll 模式下用于判断内容是否变化
+        self.file_stats: Dict[str, tuple] = {}
+        self.need_rescan = True
+        self.inotify: Optional[_Inotify] = None
+        if mode in ("auto", "inotify"):
+            try:
+                self.inotify = _Inotify(directory)
+                print(f"👀 使用 inotify 监听日志目录: {directory}")
+            except (OSError, AttributeError) as e:
+                print(f"⚠️ inotify 不可用，改为轮询目录: {e}")
+
+    def poll(self) -> Tuple[Dict[str, LogPair], Set[str]]:
+        """返回当前的板子配对，以及自上次调用以来日志文件有变化的板子"""
+        changed: Set[str] = set()
+        entries_dirty = False
+        touched: Set[str] = set()
+
+        if self.inotify is not None:
+            for name, mask in self.inotify.read_events():
+                if mask & RESCAN_EVENTS:
+                    self.need_rescan = True
+                elif mask & ENTRY_EVENTS:
+                    entries_dirty |= self._update_entry(name)
+                    touched.add(name)
+                elif mask & IN_MODIFY:
+                    touched.add(name)
+        else:
+            try:
+                mtime = os.stat(self.directory).st_mtime_ns
+            except OSError as e:
+                print(f"无法读取目录: {e}")
+                return {}, set()
+            if mtime != self.dir_mtime:
+                self.dir_mtime = mtime
+                self.need_rescan = True
+
+        if self.need_rescan:
+            try:
+                self.entries = scan_log_entries(self.directory)
+            except OSError as e:
+                print(f"无法读取目录: {e}")
+                return {}, set()
+            self.need_rescan = False
+            entries_dirty = True
+
+        if entries_dirty:
+            old_pairs = self.pairs
+            self.pairs = pair_log_entries(self.entries)
+            for board_id, pair in self.pairs.items():
+                old = old_pairs.get(board_id)
+                if old is None or (old.kernel_file, old.cm55_file) != (pair.kernel_file, pair.cm55_file):
+                    changed.add(board_id)
+            paired = {name for pair in self.pairs.values() for name in (pair.kernel_file, pair.cm55_file) if name}
+            self.file_stats = {name: st for name, st in self.file_stats.items() if name in paired}
+
+        for board_id, pair in self.pairs.items():
+            for name in (pair.kernel_file, pair.cm55_file):
+                if not name:
+                    continue
+                if self.inotify is not None:
+                    if name in touched:
+                        changed.add(board_id)
+                elif self._stat_changed(name):
+                    changed.add(board_id)
+        return self.pairs, changed
+
+    def _update_entry(self, name: str) -> bool:
+        """按单个文件的增删事件更新索引，返回索引是否变化"""
+        info = classify_log_file(name)
+        if info and os.path.isfile(os.path.join(self.directory, name)):
+            if self.entries.get(name) == info:
+                return False
+            self.entries[name] = info
+            return True
+        return self.entries.pop(name, None) is not None
+
+    def _stat_changed(self, name: str) -> bool:
+        try:
+            st = os.stat(os.path.join(self.directory, name))
+            current = (st.st_ino, st.st_size, st.st_mtime_ns)
+        except OSError:
+            current = None
+        if self.file_stats.get(name) == current:
+            return False
+        self.file_stats[name] = current
+        return True
+
+    def close(self):
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
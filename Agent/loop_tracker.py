@@ -0,0 +1,98 @@
+from typing import List, Optional
+
+from timestamps import timestamp_ms
+
+# 保留最近多少次循环的起始时间，早于此的循环只计入汇总统计
+MAX_RECENT_LOOPS = 200
+
+
+class LoopTracker:
+    """循环启动任务的循环计数器
+
+    只消费新增日志中的 Loop 行，维护当前/最大循环编号以及每次循环的开始时间，
+    循环耗时和重启频率由累计统计直接得出，无需回扫历史日志。状态随游标持久化。
+    """
+
+    def __init__(self):
+        self.current = 0
+        self.max = 0
+        # 当前循环的开始时间（日志中的原始时间字符串）
+        self.started_at: Optional[str] = None
+        # 最近的循环 [[循环编号, 开始时间戳(ms)]]
+        self.recent: List[list] = []
+        # 相邻两次循环的间隔统计（毫秒），第一个有时间的循环开始时间
+        self.durations_ms = 0
+        self.durations_count = 0
+        self.last_duration_ms: Optional[int] = None
+        self.first_ms: Optional[int] = None
+        self.last_ms: Optional[int] = None
+
+    def observe(self, loop: int, time_str: Optional[str] = None):
+        """记录一行 Loop 日志；同一循环编号重复出现时只记第一次的时间"""
+        if loop > self.max:
+            self.max = loop
+        if self.recent and loop == self.current:
+            return
+        self.current = loop
+        self.started_at = time_str
+
+        ts = None
+        if time_str:
+            try:
+                ts = timestamp_ms(time_str)
+            except ValueError:
+                ts = None
+        if ts is not None:
+            if self.last_ms is not None and ts < self.last_ms:
+                # 时间倒退（重新开始测试或系统时间被修改）：重新开始统计
+                self.durations_ms, self.durations_count = 0, 0
+                self.last_duration_ms, self.first_ms, self.last_ms = None, None, None
+            if self.last_ms is not None:
+                self.last_duration_ms = ts - self.last_ms
+                self.durations_ms += self.last_duration_ms
+                self.durations_count += 1
+            if self.first_ms is None:
+                self.first_ms = ts
+            self.last_ms = ts
+        self.recent.append([loop, ts])
+        if len(self.recent) > MAX_RECENT_LOOPS:
+            del self.recent[:len(self.recent) - MAX_RECENT_LOOPS]
+
+    def summary(self) -> dict:
+        """循环耗时与重启频率：上一次循环耗时、平均循环耗时（秒）以及每小时循环次数"""
+        span_ms = (self.last_ms - self.first_ms) if self.first_ms is not None and self.last_ms is not None else 0
+        return {
+            "loop_started_at": self.started_at,
+            "last_loop_seconds": round(self.last_duration_ms / 1000, 1) if self.last_duration_ms is not None else None,
+            "avg_loop_seconds": round(self.durations_ms / self.durations_count / 1000, 1) if self.durations_count else None,
+            "loops_per_hour": round(self.durations_count * 3600000 / span_ms, 2) if span_ms > 0 else None
+        }
+
+    def to_dict(self) -> dict:
+        return {
+            "current": self.current,
+            "max": self.max,
+            "started_at": self.started_at,
+            "recent": self.recent,
+            "durations_ms": self.durations_ms,
+            "durations_count": self.durations_count,
+            "last_duration_ms": self.last_duration_ms,
+            "first_ms": self.first_ms,
+            "last_ms": self.last_ms
+        }
+
+    @classmethod
+    def from_dict(cls, data: Optional[dict]) -> "LoopTracker":
+        tracker = cls()
+        if not data:
+            return tracker
+        tracker.current = data.get("current", 0)
+        tracker.max = data.get("max", 0)
+        tracker.started_at = data.get("started_at")
+        tracker.recent = data.get("recent", [])
+        tracker.durations_ms = data.get("durations_ms", 0)
+        tracker.durations_count = data.get("durations_count", 0)
+        tracker.last_duration_ms = data.get("last_duration_ms")
+        tracker.first_ms = data.get("first_ms")
+        tracker.last_ms = data.get("last_ms")
+        return tracker
@@ -0,0 +1,88 @@
+import sys
+import time
+from typing import Dict, Optional
+
+try:
+    import resource  # 仅 Unix
+except ImportError:
+    resource = None
+
+
+def peak_rss_kb() -> Optional[int]:
+    """当前进程的峰值常驻内存（KB），无法获取时返回 None"""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOS 上单位是字节，Linux 上是 KB
+        return peak // 1024 if sys.platform == "darwin" else peak
+    try:
+        import psutil  # 可选依赖：Windows 下获取峰值内存，只在没有 resource 模块时导入
+    except ImportError:
+        return None
+    info = psutil.Process().memory_info()
+    return getattr(info, "peak_wset", info.rss) // 1024
+
+
+class ParseMetrics:
+    """一块板子一次解析的耗时、读取量和匹配数
+
+    各阶段耗时以毫秒累计：cm55（CM55 增量解析）、kernel_scan（Kernel 历史增量扫描）、
+    tail（尾部实时分析）。结果随 parse_board 的返回值带回主进程。
+    """
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+        self.bytes_read = 0
+        self.matches = 0
+        # 执行超时而被跳过的规则 {规则字段: 超时时的耗时(ms)}
+        self.slow_rules: Dict[str, float] = {}
+
+    def record(self, name: str, started: float):
+        """累计从 started（time.perf_counter() 的返回值）到现在的耗时"""
+        self.stages[name] = self.stages.get(name, 0.0) + (time.perf_counter() - started) * 1000
+
+    def to_dict(self) -> dict:
+        result = {
+            "ms": {name: round(ms, 1) for name, ms in self.stages.items()},
+            "bytes": self.bytes_read,
+            "matches": self.matches,
+            "rss_kb": peak_rss_kb()
+        }
+        if self.slow_rules:
+            result["slow_rules"] = self.slow_rules
+        return result
+
+
+class CycleMetrics:
+    """Agent 一轮扫描的汇总指标，以紧凑的 agent_metrics 块随每次上报发送"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.boards: Dict[str, dict] = {}
+        self.stages: Dict[str, float] = {}
+        # 本轮使用的规则版本 {task_type: version}，用于按规则对比解析耗时
+        self.rules: Dict[str, Optional[str]] = {}
+
+    def add_board(self, board_id: str, metrics: Optional[dict]):
+        if metrics:
+            self.boards[board_id] = metrics
+
+    def add_stage(self, name: str, ms: float):
+        self.stages[name] = round(self.stages.get(name, 0.0) + ms, 1)
+
+    def to_dict(self) -> dict:
+        rss = [m["rss_kb"] for m in self.boards.values() if m.get("rss_kb")]
+        agent_rss = peak_rss_kb()
+        if agent_rss:
+            rss.append(agent_rss)
+        return {
+            "cycle_ms": round((time.perf_counter() - self.started) * 1000, 1),
+            "stages": self.stages,
+            "rules": self.rules,
+            "bytes_read": sum(m.get("bytes", 0) for m in self.boards.values()),
+            "matches": sum(m.get("matches", 0) for m in self.boards.values()),
+            "peak_rss_kb": max(rss) if rss else None,
+            # 本轮有板子跳过的慢规则
+            "slow_rules": sorted({rule for m in self.boards.values() for rule in m.get("slow_rules", {})}),
+            # 只包含本轮实际解析的板子
+            "boards": self.boards
+        }
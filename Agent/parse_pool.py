@@ -0,0 +1,101 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, Optional
+
+from board_parser import parse_board
+
+
+class ParsePool:
+    """按板子并行解析日志的进程池
+
+    正则匹配是 CPU 密集型任务，受 GIL 限制，因此使用进程池。同时提交的任务不超过
+    workers 个，有空闲进程时才提交下一块板子，超时从板子开始解析时算起，排队中的板子
+    不会因前面的慢板子而超时。超时的板子不会阻塞本轮上报，其任务继续在后台执行（占用
+    一个进程），结果在下一轮收取；在此之前不会重复提交同一块板子。进程都被超时的任务
+    占用时，尚未开始的板子顺延到下一轮。workers <= 1 时在当前进程内顺序解析。
+    """
+
+    def __init__(self, workers: int, board_timeout: float):
+        self.workers = workers
+        self.board_timeout = board_timeout
+        self.executor: Optional[ProcessPoolExecutor] = None
+        # key: board_id，value: 尚未收取结果的任务
+        self.in_flight: Dict[str, Future] = {}
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self.executor
+
+    def run(self, jobs: Dict[str, Callable[[], dict]]) -> Dict[str, dict]:
+        """执行一轮解析
+
+        jobs 的 value 是延迟构建 job 的函数：只有真正提交时才读取最新的游标状态。
+        返回本轮拿到结果的板子 {board_id: parse_board 的返回值}，包括上一轮
+        超时、本轮才完成的板子；仍在执行中的板子不在返回值中。
+        """
+        results: Dict[str, dict] = {}
+
+        if self.workers <= 1:
+            for board_id, build_job in jobs.items():
+                try:
+                    results[board_id] = parse_board(build_job())
+                except Exception as e:
+                    print(f"[❌ {board_id}] 解析失败: {e}")
+            return results
+
+        # 先收取上一轮超时但已完成的任务，让本轮提交基于最新的游标
+        for board_id, future in list(self.in_flight.items()):
+            if future.done():
+                self.in_flight.pop(board_id, None)
+                self._collect(board_id, future, results)
+
+        executor = self._get_executor()
+        queue = [(board_id, build_job) for board_id, build_job in jobs.items()
+                 if board_id not in self.in_flight and board_id not in results]
+        # 本轮提交、尚未超时的任务，value: (future, 超时时刻)
+        running: Dict[str, tuple] = {}
+        while queue or running:
+            busy = sum(1 for future in self.in_flight.values() if not future.done())
+            while queue and busy < self.workers:
+                board_id, build_job = queue.pop(0)
+                future = self.in_flight[board_id] = executor.submit(parse_board, build_job())
+                running[board_id] = (future, time.monotonic() + self.board_timeout)
+                busy += 1
+            if not running:
+                # 进程都被之前超时的任务占用
+                print(f"[⏳] 解析进程都被超时的任务占用，{len(queue)} 块板子顺延到下一轮")
+                break
+            next_deadline = min(deadline for _, deadline in running.values())
+            wait([future for future, _ in running.values()],
+                 timeout=max(0.0, next_deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+            now = time.monotonic()
+            for board_id, (future, deadline) in list(running.items()):
+                if future.done():
+                    del running[board_id]
+                    self.in_flight.pop(board_id, None)
+                    self._collect(board_id, future, results)
+                elif now >= deadline:
+                    del running[board_id]
+                    print(f"[⏱️ {board_id}] 解析超时 (>{self.board_timeout}s)，本轮沿用上次状态")
+            if self.executor is None:
+                # 进程池已损坏（_collect 中关闭），其余板子下一轮重新提交
+                break
+        return results
+
+    def _collect(self, board_id: str, future: Future, results: Dict[str, dict]):
+        try:
+            results[board_id] = future.result()
+        except BrokenProcessPool as e:
+            # 子进程异常退出（如内存不足被杀），下一轮重建进程池
+            print(f"[❌ {board_id}] 解析进程异常退出: {e}")
+            self.shutdown()
+        except Exception as e:
+            print(f"[❌ {board_id}] 解析失败: {e}")
+
+    def shutdown(self):
+        self.in_flight.clear()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
@@ -0,0 +1,75 @@
+import signal
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List
+
+# 规则中用户提供的正则，以规则配置中的字段命名
+RULE_SCRIPT_ERRORS = "script_error_patterns"
+RULE_REMAINING = "time_calculation.pattern"
+RULE_SCRIPT_TIME = "time_calculation.script_pattern"
+RULE_LOOP = "loop_detection.pattern"
+
+
+class RuleTimeout(Exception):
+    pass
+
+
+def _on_alarm(signum, frame):
+    raise RuleTimeout
+
+
+def _can_interrupt() -> bool:
+    """只有 Unix 进程的主线程可以用定时器信号中断正在执行的正则（解析子进程满足该条件）"""
+    return hasattr(signal, "setitimer") and threading.current_thread() is threading.main_thread()
+
+
+class RuleGuard:
+    """限制单条规则正则的执行时间
+
+    灾难性回溯的正则可能在一块板子上卡住数小时。每次执行按处理的数据量给出时间上限：
+    base_ms + 每 MB ms_per_mb。能用定时器信号中断时超时立即中断；否则（Windows 或在
+    线程中解析）执行完成后按实际耗时判断。超时的规则记入 slow_rules（随游标状态持久化，
+    规则变更后随历史结论一起重置），此后跳过不再执行。
+    """
+
+    def __init__(self, slow_rules: Dict[str, float], base_ms: float = 2000, ms_per_mb: float = 200):
+        self.slow_rules = slow_rules
+        self.base_ms = base_ms
+        self.ms_per_mb = ms_per_mb
+        # 本次解析新发现的慢规则
+        self.flagged: List[str] = []
+
+    def allowed(self, rule: str) -> bool:
+        return rule not in self.slow_rules
+
+    def limit_ms(self, size: int) -> float:
+        return self.base_ms + size / 1024 / 1024 * self.ms_per_mb
+
+    def _disarm(self, previous):
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+    @contextmanager
+    def run(self, rule: str, size: int):
+        """执行一条规则的匹配；超时时中断并吞掉异常，调用方只保留中断前的结果"""
+        limit = self.limit_ms(size)
+        armed = _can_interrupt()
+        previous = None
+        if armed:
+            previous = signal.signal(signal.SIGALRM, _on_alarm)
+            signal.setitimer(signal.ITIMER_REAL, limit / 1000)
+        started = time.perf_counter()
+        try:
+            try:
+                yield
+            finally:
+                if armed:
+                    self._disarm(previous)
+        except RuleTimeout:
+            # 定时器只触发一次；在 finally 中恢复之前触发时这里再恢复一次
+            self._disarm(previous)
+        elapsed = (time.perf_counter() - started) * 1000
+        if elapsed > limit:
+            self.slow_rules[rule] = round(elapsed, 1)
+            self.flagged.append(rule)
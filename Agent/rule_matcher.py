@@ -0,0 +1,219 @@
+import re
+from contextlib import nullcontext
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from rule_guard import RULE_SCRIPT_ERRORS, RuleGuard
+
+try:
+    from re import _parser as sre_parse  # Python 3.11+
+except ImportError:
+    import sre_parse
+
+try:
+    import ahocorasick  # pyahocorasick，可选依赖：真正的单遍多模式匹配
+except ImportError:
+    ahocorasick = None
+
+DEFAULT_CRITICAL_KEYWORDS = ["KERNEL PANIC", "MACHINE CHECK", "REBOOTING", "OUT OF MEMORY", "SEGMENTATION FAULT"]
+
+# 不区分大小写的关键词按块大写化后查找，块大小限制临时副本的内存占用
+UPPER_BLOCK_SIZE = 4 * 1024 * 1024
+# bytes 模式下自动机按块扫描：每块按 latin-1 解码（字节与字符一一对应，位置不变）后交给自动机
+AUTOMATON_BLOCK_SIZE = 4 * 1024 * 1024
+
+# 命中类型
+KIND_ERROR = "error"
+KIND_CRITICAL = "critical"
+KIND_SCRIPT = "script_error"
+
+
+class RuleHit(NamedTuple):
+    kind: str
+    name: str
+    offset: int
+
+
+def _has_group_ref(node) -> bool:
+    for item in node:
+        if isinstance(item, sre_parse.SubPattern):
+            if _has_group_ref(item):
+                return True
+        elif isinstance(item, (tuple, list)):
+            # 操作码是 int 的子类，用 is 比较，避免与重复次数等普通整数混淆
+            if item and (item[0] is sre_parse.GROUPREF or item[0] is sre_parse.GROUPREF_EXISTS):
+                return True
+            if _has_group_ref(item):
+                return True
+    return False
+
+
+def has_group_ref(pattern: str) -> bool:
+    """正则中是否引用了分组（\\1、(?P=name)、(?(1)...)）
+
+    合并为多选分支后分组会重新编号，引用会指向其它规则的分组且不会报错，这类正则需要单独编译。
+    """
+    return _has_group_ref(sre_parse.parse(pattern, re.IGNORECASE))
+
+
+def encode_pattern(pattern: str, binary: bool):
+    """binary 模式下把字符串模式转换为 bytes，用于直接匹配 mmap 中的原始字节"""
+    return pattern.encode("utf-8") if binary else pattern
+
+
+class _LiteralSet:
+    """一组字面量的多模式匹配
+
+    安装了 pyahocorasick 时构建 Aho-Corasick 自动机，单遍扫描即可得到所有模式的命中
+    位置，成本与模式数量无关。自动机只接受 str：bytes 模式（扫描 mmap）下字面量按 UTF-8
+    编码后以 latin-1 解码作为键，文本按块以 latin-1 解码后扫描，命中位置即字节偏移。
+    未安装时退化为逐个 find（C 实现，可直接作用于 mmap）。
+    """
+
+    def __init__(self, entries: List[Tuple[str, str, str]], binary: bool = False):
+        # entries: [(literal, kind, name)]，同一个字面量可能对应多条规则
+        self.binary = binary
+        self.targets: Dict = {}
+        for literal, kind, name in entries:
+            if literal:
+                self.targets.setdefault(encode_pattern(literal, binary), []).append((kind, name))
+        self.max_len = max((len(literal) for literal in self.targets), default=0)
+        self.target_count = sum(len(targets) for targets in self.targets.values())
+
+        self.automaton = None
+        if ahocorasick is not None and self.targets:
+            self.automaton = ahocorasick.Automaton()
+            for literal, targets in self.targets.items():
+                key = literal.decode("latin-1") if binary else literal
+                self.automaton.add_word(key, (len(literal), targets))
+            self.automaton.make_automaton()
+
+    def scan(self, buf, start: int, end: int, hits: Dict[Tuple[str, str], int], base: int = 0):
+        if self.automaton is not None:
+            if self.binary:
+                self._scan_blocks(buf, start, end, hits, base)
+            else:
+                self._scan_automaton(buf, start, end, hits, base)
+            return
+        for literal, targets in self.targets.items():
+            pos = buf.find(literal, start, end)
+            if pos < 0:
+                continue
+            for target in targets:
+                if target not in hits:
+                    hits[target] = base + pos
+
+    def _scan_automaton(self, text: str, start: int, end: int, hits: Dict[Tuple[str, str], int], base: int):
+        for pos, (length, targets) in self.automaton.iter(text, start, end):
+            for target in targets:
+                if target not in hits:
+                    hits[target] = base + pos - length + 1
+
+    def _scan_blocks(self, buf, start: int, end: int, hits: Dict[Tuple[str, str], int], base: int):
+        # 相邻块重叠 (最长字面量-1) 个字节，跨块的字面量不会漏掉；全部命中后提前结束
+        overlap = max(self.max_len - 1, 0)
+        pos = start
+        while pos < end:
+            block_end = min(pos + AUTOMATON_BLOCK_SIZE, end)
+            text = buf[pos:min(block_end + overlap, end)].decode("latin-1")
+            self._scan_automaton(text, 0, len(text), hits, base + pos)
+            if sum(1 for targets in self.targets.values() for target in targets if target in hits) >= self.target_count:
+                break
+            pos = block_end
+
+
+class RuleMatcher:
+    """把一份规则配置编译成一次扫描即可完成的匹配器
+
+    - error_patterns：区分大小写的字面量
+    - critical_keywords：与大写化后的文本比较的字面量（关键词需为大写）
+    - script_error_patterns：不区分大小写的正则，合并为一个多选分支正则
+
+    binary=True 时所有模式编译为 bytes，可直接扫描 mmap 映射的文件而无需解码。
+    """
+
+    def __init__(self, rules: dict, include_script_errors: bool = True, binary: bool = False):
+        self.binary = binary
+        self.literals = _LiteralSet([
+            (rule.get("pattern", ""), KIND_ERROR, rule.get("name", "Unknown Error"))
+            for rule in rules.get("error_patterns", [])
+        ], binary)
+        # 关键词原样与大写化后的文本比较，与原先的 kw in content.upper() 一致：含小写字母的关键词
+        # 永远不会命中，直接忽略
+        self.keywords = _LiteralSet([
+            (kw, KIND_CRITICAL, kw)
+            for kw in rules.get("critical_keywords", DEFAULT_CRITICAL_KEYWORDS)
+            if kw == kw.upper()
+        ], binary)
+
+        self.regex_targets: List[Tuple[str, str]] = []
+        self.combined = None
+        # 合并正则中第 i 个分支对应的 regex_targets 下标
+        self.combined_targets: List[int] = []
+        # 单独编译的正则: [(regex_targets 下标, 正则)]
+        self.separate: List[Tuple[int, re.Pattern]] = []
+        patterns = rules.get("script_error_patterns", []) if include_script_errors else []
+        if patterns:
+            self.regex_targets = [(KIND_SCRIPT, p) for p in patterns]
+            merged = []
+            for i, p in enumerate(patterns):
+                if has_group_ref(p):
+                    self.separate.append((i, re.compile(encode_pattern(p, binary), re.IGNORECASE)))
+                else:
+                    merged.append(i)
+            try:
+                if merged:
+                    self.combined = re.compile(
+                        encode_pattern("|".join(f"(?P<__rule{i}>{patterns[i]})" for i in merged), binary),
+                        re.IGNORECASE
+                    )
+                    self.combined_targets = merged
+            except re.error:
+                # 规则之间无法合并（如重名分组），逐条编译
+                self.separate += [(i, re.compile(encode_pattern(patterns[i], binary), re.IGNORECASE)) for i in merged]
+
+    def _scan_keywords(self, buf, start: int, end: int, hits: Dict[Tuple[str, str], int]):
+        # 分块大写化，相邻块重叠 (最长关键词-1) 个字符，保证跨块的关键词不漏
+        overlap = max(self.keywords.max_len - 1, 0)
+        pos = start
+        while pos < end:
+            block_end = min(pos + UPPER_BLOCK_SIZE, end)
+            block = buf[pos:min(block_end + overlap, end)].upper()
+            self.keywords.scan(block, 0, len(block), hits, base=pos)
+            if sum(1 for kind, _ in hits if kind == KIND_CRITICAL) >= self.keywords.target_count:
+                break
+            pos = block_end
+
+    def scan(self, buf, start: int = 0, end: Optional[int] = None, guard: Optional[RuleGuard] = None) -> List[RuleHit]:
+        """扫描 buf[start:end]（str、bytes 或 mmap），返回每条命中规则及其首次出现的位置
+
+        字面量匹配耗时可控，总是执行；用户提供的脚本错误正则在 guard 的时间限制内执行，
+        被判定为慢规则后跳过。
+        """
+        if end is None:
+            end = len(buf)
+        hits: Dict[Tuple[str, str], int] = {}
+        self.literals.scan(buf, start, end, hits)
+        if self.keywords.targets:
+            self._scan_keywords(buf, start, end, hits)
+
+        if self.regex_targets and (guard is None or guard.allowed(RULE_SCRIPT_ERRORS)):
+            with guard.run(RULE_SCRIPT_ERRORS, end - start) if guard else nullcontext():
+                self._scan_regex(buf, start, end, hits)
+
+        return sorted((RuleHit(kind, name, offset) for (kind, name), offset in hits.items()),
+                      key=lambda hit: hit.offset)
+
+    def _scan_regex(self, buf, start: int, end: int, hits: Dict[Tuple[str, str], int]):
+        if self.combined is not None:
+            remaining = len(self.combined_targets)
+            for m in self.combined.finditer(buf, start, end):
+                target = self.regex_targets[int(m.lastgroup[len("__rule"):])]
+                if target not in hits:
+                    hits[target] = m.start()
+                    remaining -= 1
+                    if not remaining:
+                        break
+        for i, regex in self.separate:
+            m = regex.search(buf, start, end)
+            if m:
+                hits.setdefault(self.regex_targets[i], m.start())
@@ -0,0 +1,164 @@
+import time
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from timestamps import timestamp_ms
+
+# 调度优先级（数值越小越优先）：新板子或规则变更、即将达到挂起阈值、日志有增长、定期复查、已完成
+PRIORITY_FORCED = 0
+PRIORITY_HANG = 1
+PRIORITY_CHANGED = 2
+PRIORITY_IDLE = 3
+PRIORITY_FINISHED = 4
+
+# 吞吐量的指数滑动平均系数
+THROUGHPUT_ALPHA = 0.3
+
+
+class ScanCandidate(NamedTuple):
+    priority: int
+    next_due: float
+    key: str
+    # 待解析的新增字节数，以及按历史吞吐量估算的解析耗时（毫秒）
+    pending_bytes: int
+    cost_ms: float
+
+
+class BoardSchedule:
+    """一块板子的扫描计划：当前扫描间隔、下次到期时间及到期原因"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.next_due = 0.0
+        self.priority = PRIORITY_FORCED
+        self.last_parsed = 0.0
+        # 最近一次解析的固定开销（尾部分析等，与新增内容无关）
+        self.base_ms = 0.0
+
+
+class ScanScheduler:
+    """按板子调度日志解析
+
+    - 日志在增长的板子按 base_interval 扫描
+    - 日志无变化的板子每次扫描后间隔翻倍，最长 idle_interval
+    - 已完成的板子按 finished_interval 复查
+    - 心跳即将超过挂起阈值的板子在到达阈值时立即扫描，及时报告挂起
+    - 规则变更或新出现的板子立即扫描
+    """
+
+    def __init__(self, base_interval: float = 30, idle_interval: float = 60, finished_interval: float = 600):
+        self.base_interval = base_interval
+        self.idle_interval = max(idle_interval, base_interval)
+        self.finished_interval = max(finished_interval, base_interval)
+        self.boards: Dict[str, BoardSchedule] = {}
+        # 解析吞吐量（字节/毫秒），用于估算待解析内容的耗时
+        self.throughput: Optional[float] = None
+
+    def get(self, key: str) -> BoardSchedule:
+        if key not in self.boards:
+            self.boards[key] = BoardSchedule(self.base_interval)
+        return self.boards[key]
+
+    def mark_changed(self, key: str):
+        """日志有变化：退避中的板子恢复到基础间隔"""
+        board = self.get(key)
+        if board.priority > PRIORITY_CHANGED or board.interval > self.base_interval:
+            board.interval = self.base_interval
+            board.next_due = min(board.next_due, board.last_parsed + self.base_interval)
+            board.priority = min(board.priority, PRIORITY_CHANGED)
+
+    def force(self, key: str):
+        """立即扫描（规则变更等）"""
+        board = self.get(key)
+        board.next_due = 0.0
+        board.priority = PRIORITY_FORCED
+
+    def forget(self, live_keys: Iterable[str]):
+        live = set(live_keys)
+        for key in [k for k in self.boards if k not in live]:
+            del self.boards[key]
+
+    def estimate_ms(self, key: str, pending_bytes: int) -> float:
+        board = self.get(key)
+        if not pending_bytes or not self.throughput:
+            return board.base_ms
+        return board.base_ms + pending_bytes / self.throughput
+
+    def due(self, keys: Iterable[str], now: float) -> List[tuple]:
+        """到期的板子 [(priority, next_due, key)]"""
+        result = []
+        for key in keys:
+            board = self.get(key)
+            if board.next_due <= now:
+                result.append((board.priority, board.next_due, key))
+        return result
+
+    def next_wakeup(self) -> Optional[float]:
+        return min((board.next_due for board in self.boards.values()), default=None)
+
+    def on_parsed(self, key: str, status: dict, pending_bytes: int, parse_ms: Optional[float],
+                  hang_threshold: Optional[float], now: Optional[float] = None):
+        """根据解析结果安排下一次扫描"""
+        now = time.time() if now is None else now
+        board = self.get(key)
+        board.last_parsed = now
+
+        if parse_ms is not None:
+            if pending_bytes and parse_ms > 0:
+                rate = pending_bytes / parse_ms
+                self.throughput = rate if self.throughput is None else (
+                    THROUGHPUT_ALPHA * rate + (1 - THROUGHPUT_ALPHA) * self.throughput
+                )
+            else:
+                board.base_ms = parse_ms
+
+        if status.get("status") == "Finished":
+            board.interval, board.priority = self.finished_interval, PRIORITY_FINISHED
+        elif pending_bytes:
+            board.interval, board.priority = self.base_interval, PRIORITY_CHANGED
+        else:
+            # 无变化：指数退避
+            board.interval = min(max(board.interval, self.base_interval) * 2, self.idle_interval)
+            board.priority = PRIORITY_IDLE
+        board.next_due = now + board.interval
+
+        # 心跳将在下次扫描之前超过挂起阈值：在到达阈值时扫描
+        hang_at = self._hang_at(status, hang_threshold)
+        if hang_at is not None and now < hang_at < board.next_due:
+            board.next_due = hang_at + 1
+            board.priority = PRIORITY_HANG
+
+    @staticmethod
+    def _hang_at(status: dict, hang_threshold: Optional[float]) -> Optional[float]:
+        if not hang_threshold or status.get("status") not in ("Running", "Warning"):
+            return None
+        deadlines = []
+        for field in ("kernel_heartbeat", "cm55_heartbeat"):
+            heartbeat = status.get(field)
+            if not heartbeat:
+                continue
+            try:
+                deadlines.append(timestamp_ms(heartbeat) / 1000 + hang_threshold)
+            except ValueError:
+                continue
+        return min(deadlines) if deadlines else None
+
+
+def select_within_budget(candidates: List[ScanCandidate], budget_bytes: Optional[int],
+                         budget_ms: Optional[float]) -> List[ScanCandidate]:
+    """按优先级和到期时间选出本轮解析的板子，新增字节数和估算耗时不超过预算
+
+    预算为 None 或 0 时不限制；超出预算的板子保留到期状态，下一轮优先处理。
+    第一块板子总会被选中，避免单块板子的大量积压永远无法解析。
+    """
+    selected: List[ScanCandidate] = []
+    used_bytes, used_ms = 0, 0.0
+    for candidate in sorted(candidates):
+        if selected and (
+            (budget_bytes and used_bytes + candidate.pending_bytes > budget_bytes) or
+            (budget_ms and used_ms + candidate.cost_ms > budget_ms)
+        ):
+            continue
+        selected.append(candidate)
+        used_bytes += candidate.pending_bytes
+        used_ms += candidate.cost_ms
+    return selected
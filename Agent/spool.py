@@ -0,0 +1,207 @@
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+# 单个段文件的大小上限，超过后切换到新段
+SEGMENT_BYTES = 4 * 1024 * 1024
+SEGMENT_PREFIX = "segment-"
+SEGMENT_SUFFIX = ".jsonl"
+CURSOR_FILE = "cursor.json"
+
+
+class Spool:
+    """磁盘上的离线上报队列
+
+    后端不可达时，上报数据按顺序追加到段文件（每行一条 JSON 记录）中，恢复后
+    从读取位置开始按顺序重放。读取位置单独保存在 cursor.json 中，已完全消费的
+    段文件直接删除。总大小超过 max_bytes 时丢弃最旧的段，避免长期断网占满磁盘。
+    """
+
+    def __init__(self, directory: str, max_bytes: int, segment_bytes: int = SEGMENT_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        self.segments: List[int] = sorted(
+            int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+            for name in os.listdir(directory)
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)
+        )
+        # 读取位置：(段编号, 段内字节偏移)
+        self.read_segment = self.segments[0] if self.segments else 1
+        self.read_offset = 0
+        self._load_cursor()
+        if self.segments and not self.empty():
+            print(f"📦 离线队列中有待重放的上报数据: {self.directory}")
+
+    def _path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{segment:06d}{SEGMENT_SUFFIX}")
+
+    def _size(self, segment: int) -> int:
+        try:
+            return os.path.getsize(self._path(segment))
+        except OSError:
+            return 0
+
+    def _load_cursor(self):
+        try:
+            with open(os.path.join(self.directory, CURSOR_FILE), "r", encoding="utf-8") as f:
+                cursor = json.load(f)
+            segment, offset = cursor["segment"], cursor["offset"]
+        except (OSError, ValueError, KeyError):
+            return
+        if segment in self.segments:
+            self.read_segment, self.read_offset = segment, offset
+        elif self.segments and segment < self.segments[0]:
+            self.read_segment, self.read_offset = self.segments[0], 0
+
+    def _save_cursor(self):
+        path = os.path.join(self.directory, CURSOR_FILE)
+        tmp_path = path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"segment": self.read_segment, "offset": self.read_offset}, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"⚠️ 保存离线队列位置失败: {e}")
+
+    def append(self, record: dict):
+        line = (json.dumps(record, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+        with self.lock:
+            if not self.segments or self._size(self.segments[-1]) + len(line) > self.segment_bytes:
+                self.segments.append(self.segments[-1] + 1 if self.segments else self.read_segment)
+            with open(self._path(self.segments[-1]), "ab") as f:
+                f.write(line)
+            self._enforce_limit()
+
+    def _enforce_limit(self):
+        total = sum(self._size(segment) for segment in self.segments)
+        while total > self.max_bytes and len(self.segments) > 1:
+            oldest = self.segments.pop(0)
+            total -= self._size(oldest)
+            try:
+                os.remove(self._path(oldest))
+            except OSError:
+                pass
+            if self.read_segment <= oldest:
+                self.read_segment, self.read_offset = self.segments[0], 0
+            print(f"⚠️ 离线队列超过 {self.max_bytes // (1024 * 1024)}MB，已丢弃最旧的数据段 {oldest}")
+
+    def empty(self) -> bool:
+        with self.lock:
+            return not self.segments or (
+                self.read_segment >= self.segments[-1] and self.read_offset >= self._size(self.segments[-1])
+            )
+
+    def read_batch(self, max_records: int) -> Tuple[List[dict], Optional[Tuple[int, int]]]:
+        """从读取位置开始按顺序取出最多 max_records 条记录，返回记录和消费后的位置（需 commit 才生效）"""
+        records: List[dict] = []
+        with self.lock:
+            segment, offset = self.read_segment, self.read_offset
+            for seg in [s for s in self.segments if s >= segment]:
+                if seg != segment:
+                    segment, offset = seg, 0
+                is_last = seg == self.segments[-1]
+                try:
+                    with open(self._path(seg), "rb") as f:
+                        f.seek(offset)
+                        for line in f:
+                            if not line.endswith(b"\n"):
+                                # 最后一段末尾的不完整记录（写入中途崩溃）留待下次；其它段中的直接跳过
+                                if is_last:
+                                    break
+                                offset += len(line)
+                                continue
+                            offset += len(line)
+                            try:
+                                records.append(json.loads(line))
+                            except ValueError:
+                                print(f"⚠️ 跳过离线队列中损坏的记录 (段 {seg})")
+                            if len(records) >= max_records:
+                                return records, (segment, offset)
+                except OSError as e:
+                    print(f"⚠️ 读取离线队列失败: {e}")
+                    break
+        return records, (segment, offset)
+
+    def commit(self, position: Tuple[int, int]):
+        """确认 read_batch 返回的记录已上报成功，删除已完全消费的段"""
+        with self.lock:
+            self.read_segment, self.read_offset = position
+            while len(self.segments) > 1 and self.segments[0] < self.read_segment:
+                try:
+                    os.remove(self._path(self.segments.pop(0)))
+                except OSError:
+                    pass
+            last = self.segments[-1] if self.segments else None
+            if last is not None and self.read_segment == last and self.read_offset >= self._size(last):
+                # 全部重放完毕：清空最后一段，下次从新段开始
+                try:
+                    os.remove(self._path(last))
+                except OSError:
+                    pass
+                self.segments = []
+                self.read_segment, self.read_offset = last + 1, 0
+            self._save_cursor()
+
+
+class SpoolSender(threading.Thread):
+    """后台重放离线队列：按顺序批量上报，失败时指数退避，不阻塞解析循环"""
+
+    def __init__(self, spool: Spool, transport, batch_size: int = 50,
+                 min_backoff: float = 1, max_backoff: float = 300):
+        super().__init__(name="spool-sender", daemon=True)
+        self.spool = spool
+        self.transport = transport
+        self.batch_size = batch_size
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.backoff = min_backoff
+        # 失败退避结束的时刻（time.monotonic()），此前 notify() 不会提前重试；0 表示未在退避中
+        self.next_retry = 0.0
+        self.wake = threading.Event()
+        self.lock = threading.Lock()
+        # 重放过程中后端要求全量重传温度曲线的板子 {rig_id: {board_id}}，由主循环取走
+        self.temperature_resync: Dict[str, set] = {}
+
+    def notify(self):
+        """有新的数据入队：空闲时立即重放，失败退避中仍等到 next_retry"""
+        self.wake.set()
+
+    def pop_temperature_resync(self, rig_id: str) -> set:
+        with self.lock:
+            return self.temperature_resync.pop(rig_id, set())
+
+    def run(self):
+        while True:
+            if self.next_retry:
+                # 失败退避中：新数据入队不提前重试，到期后直接重试
+                time.sleep(max(0.0, self.next_retry - time.monotonic()))
+                self.next_retry = 0.0
+            else:
+                self.wake.wait(timeout=self.backoff)
+            self.wake.clear()
+            while not self.spool.empty():
+                records, position = self.spool.read_batch(self.batch_size)
+                if not records:
+                    # 只剩损坏或未写完的记录
+                    self.spool.commit(position)
+                    break
+                try:
+                    result = self.transport.ingest_batch(records)
+                except Exception as e:
+                    self.backoff = min(self.backoff * 2, self.max_backoff)
+                    self.next_retry = time.monotonic() + self.backoff
+                    print(f"📦 离线数据重放失败，{self.backoff:.0f} 秒后重试: {e}")
+                    break
+                self.spool.commit(position)
+                with self.lock:
+                    for rig_id, boards in result.get("temperature_resync", {}).items():
+                        self.temperature_resync.setdefault(rig_id, set()).update(boards)
+                print(f"📦 已重放 {len(records)} 条离线上报数据")
+                self.backoff = self.min_backoff
+                self.next_retry = 0.0
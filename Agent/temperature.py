@@ -0,0 +1,150 @@
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from bucketing import COUNT, DDR, MAX, MIN, SUM, bucket_readings, merge_buckets
+from timestamps import timestamp_ms
+
+# 默认温度曲线时间窗口：5分钟 = 300000毫秒
+WINDOW_MS = 300000
+# 默认温度曲线保留时长：7天；保留的窗口数 = 保留时长 // 窗口宽度，超出后淘汰最旧的已关闭窗口，
+# 保证内存不随运行时长增长
+RETENTION_MS = 7 * 24 * 3600 * 1000
+# 核心温度传感器关键字 (排除硬件ADC、PMIC等)
+CORE_SENSOR_KEYWORDS = ["CPU", "DDR", "SOC", "MIN"]
+
+
+def is_core_sensor(sensor_name: str) -> bool:
+    return any(x in sensor_name.upper() for x in CORE_SENSOR_KEYWORDS)
+
+
+class TemperatureAggregator:
+    """CM55 温度流式聚合器
+
+    只消费新增的温度读数，维护每个传感器的 min/max/latest 以及按时间窗口
+    分组的 max/min/DDR/avg 统计，不保存原始读数，内存占用与日志长度无关。
+    """
+
+    def __init__(self, window_ms: int = WINDOW_MS, retention_ms: int = RETENTION_MS):
+        self.window_ms = window_ms
+        # 最多保留的窗口数，与窗口宽度无关地覆盖 retention_ms 时长
+        self.max_buckets = max(1, retention_ms // window_ms)
+        self.sensor_min: Dict[str, float] = {}
+        self.sensor_max: Dict[str, float] = {}
+        self.sensor_latest: Dict[str, float] = {}
+        # key: 窗口起始时间戳(ms)，value: [max, min, ddr, sum, count]
+        self.buckets: Dict[int, list] = {}
+        # 当前仍在写入的窗口，早于它的窗口视为已关闭
+        self.open_window: Optional[int] = None
+        # 自上次 drain_changed() 以来发生变化的窗口
+        self.changed: set = set()
+
+    def add_many(self, readings: Iterable[Tuple[str, str, float]]) -> int:
+        """消费一批 (时间, 传感器名, 温度) 读数，单次遍历完成窗口统计，返回读数条数"""
+        ts_list, val_list, ddr_list = [], [], []
+        last_time_str, last_ts = None, None
+        count = 0
+        for time_str, sensor_name, val in readings:
+            count += 1
+            # 记录最后一次值用于仪表盘
+            self.sensor_latest[sensor_name] = val
+
+            # 记录历史极值用于计算最大最小值
+            if sensor_name not in self.sensor_min or val < self.sensor_min[sensor_name]:
+                self.sensor_min[sensor_name] = val
+            if sensor_name not in self.sensor_max or val > self.sensor_max[sensor_name]:
+                self.sensor_max[sensor_name] = val
+
+            # 仅核心传感器的数据点参与绘图
+            if not (is_core_sensor(sensor_name) and "PVTC_TS_" in sensor_name):
+                continue
+            # 同一时刻通常有多个传感器读数，复用上一次的解析结果
+            if time_str != last_time_str:
+                try:
+                    last_ts = timestamp_ms(time_str)
+                except ValueError:
+                    last_ts = None
+                last_time_str = time_str
+            if last_ts is None:
+                continue
+            ts_list.append(last_ts)
+            val_list.append(val)
+            ddr_list.append("DDR" in sensor_name.upper())
+
+        if not ts_list:
+            return count
+        batch = bucket_readings(ts_list, val_list, ddr_list, self.window_ms)
+        self.changed.update(merge_buckets(self.buckets, batch))
+
+        newest = max(batch)
+        if self.open_window is None or newest > self.open_window:
+            self.open_window = newest
+            self._evict()
+        return count
+
+    def _evict(self):
+        if len(self.buckets) <= self.max_buckets:
+            return
+        for window in sorted(self.buckets)[:len(self.buckets) - self.max_buckets]:
+            del self.buckets[window]
+            self.changed.discard(window)
+
+    def core_range(self):
+        """核心传感器的历史最低/最高温度，没有数据时返回 None"""
+        mins = [v for k, v in self.sensor_min.items() if is_core_sensor(k)]
+        maxs = [v for k, v in self.sensor_max.items() if is_core_sensor(k)]
+        if not mins:
+            return None
+        return min(mins), max(maxs)
+
+    def ddr_details(self) -> Dict[str, float]:
+        """核心 DDR 传感器的最新读数 (TS1-6)"""
+        return {k: v for k, v in self.sensor_latest.items() if "DDR" in k.upper() and "PVTC_TS_" in k}
+
+    @staticmethod
+    def _point(window: int, bucket: list) -> dict:
+        return {
+            "timestamp": datetime.fromtimestamp(window / 1000).isoformat(),
+            "max_temperature": bucket[MAX],
+            "min_temperature": bucket[MIN],
+            # 窗口内没有 DDR 读数时为 0.0
+            "ddr_temperature": bucket[DDR] if bucket[DDR] is not None else 0.0,
+            "avg_temperature": round(bucket[SUM] / bucket[COUNT], 2)
+        }
+
+    def points(self) -> List[dict]:
+        """完整温度曲线（按时间排序）"""
+        return [self._point(w, self.buckets[w]) for w in sorted(self.buckets)]
+
+    def drain_changed(self) -> List[dict]:
+        """返回自上次调用以来新增或更新过的窗口，并清空变更记录"""
+        points = [self._point(w, self.buckets[w]) for w in sorted(self.changed) if w in self.buckets]
+        self.changed = set()
+        return points
+
+    def to_dict(self) -> dict:
+        return {
+            "window_ms": self.window_ms,
+            "sensor_min": self.sensor_min,
+            "sensor_max": self.sensor_max,
+            "sensor_latest": self.sensor_latest,
+            "buckets": [[w] + b for w, b in sorted(self.buckets.items())],
+            "open_window": self.open_window,
+            "changed": sorted(self.changed)
+        }
+
+    @classmethod
+    def from_dict(cls, data: Optional[dict], window_ms: int = WINDOW_MS,
+                  retention_ms: int = RETENTION_MS) -> Optional["TemperatureAggregator"]:
+        """从持久化状态恢复；窗口宽度与当前配置不一致时返回 None，需要重新解析"""
+        agg = cls(window_ms, retention_ms)
+        if not data:
+            return agg
+        if data.get("window_ms", WINDOW_MS) != window_ms:
+            return None
+        agg.sensor_min = data.get("sensor_min", {})
+        agg.sensor_max = data.get("sensor_max", {})
+        agg.sensor_latest = data.get("sensor_latest", {})
+        agg.buckets = {item[0]: list(item[1:]) for item in data.get("buckets", [])}
+        agg.open_window = data.get("open_window")
+        agg.changed = set(data.get("changed", []))
+        return agg
@@ -0,0 +1,46 @@
+import re
+from datetime import datetime
+from functools import lru_cache
+from typing import Optional
+
+from log_reader import find_last
+
+# 日志中统一使用的时间格式: YYYY-MM-DD HH:MM:SS
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+TIMESTAMP_BYTES_RE = re.compile(rb'\[(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})\]')
+
+
+@lru_cache(maxsize=4096)
+def parse_timestamp(text: str) -> datetime:
+    """按固定格式 YYYY-MM-DD HH:MM:SS 解析时间，与 datetime.strptime(text, TIMESTAMP_FORMAT) 结果一致
+
+    直接按位置切片转换，不经过 strptime 的通用格式解析；格式不符时抛出 ValueError。
+    """
+    if len(text) != 19 or text[4] != "-" or text[7] != "-" or text[10] != " " or text[13] != ":" or text[16] != ":":
+        raise ValueError(f"时间格式不符: {text!r}")
+    return datetime(int(text[0:4]), int(text[5:7]), int(text[8:10]),
+                    int(text[11:13]), int(text[14:16]), int(text[17:19]))
+
+
+@lru_cache(maxsize=1024)
+def _minute_ms(prefix: str) -> int:
+    return int(parse_timestamp(prefix + ":00").timestamp() * 1000)
+
+
+def timestamp_ms(text: str) -> int:
+    """本地时间字符串转换为毫秒时间戳
+
+    同一分钟内的时间共用一次本地时区换算（mktime），温度读数逐条转换时开销可以忽略。
+    """
+    if len(text) != 19 or text[16] != ":" or not "00" <= text[17:19] <= "59":
+        raise ValueError(f"时间格式不符: {text!r}")
+    return _minute_ms(text[:16]) + int(text[17:19]) * 1000
+
+
+def last_timestamp(path: str, start: int = 0, end: Optional[int] = None) -> Optional[str]:
+    """从文件末尾向前查找 [start, end) 范围内最后一个 [YYYY-MM-DD HH:MM:SS] 时间戳
+
+    只读取文件末尾的少量数据块，耗时与日志大小无关。
+    """
+    m = find_last(path, TIMESTAMP_BYTES_RE, start, end)
+    return m.group(1).decode("ascii") if m else None
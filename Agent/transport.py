@@ -0,0 +1,104 @@
+import gzip
+import json
+from typing import TYPE_CHECKING, List, Optional
+
+if TYPE_CHECKING:
+    import requests
+
+# 小于该大小的请求体不压缩，压缩收益抵不过 CPU 开销
+GZIP_MIN_BYTES = 1024
+
+
+class Transport:
+    """Agent 到 Backend 的 HTTP 传输层
+
+    复用一个 keep-alive 的 requests.Session（连接池），请求体超过阈值时 gzip 压缩，
+    所有请求都带超时，避免网络拥塞时阻塞扫描循环。
+    """
+
+    def __init__(self, backend_url: str, timeout: float = 10, compress: bool = True):
+        # BACKEND_URL 历史上配置为 .../api/report，这里统一还原为服务根地址
+        self.base_url = backend_url.rstrip("/")
+        if self.base_url.endswith("/api/report"):
+            self.base_url = self.base_url[:-len("/api/report")]
+        self.timeout = timeout
+        self.compress = compress
+        self._session: Optional["requests.Session"] = None
+        # 旧版后端没有 /api/ingest 时退回到分别上报
+        self.ingest_supported = True
+
+    @property
+    def session(self) -> "requests.Session":
+        """首次发送请求时才导入 requests 并建立连接池，加快 Agent 启动"""
+        if self._session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            self._session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8)
+            self._session.mount("http://", adapter)
+            self._session.mount("https://", adapter)
+        return self._session
+
+    def url(self, path: str) -> str:
+        return f"{self.base_url}{path}"
+
+    def get(self, path: str, headers: Optional[dict] = None) -> "requests.Response":
+        return self.session.get(self.url(path), headers=headers, timeout=self.timeout)
+
+    def post_json(self, path: str, payload: dict) -> "requests.Response":
+        body = json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
+        if self.compress and len(body) >= GZIP_MIN_BYTES:
+            body = gzip.compress(body, compresslevel=5)
+            headers["Content-Encoding"] = "gzip"
+        return self.session.post(self.url(path), data=body, headers=headers, timeout=self.timeout)
+
+    def ingest(self, rig_id: str, boards: List[dict], temperature_data: List[dict],
+               delta: Optional[dict] = None, agent_metrics: Optional[dict] = None) -> dict:
+        """一次往返上报状态和温度数据，返回后端响应（含需要全量重传的板子）
+
+        delta 为 BoardDelta.build() 的结果；增量上报时只发送 board_patches，不携带 boards。
+        agent_metrics 为 Agent 本轮的自身性能指标，旧版后端会忽略该字段。
+        """
+        if self.ingest_supported:
+            payload = {"rig_id": rig_id, "temperature_data": temperature_data}
+            if agent_metrics:
+                payload["agent_metrics"] = agent_metrics
+            if delta:
+                payload.update(delta)
+            if not delta or delta.get("full", True):
+                payload["boards"] = boards
+            response = self.post_json("/api/ingest", payload)
+            if response.status_code != 404:
+                response.raise_for_status()
+                return response.json()
+            print("⚠️ 后端不支持 /api/ingest，改为分别上报状态与温度数据")
+            self.ingest_supported = False
+
+        if temperature_data:
+            self.post_json("/api/temperature", {"temperature_data": temperature_data}).raise_for_status()
+        self.post_json("/api/report", {"rig_id": rig_id, "boards": boards}).raise_for_status()
+        return {"status": "success", "rig_id": rig_id, "temperature_resync": []}
+
+    def ingest_batch(self, reports: List[dict]) -> dict:
+        """按顺序批量上报离线队列中的多轮数据（每条均为全量状态）"""
+        if self.ingest_supported:
+            response = self.post_json("/api/ingest/batch", {"reports": reports})
+            if response.status_code != 404:
+                response.raise_for_status()
+                return response.json()
+
+        resync = {}
+        for report in reports:
+            result = self.ingest(report["rig_id"], report["boards"], report.get("temperature_data", []))
+            resync.setdefault(report["rig_id"], set()).update(result.get("temperature_resync", []))
+        return {
+            "status": "success",
+            "count": len(reports),
+            "temperature_resync": {rig_id: sorted(boards) for rig_id, boards in resync.items() if boards}
+        }
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
@@ -0,0 +1,64 @@
+import os
+import zlib
+from typing import Callable
+
+from fastapi import HTTPException, Request, Response
+from fastapi.routing import APIRoute
+
+# 解压后请求体的大小上限，超过时返回 413，防止很小的压缩包解压后耗尽内存
+MAX_REQUEST_MB = float(os.environ.get("MAX_REQUEST_MB", 64))
+MAX_REQUEST_BYTES = int(MAX_REQUEST_MB * 1024 * 1024)
+
+
+class GzipRequest(Request):
+    """透明解压 Content-Encoding: gzip 的请求体
+
+    按块流式解压，解压后超过 MAX_REQUEST_BYTES 时立即停止并返回 413；不是合法的 gzip
+    数据（损坏或被截断）时返回 400。
+    """
+
+    async def body(self) -> bytes:
+        if not hasattr(self, "_body"):
+            if "gzip" in self.headers.getlist("Content-Encoding"):
+                self._body = await self._gunzip()
+            else:
+                self._body = await super().body()
+        return self._body
+
+    async def _gunzip(self) -> bytes:
+        chunks, size = [], 0
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            async for chunk in self.stream():
+                while chunk:
+                    if decompressor.eof:
+                        # 多个 gzip 成员拼接（与 gzip.decompress 一致）
+                        chunk = decompressor.unused_data + chunk
+                        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                    data = decompressor.decompress(chunk, MAX_REQUEST_BYTES - size + 1)
+                    size += len(data)
+                    if size > MAX_REQUEST_BYTES:
+                        raise HTTPException(status_code=413,
+                                            detail=f"Decompressed request body exceeds {MAX_REQUEST_MB:g} MB")
+                    chunks.append(data)
+                    chunk = decompressor.unconsumed_tail
+        except zlib.error as e:
+            raise HTTPException(status_code=400, detail=f"Invalid gzip request body: {e}")
+        if not chunks:
+            # 空请求体
+            return b""
+        if not decompressor.eof:
+            raise HTTPException(status_code=400, detail="Invalid gzip request body: truncated")
+        return b"".join(chunks)
+
+
+class GzipRoute(APIRoute):
+    """所有路由都接受 gzip 压缩的请求体（Agent 上报时使用）"""
+
+    def get_route_handler(self) -> Callable:
+        original_route_handler = super().get_route_handler()
+
+        async def route_handler(request: Request) -> Response:
+            return await original_route_handler(GzipRequest(request.scope, request.receive))
+
+        return route_handler
@@ -0,0 +1,352 @@
+import os
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+from models import BoardStatus, RigReport, TemperatureData
+from timeseries import Row, SegmentStore, TemperatureSeries
+from wal import WriteAheadLog
+from write_behind import DirtyRigs, WriteBehind
+
+
+class JsonStore:
+    """默认存储后端：全部状态保存在内存中
+
+    台架状态通过追加写日志 + 快照持久化（见 wal.py）。温度曲线按列保存在内存中，每块板子
+    一个二进制分段文件，增量上报只追加新写入的窗口（见 timeseries.py）；温度汇总
+    （最低/最高/当前温度）与台架状态一样以追加写日志 + 快照持久化，每次落盘只记录有变化的板子。
+    修改只记录脏数据，由后台线程按 flush_interval 合并落盘（见 write_behind.py）。
+    readonly 为 True（如 Vercel 的只读文件系统）时只读取已有文件，不写入。
+    """
+
+    def __init__(self, state_file: str, state_wal_file: str, temperature_file: str, temperature_wal_file: str,
+                 temperature_dir: str, compact_records: int = 1000, compact_bytes: int = 32 * 1024 * 1024,
+                 fsync: bool = False, readonly: bool = False,
+                 flush_interval: float = 1.0, flush_max_dirty: int = 500):
+        self.segments = SegmentStore(temperature_dir)
+        self.readonly = readonly
+        self.state_wal = WriteAheadLog(state_file, state_wal_file, compact_records, compact_bytes, fsync)
+        self.temperature_wal = WriteAheadLog(temperature_file, temperature_wal_file, compact_records, compact_bytes,
+                                             fsync)
+        # key: rig_id
+        self.rigs: Dict[str, RigReport] = {}
+        # key: f"{rig_id}_{board_id}"，温度汇总（temp_points 为空）与温度曲线
+        self.temperatures: Dict[str, TemperatureData] = {}
+        self.series: Dict[str, TemperatureSeries] = {}
+        # 保护内存状态与脏数据记录：请求处理修改状态，后台线程读取状态生成写入
+        self.lock = threading.RLock()
+        self.dirty_rigs = DirtyRigs()
+        # 汇总有变化的板子 key；temperature_legacy 为 True 时快照是旧格式（含完整曲线），转换后需要重写
+        self.temperature_dirty: Set[str] = set()
+        self.temperature_legacy = False
+        # 尚未写入分段文件的行（key -> {时间戳: 行}，同一窗口只保留最新值）与需要整体重写的曲线
+        self.pending_rows: Dict[str, Dict[int, Row]] = {}
+        self.rewrite_series: Set[str] = set()
+        if not readonly:
+            os.makedirs(temperature_dir, exist_ok=True)
+        self._load_state()
+        self._load_temperature()
+        self.writer = None if readonly else WriteBehind(self.flush, flush_interval, flush_max_dirty, "json-store")
+        if self.temperature_legacy:
+            # 旧格式的温度文件转换为分段文件
+            self._mark()
+
+    # ===== 台架状态 =====
+
+    @staticmethod
+    def _report_json(report: RigReport) -> dict:
+        return report.model_dump(mode="json")
+
+    def _mark(self, count: int = 1):
+        if self.writer is not None:
+            self.writer.mark(count)
+
+    def flush(self):
+        """把上次落盘以来的修改写入磁盘（由后台线程调用）"""
+        with self.lock:
+            full, boards = self.dirty_rigs.take()
+            records = [self._rig_record(rig_id) for rig_id in full]
+            records += [self._patch_record(rig_id, board_ids) for rig_id, board_ids in boards.items()]
+            summaries = [{"key": key, "summary": self.temperatures[key].model_dump(mode="json")}
+                         for key in self.temperature_dirty if key in self.temperatures]
+            self.temperature_dirty = set()
+            appends, rewrites = self._take_temperature_writes()
+        for record in records:
+            if record is not None:
+                self._log_change(record)
+        written = True
+        for temp_data, rows in appends:
+            written &= self._write_segment(temp_data, self.segments.append, rows)
+        for temp_data, series in rewrites:
+            written &= self._write_segment(temp_data, self.segments.write, series)
+        for record in summaries:
+            self._log_temperature(record)
+        if self.temperature_legacy and written:
+            # 旧格式的曲线都已写入分段文件，快照中去掉曲线
+            self.save_temperature()
+            self.temperature_legacy = False
+
+    def _write_segment(self, temp_data: TemperatureData, write, data) -> bool:
+        try:
+            write(temp_data.rig_id, temp_data.board_id, data)
+            return True
+        except Exception as e:
+            print(f"Failed to save temperature series {temp_data.rig_id}/{temp_data.board_id}: {e}")
+            # 下次落盘时用内存中的曲线重写整个文件
+            with self.lock:
+                key = f"{temp_data.rig_id}_{temp_data.board_id}"
+                self.pending_rows.pop(key, None)
+                self.rewrite_series.add(key)
+            return False
+
+    def _take_temperature_writes(self):
+        """取出待写入的温度曲线：[(汇总, 追加的行)]，[(汇总, 需要整体重写的曲线副本)]"""
+        appends, rewrites = [], []
+        pending, self.pending_rows = self.pending_rows, {}
+        rewrite, self.rewrite_series = self.rewrite_series, set()
+        for key, rows in pending.items():
+            temp_data, series = self.temperatures[key], self.series[key]
+            if key not in rewrite and self.segments.needs_compact(temp_data.rig_id, temp_data.board_id,
+                                                                  len(series), len(rows)):
+                rewrite.add(key)
+            if key not in rewrite:
+                appends.append((temp_data, sorted(rows.items())))
+        for key in rewrite:
+            rewrites.append((self.temperatures[key], self.series[key].copy()))
+        return appends, rewrites
+
+    def save_state(self):
+        """把全部台架状态写成快照并清空追加写日志"""
+        if self.readonly:
+            return
+        with self.lock:
+            snapshot = {rid: self._report_json(report) for rid, report in self.rigs.items()}
+        try:
+            self.state_wal.compact(snapshot)
+        except Exception as e:
+            print(f"Failed to save state: {e}")
+
+    def _log_change(self, record: dict):
+        """把一条修改追加到日志，成本与修改的大小成正比；日志足够大时合并为快照"""
+        try:
+            self.state_wal.append(record)
+        except Exception as e:
+            print(f"Failed to append state change: {e}")
+            return
+        if self.state_wal.should_compact():
+            self.save_state()
+
+    def _rig_record(self, rig_id: str) -> dict:
+        """台架的完整状态，台架已删除时为删除记录"""
+        report = self.rigs.get(rig_id)
+        if report is None:
+            return {"op": "delete", "rig_id": rig_id}
+        return {"op": "put", "rig_id": rig_id, "report": self._report_json(report)}
+
+    def _patch_record(self, rig_id: str, board_ids) -> Optional[dict]:
+        """有变化的板子修改后的完整状态；没有板子变化时不记录"""
+        report = self.rigs.get(rig_id)
+        if report is None or not board_ids:
+            return None
+        current = {board.board_id: board for board in report.boards if board.board_id in board_ids}
+        return {
+            "op": "patch",
+            "rig_id": rig_id,
+            "at": report.last_report_at.isoformat(),
+            "boards": {board_id: board.model_dump(mode="json") for board_id, board in current.items()},
+            "removed": sorted(set(board_ids) - set(current))
+        }
+
+    def _apply_change(self, record: dict):
+        """重放一条日志记录（与写入时的修改一一对应，重复应用结果不变）"""
+        op, rig_id = record.get("op"), record.get("rig_id")
+        if op == "put":
+            self.rigs[rig_id] = RigReport(**record["report"])
+        elif op == "patch":
+            report = self.rigs.get(rig_id)
+            if report is None:
+                return
+            boards = {board.board_id: board for board in report.boards}
+            for board_id, board in record.get("boards", {}).items():
+                boards[board_id] = BoardStatus(**board)
+            for board_id in record.get("removed", []):
+                boards.pop(board_id, None)
+            report.boards = list(boards.values())
+            report.last_report_at = datetime.fromisoformat(record["at"])
+        elif op == "delete":
+            self.rigs.pop(rig_id, None)
+
+    def _load_state(self):
+        """读取快照后重放追加写日志"""
+        try:
+            raw_data = self.state_wal.load_snapshot() or {}
+            self.rigs = {rid: RigReport(**item) for rid, item in raw_data.items()}
+        except Exception as e:
+            print(f"Failed to load state: {e}")
+        try:
+            for record in self.state_wal.replay():
+                self._apply_change(record)
+        except Exception as e:
+            print(f"Failed to replay state log: {e}")
+        if self.state_wal.should_compact():
+            self.save_state()
+
+    def get_rig(self, rig_id: str) -> Optional[RigReport]:
+        return self.rigs.get(rig_id)
+
+    def list_rigs(self) -> List[RigReport]:
+        return list(self.rigs.values())
+
+    def put_rig(self, report: RigReport):
+        with self.lock:
+            self.rigs[report.rig_id] = report
+            self.dirty_rigs.put(report.rig_id)
+        self._mark(len(report.boards) or 1)
+
+    def put_boards(self, rig_id: str, boards: Dict[str, BoardStatus], removed: List[str], at: datetime):
+        """替换台架中有变化的板子、删除已移除的板子；只记录有变化的板子"""
+        with self.lock:
+            report = self.rigs[rig_id]
+            merged = {board.board_id: board for board in report.boards}
+            merged.update(boards)
+            for board_id in removed:
+                merged.pop(board_id, None)
+            report.boards = list(merged.values())
+            report.last_report_at = at
+            if boards or removed:
+                self.dirty_rigs.patch(rig_id, list(boards) + list(removed))
+        if boards or removed:
+            self._mark(len(boards) + len(removed))
+
+    def delete_rig(self, rig_id: str) -> bool:
+        with self.lock:
+            if rig_id not in self.rigs:
+                return False
+            del self.rigs[rig_id]
+            self.dirty_rigs.put(rig_id)
+        self._mark()
+        return True
+
+    def find_boards(self, status: Optional[str] = None, task_type: Optional[str] = None,
+                    rig_id: Optional[str] = None) -> List[Tuple[str, BoardStatus]]:
+        reports = [self.rigs[rig_id]] if rig_id in self.rigs else [] if rig_id else self.rigs.values()
+        return [
+            (report.rig_id, board)
+            for report in reports
+            for board in report.boards
+            if (status is None or board.status == status) and (task_type is None or board.task_type == task_type)
+        ]
+
+    # ===== 温度数据 =====
+
+    def save_temperature(self):
+        """把全部温度汇总写成快照并清空追加写日志（曲线在分段文件中）"""
+        if self.readonly:
+            return
+        with self.lock:
+            snapshot = {key: temp_data.model_dump(mode="json") for key, temp_data in self.temperatures.items()}
+        try:
+            self.temperature_wal.compact(snapshot)
+        except Exception as e:
+            print(f"Failed to save temperature data: {e}")
+
+    def _log_temperature(self, record: dict):
+        """把一块板子修改后的温度汇总追加到日志；日志足够大时合并为快照"""
+        try:
+            self.temperature_wal.append(record)
+        except Exception as e:
+            print(f"Failed to append temperature summary: {e}")
+            return
+        if self.temperature_wal.should_compact():
+            self.save_temperature()
+
+    def _load_temperature(self):
+        """从磁盘加载温度汇总（快照 + 追加写日志）和各板子的分段文件
+
+        旧版本的温度文件中直接保存了整条曲线，读取后转换为按列存储，下次落盘时写入分段文件。
+        """
+        try:
+            raw_data = self.temperature_wal.load_snapshot() or {}
+        except Exception as e:
+            print(f"Failed to load temperature data: {e}")
+            raw_data = {}
+        legacy: Dict[str, TemperatureSeries] = {}
+        for key, item in raw_data.items():
+            try:
+                temp_data = TemperatureData(**item)
+            except Exception as e:
+                print(f"Failed to load temperature data {key}: {e}")
+                continue
+            if temp_data.temp_points:
+                legacy[key] = TemperatureSeries.from_points(temp_data.temp_points)
+                temp_data.temp_points = []
+            self.temperatures[key] = temp_data
+        try:
+            for record in self.temperature_wal.replay():
+                self.temperatures[record["key"]] = TemperatureData(**record["summary"])
+        except Exception as e:
+            print(f"Failed to replay temperature log: {e}")
+        for key, temp_data in self.temperatures.items():
+            series = self.segments.load(temp_data.rig_id, temp_data.board_id)
+            if series is None and key in legacy:
+                series = legacy[key]
+                self.rewrite_series.add(key)
+            self.series[key] = series or TemperatureSeries()
+        # 已有分段文件的板子是上次转换后、快照重写前退出的，以分段文件为准
+        self.temperature_legacy = bool(legacy)
+
+    def get_temperature(self, rig_id: str, board_id: str) -> Optional[TemperatureData]:
+        key = f"{rig_id}_{board_id}"
+        with self.lock:
+            temp_data = self.temperatures.get(key)
+            if temp_data is None:
+                return None
+            return temp_data.model_copy(update={"temp_points": self.series[key].points()})
+
+    def temperature_summary(self, rig_id: str, board_id: str) -> Optional[TemperatureData]:
+        """温度汇总（temp_points 为空）"""
+        temp_data = self.temperatures.get(f"{rig_id}_{board_id}")
+        return temp_data.model_copy() if temp_data is not None else None
+
+    def temperature_series(self, rig_id: str, board_id: str, start: Optional[str] = None,
+                           end: Optional[str] = None) -> TemperatureSeries:
+        with self.lock:
+            series = self.series.get(f"{rig_id}_{board_id}")
+            return series.slice(start, end) if series is not None else TemperatureSeries()
+
+    def put_temperature(self, reports: List[TemperatureData]) -> List[str]:
+        """保存一批温度数据：全量上报替换整条曲线，增量上报按 timestamp 写入有变化的窗口；
+        返回没有已有曲线、需要全量重传的板子"""
+        resync = []
+        with self.lock:
+            for temp_data in reports:
+                key = f"{temp_data.rig_id}_{temp_data.board_id}"
+                series = self.series.get(key)
+                if temp_data.incremental and series is not None:
+                    rows = series.upsert_points(temp_data.temp_points)
+                    if key not in self.rewrite_series:
+                        self.pending_rows.setdefault(key, {}).update(rows)
+                else:
+                    if temp_data.incremental:
+                        resync.append(temp_data.board_id)
+                    self.series[key] = TemperatureSeries.from_points(temp_data.temp_points)
+                    self.pending_rows.pop(key, None)
+                    self.rewrite_series.add(key)
+                self.temperatures[key] = temp_data.model_copy(update={"temp_points": [], "incremental": False})
+                self.temperature_dirty.add(key)
+        self._mark(len(reports))
+        return resync
+
+    def temperature_range(self, rig_id: str, board_id: str, start: Optional[str] = None,
+                          end: Optional[str] = None) -> List[dict]:
+        """[start, end] 范围内的温度点（ISO 格式时间），按时间排序"""
+        with self.lock:
+            series = self.series.get(f"{rig_id}_{board_id}")
+            return series.points(start, end) if series is not None else []
+
+    def close(self):
+        """停止后台线程，落盘尚未写入的修改"""
+        if self.writer is not None:
+            self.writer.close()
+        self.state_wal.close()
+        self.temperature_wal.close()
@@ -1,13 +1,28 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
+import asyncio
+from contextlib import asynccontextmanager
 import store
 import models
+import rule_validation
 import urllib.parse
-from models import RigReport, RuleConfig
+from compression import GzipRoute
+from models import IngestBatch, IngestReport, RigReport, RuleConfig
 
-app = FastAPI(title="Rig Monitoring System API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # 退出前落盘尚未写入的修改
+    store.close()
+
+app = FastAPI(title="Rig Monitoring System API", lifespan=lifespan)
+# 接受 Agent 发送的 gzip 压缩请求体
+app.router.route_class = GzipRoute
 
 # 启用 CORS 以支持前端访问
 app.add_middleware(
@@ -17,6 +32,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# 响应体超过 1KB 时压缩（温度曲线、全量状态等）
+app.add_middleware(GZipMiddleware, minimum_size=1000)
 
 @app.get("/")
 async def root():
@@ -37,10 +54,17 @@ async def list_endpoints():
             {"method": "GET", "path": "/api/endpoints", "description": "列出所有端点"},
             {"method": "GET", "path": "/api/status", "description": "获取所有台架状态"},
             {"method": "POST", "path": "/api/report", "description": "上报台架数据"},
+            {"method": "POST", "path": "/api/ingest", "description": "合并上报台架状态与温度数据"},
+            {"method": "POST", "path": "/api/ingest/batch", "description": "批量重放 Agent 离线队列"},
+            {"method": "GET", "path": "/api/metrics", "description": "各台架 Agent 性能指标及最慢的板子"},
+            {"method": "GET", "path": "/api/metrics/{rig_id}", "description": "特定台架 Agent 性能指标"},
             {"method": "DELETE", "path": "/api/status/{rig_id}", "description": "删除特定台架"},
+            {"method": "GET", "path": "/api/boards", "description": "按 status / task_type / rig_id 筛选板子"},
+            {"method": "GET", "path": "/api/temperature/{rig_id}/{board_id}", "description": "温度曲线，支持 from / to / max_points 降采样"},
             {"method": "GET", "path": "/api/rules", "description": "获取所有规则配置"},
             {"method": "GET", "path": "/api/rules/{task_type}", "description": "获取特定任务类型规则"},
-            {"method": "POST", "path": "/api/rules/{task_type}", "description": "更新特定任务类型规则"}
+            {"method": "POST", "path": "/api/rules/{task_type}", "description": "更新特定任务类型规则（先经过性能校验）"},
+            {"method": "POST", "path": "/api/rules/{task_type}/validate", "description": "在样本日志上校验规则性能，不保存"}
         ]
     }
 
@@ -50,6 +74,62 @@ async def report_status(report: RigReport):
     store.update_rig_data(report)
     return {"status": "success", "rig_id": report.rig_id}
 
+def apply_ingest(report: IngestReport):
+    """应用一次合并上报，返回 (是否需要全量重传板子状态, 需要全量重传温度曲线的板子)"""
+    board_resync = False
+    if report.agent_metrics:
+        store.update_agent_metrics(report.rig_id, report.agent_metrics)
+    if report.full or report.seq is None:
+        store.update_rig_data(RigReport(rig_id=report.rig_id, boards=report.boards), seq=report.seq)
+    elif not store.apply_rig_patch(report.rig_id, report.seq, report.board_patches, report.removed_boards):
+        board_resync = True
+    return board_resync, store.update_temperature_data(report.temperature_data)
+
+@app.post("/api/ingest")
+async def ingest(report: IngestReport):
+    """接收来自 Agent 的合并上报（状态 + 温度），一次往返完成
+
+    板子状态支持按 seq 增量合并；序号不连续时返回 board_resync，要求 Agent 全量重传。
+    """
+    board_resync, resync = apply_ingest(report)
+    return {
+        "status": "success",
+        "rig_id": report.rig_id,
+        "board_resync": board_resync,
+        "temperature_resync": resync
+    }
+
+@app.post("/api/ingest/batch")
+async def ingest_batch(batch: IngestBatch):
+    """接收 Agent 离线队列的批量重放，按上报顺序逐条应用"""
+    resync: Dict[str, set] = {}
+    for report in batch.reports:
+        _, temperature_resync = apply_ingest(report)
+        if temperature_resync:
+            resync.setdefault(report.rig_id, set()).update(temperature_resync)
+    return {
+        "status": "success",
+        "count": len(batch.reports),
+        "temperature_resync": {rig_id: sorted(boards) for rig_id, boards in resync.items()}
+    }
+
+@app.get("/api/metrics")
+async def get_all_agent_metrics(limit: int = 10):
+    """各台架 Agent 最近一轮的汇总指标，以及全部台架中解析最慢的板子"""
+    rigs = {
+        rig_id: {k: v for k, v in metrics.items() if k != "boards"}
+        for rig_id, metrics in store.agent_metrics_store.items()
+    }
+    return {"rigs": rigs, "slowest_boards": store.get_slowest_boards(limit)}
+
+@app.get("/api/metrics/{rig_id}")
+async def get_rig_agent_metrics(rig_id: str):
+    """特定台架 Agent 最近一轮的完整指标（含各板子的解析耗时）"""
+    metrics = store.get_agent_metrics(rig_id)
+    if not metrics:
+        raise HTTPException(status_code=404, detail="Metrics not found")
+    return metrics
+
 @app.get("/api/status")
 async def get_all_status():
     """获取所有台架的实时状态"""
@@ -71,14 +151,23 @@ async def delete_rig(rig_id: str):
         raise HTTPException(status_code=404, detail="Rig not found")
     return {"status": "success", "message": f"Rig {rig_id} deleted"}
 
+@app.get("/api/boards")
+async def find_boards(status: Optional[str] = None, task_type: Optional[str] = None, rig_id: Optional[str] = None):
+    """按状态、任务类型、台架筛选板子，每项附带所属 rig_id"""
+    # SQLite 后端查询数据库时可能等待正在执行的落盘事务，放到线程中执行，不阻塞事件循环
+    return await asyncio.to_thread(store.find_boards, status, task_type, rig_id)
+
 @app.get("/api/rules/{task_type}")
-async def get_rules(task_type: str):
-    """获取特定任务类型的规则配置"""
+async def get_rules(task_type: str, request: Request):
+    """获取特定任务类型的规则配置，支持 If-None-Match 条件请求（未变化时返回 304）"""
     try:
         # 对URL编码的任务类型进行解码
         decoded_task_type = urllib.parse.unquote(task_type)
         rules = store.get_rules_by_task_type(decoded_task_type)
-        return rules
+        etag = store.get_rules_etag(decoded_task_type)
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+        return JSONResponse(content=jsonable_encoder(rules), headers={"ETag": etag})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get rules: {str(e)}")
 
@@ -104,21 +193,39 @@ async def report_temperature_data(data: Dict[str, Any]):
         raise HTTPException(status_code=500, detail=f"Failed to update temperature data: {str(e)}")
 
 @app.get("/api/temperature/{rig_id}/{board_id}")
-async def get_temperature_curve(rig_id: str, board_id: str):
-    """获取指定板子的温度曲线数据"""
+async def get_temperature_curve(rig_id: str, board_id: str,
+                                start: Optional[str] = Query(None, alias="from"),
+                                end: Optional[str] = Query(None, alias="to"),
+                                max_points: Optional[int] = Query(None, ge=2, le=100000)):
+    """获取指定板子的温度曲线数据
+
+    from / to（ISO 时间）截取时间范围；max_points 限制返回的点数，超过时按时间分段合并
+    （保留最高/最低温度峰值），图表的数据量与测试运行时长无关。结果按板子缓存，
+    有新的温度上报时失效。
+    """
     try:
-        temp_data = store.get_temperature_data(rig_id, board_id)
+        temp_data = store.query_temperature(rig_id, board_id, start, end, max_points)
         if not temp_data:
             raise HTTPException(status_code=404, detail="Temperature data not found")
         return temp_data
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid time range: {str(e)}")
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get temperature data: {str(e)}")
 
+@app.post("/api/rules/{task_type}/validate")
+async def validate_rules(task_type: str, rules: RuleConfig):
+    """在样本日志上试运行规则中的正则，返回各条正则的耗时及是否通过，不保存规则"""
+    return await asyncio.to_thread(rule_validation.validate_rules, rules.rules)
+
 @app.post("/api/rules/{task_type}")
 async def update_rules(task_type: str, rules: RuleConfig):
-    """更新特定任务类型的规则配置"""
+    """更新特定任务类型的规则配置；正则无法编译、吞吐量过低或可能灾难性回溯时返回 422，规则不保存"""
+    report = await asyncio.to_thread(rule_validation.validate_rules, rules.rules)
+    if not report["ok"]:
+        raise HTTPException(status_code=422, detail={"message": "Rules failed validation", "report": report})
     try:
         # 对URL编码的任务类型进行解码
         decoded_task_type = urllib.parse.unquote(task_type)
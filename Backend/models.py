@@ -19,6 +19,12 @@ class BoardStatus(BaseModel):
     last_kernel_log: Optional[str] = None
     task_type: Optional[str] = None
     current_loop: int = 0
+    total_loops: int = 0
+    # 循环启动任务：当前循环开始时间、上一次/平均循环耗时（秒）、每小时循环次数
+    loop_started_at: Optional[str] = None
+    last_loop_seconds: Optional[float] = None
+    avg_loop_seconds: Optional[float] = None
+    loops_per_hour: Optional[float] = None
     is_hang: bool = False
     temp_warning: bool = False
     remaining_seconds: int = 0
@@ -47,7 +53,29 @@ class TemperatureData(BaseModel):
     rig_id: str
     board_id: str
     temp_points: List[dict] = []  # [{"timestamp": "2026-02-26T12:00:00", "temperature": 45.2}, ...]
+    # True 表示 temp_points 只包含有变化的时间窗口，需要按 timestamp 合并到已有曲线
+    incremental: bool = False
     temp_min: float = 0.0
     temp_max: float = 0.0
     current_temp: float = 0.0
     last_updated: datetime = Field(default_factory=datetime.now)
+
+class IngestReport(BaseModel):
+    """合并上报：一次请求同时携带台架状态和温度数据
+
+    full 为 True（或未携带 seq 的旧版 Agent）时 boards 为全量状态；否则只携带
+    board_patches（每块板子变化的字段）和 removed_boards，按 seq 顺序合并。
+    """
+    rig_id: str
+    boards: List[BoardStatus] = []
+    temperature_data: List[TemperatureData] = []
+    seq: Optional[int] = None
+    full: bool = True
+    board_patches: Dict[str, Dict[str, Any]] = {}
+    removed_boards: List[str] = []
+    # Agent 自身的性能指标：本轮各阶段耗时、读取字节数、匹配数、峰值内存及各板子的解析耗时
+    agent_metrics: Optional[Dict[str, Any]] = None
+
+class IngestBatch(BaseModel):
+    """Agent 离线队列重放：按时间顺序排列的多轮全量上报"""
+    reports: List[IngestReport]
@@ -0,0 +1,194 @@
+"""规则性能校验
+
+规则中的正则由 Agent 在数 GB 的日志上执行，一条灾难性回溯的正则会卡住所有 Agent。
+保存规则前在样本日志（RULE_SAMPLES_DIR 下的 *.log）和一组容易触发回溯的构造行上
+逐条试运行，吞吐量低于阈值或超时的规则被拒绝。试运行在独立子进程中进行，超时时
+直接结束子进程，不影响 API 服务。
+"""
+import multiprocessing
+import os
+import re
+import time
+from typing import List, Optional, Tuple
+
+RULE_SAMPLES_DIR = os.environ.get(
+    "RULE_SAMPLES_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "rule_samples")
+)
+# 样本重复拼接到至少这个大小再计时，结果更稳定；样本总量上限
+RULE_BENCHMARK_BYTES = 2 * 1024 * 1024
+RULE_SAMPLE_MAX_BYTES = 16 * 1024 * 1024
+# 每 MB 样本允许的耗时（毫秒），默认 100，即吞吐量不低于 10MB/s
+RULE_MAX_MS_PER_MB = float(os.environ.get("RULE_MAX_MS_PER_MB", 100))
+# 全部构造行允许的总耗时（毫秒）
+RULE_ADVERSARIAL_BUDGET_MS = float(os.environ.get("RULE_ADVERSARIAL_BUDGET_MS", 100))
+# 单条正则试运行的硬超时（秒），超过后结束子进程
+RULE_PATTERN_TIMEOUT = float(os.environ.get("RULE_PATTERN_TIMEOUT", 3))
+# 子进程启动超时（秒）
+WORKER_START_TIMEOUT = 30
+
+TIMESTAMP_PREFIX = "[2026-01-01 08:00:00] "
+
+
+def adversarial_lines() -> List[str]:
+    """容易触发回溯的构造行：同类字符的长串后接一个不匹配的结尾
+
+    短串用于暴露指数级回溯（如 (a+)+$），长串用于暴露多项式级回溯（如 .*.*x）。
+    """
+    lines = []
+    for chunk in ("a", "A", "0", " ", "\t", "a ", "0:", "-", ".", "_", "[", "aA0_"):
+        for repeat in (32, 4096):
+            body = chunk * (repeat // len(chunk))
+            lines.append(body + "!")
+            lines.append(TIMESTAMP_PREFIX + body + "!")
+    return lines
+
+
+def load_samples(samples_dir: str = RULE_SAMPLES_DIR) -> str:
+    """读取样本日志，并重复拼接到至少 RULE_BENCHMARK_BYTES"""
+    parts, size = [], 0
+    try:
+        names = sorted(name for name in os.listdir(samples_dir) if name.endswith(".log"))
+    except OSError:
+        names = []
+    for name in names:
+        with open(os.path.join(samples_dir, name), "r", encoding="utf-8", errors="ignore") as f:
+            content = f.read(RULE_SAMPLE_MAX_BYTES - size)
+        parts.append(content if content.endswith("\n") else content + "\n")
+        size += len(content)
+        if size >= RULE_SAMPLE_MAX_BYTES:
+            break
+    text = "".join(parts)
+    if text and len(text) < RULE_BENCHMARK_BYTES:
+        text *= -(-RULE_BENCHMARK_BYTES // len(text))
+    return text
+
+
+def extract_patterns(rules: dict) -> Tuple[List[Tuple[str, str, int]], List[dict]]:
+    """规则中由 Agent 按正则执行的字段 [(字段, 正则, flags)]，以及格式错误 [{field, error}]
+
+    error_patterns 与 critical_keywords 按字面量匹配，耗时与内容无关，只检查类型。
+    """
+    patterns, errors = [], []
+
+    def add(field: str, value, flags: int = 0):
+        if value is None:
+            return
+        if not isinstance(value, str):
+            errors.append({"field": field, "error": "正则必须是字符串"})
+            return
+        patterns.append((field, value, flags))
+
+    time_rules = rules.get("time_calculation") or {}
+    add("time_calculation.script_pattern", time_rules.get("script_pattern"))
+    add("time_calculation.pattern", time_rules.get("pattern"))
+    add("loop_detection.pattern", (rules.get("loop_detection") or {}).get("pattern"))
+    for i, pattern in enumerate(rules.get("script_error_patterns") or []):
+        add(f"script_error_patterns[{i}]", pattern, re.IGNORECASE)
+
+    for i, rule in enumerate(rules.get("error_patterns") or []):
+        if not isinstance(rule, dict) or not isinstance(rule.get("pattern", ""), str):
+            errors.append({"field": f"error_patterns[{i}]", "error": "需要 {name, pattern} 且 pattern 为字符串"})
+    for i, keyword in enumerate(rules.get("critical_keywords") or []):
+        if not isinstance(keyword, str):
+            errors.append({"field": f"critical_keywords[{i}]", "error": "关键词必须是字符串"})
+    return patterns, errors
+
+
+def _time_pattern(regex: re.Pattern, text: str) -> float:
+    started = time.perf_counter()
+    for _ in regex.finditer(text):
+        pass
+    return (time.perf_counter() - started) * 1000
+
+
+def _benchmark(pattern: str, flags: int, text: str, adversarial: str) -> Tuple[float, float]:
+    """返回 (样本上每 MB 耗时 ms, 构造行总耗时 ms)"""
+    regex = re.compile(pattern, flags)
+    sample_ms = _time_pattern(regex, text)
+    return sample_ms / max(len(text.encode("utf-8")) / 1024 / 1024, 1e-9), _time_pattern(regex, adversarial)
+
+
+def _benchmark_worker(patterns: List[Tuple[str, int]], text: str, adversarial: str, conn):
+    # 用 Pipe 同步发送结果：正则执行期间不释放 GIL，Queue 的后台发送线程无法及时发出数据
+    conn.send(None)
+    for pattern, flags in patterns:
+        conn.send(_benchmark(pattern, flags, text, adversarial))
+
+
+def _run_isolated(patterns: List[Tuple[str, int]], text: str, adversarial: str) -> List[Optional[Tuple[float, float]]]:
+    """在子进程中依次试运行；某条正则超时则结束子进程（结果记为 None），用新进程继续后面的正则"""
+    ctx = multiprocessing.get_context("spawn")
+    results: List[Optional[Tuple[float, float]]] = []
+    while len(results) < len(patterns):
+        pending = patterns[len(results):]
+        receiver, sender = ctx.Pipe(duplex=False)
+        process = ctx.Process(target=_benchmark_worker, args=(pending, text, adversarial, sender), daemon=True)
+        process.start()
+        sender.close()
+        try:
+            if not receiver.poll(WORKER_START_TIMEOUT):
+                raise TimeoutError
+            receiver.recv()
+            for _ in pending:
+                if not receiver.poll(RULE_PATTERN_TIMEOUT):
+                    raise TimeoutError
+                results.append(receiver.recv())
+        except (TimeoutError, EOFError):
+            # 超时或子进程异常退出（如回溯耗尽内存），都视为当前这条正则未通过
+            results.append(None)
+        finally:
+            if process.is_alive():
+                process.kill()
+            process.join()
+            receiver.close()
+    return results
+
+
+def validate_rules(rules: dict, samples_dir: str = RULE_SAMPLES_DIR) -> dict:
+    """校验一份规则，返回报告：
+
+    {ok, sample_bytes, max_ms_per_mb, adversarial_budget_ms,
+     results: [{field, pattern, ok, error, ms_per_mb, adversarial_ms}]}
+    """
+    patterns, errors = extract_patterns(rules)
+    results = [{"field": e["field"], "pattern": None, "ok": False, "error": e["error"]} for e in errors]
+
+    compiled = []
+    for field, pattern, flags in patterns:
+        try:
+            re.compile(pattern, flags)
+        except re.error as e:
+            results.append({"field": field, "pattern": pattern, "ok": False, "error": f"正则无法编译: {e}"})
+            continue
+        compiled.append((field, pattern, flags))
+
+    text = load_samples(samples_dir)
+    adversarial = "\n".join(adversarial_lines()) + "\n"
+    if compiled:
+        jobs = [(pattern, flags) for _, pattern, flags in compiled]
+        try:
+            timings = _run_isolated(jobs, text, adversarial)
+        except OSError:
+            # 运行环境不支持子进程（如部分 Serverless 平台）：在当前进程内试运行，无法中断超时的正则
+            timings = [_benchmark(pattern, flags, text, adversarial) for pattern, flags in jobs]
+        for (field, pattern, _), timing in zip(compiled, timings):
+            entry = {"field": field, "pattern": pattern, "ok": True, "error": None}
+            if timing is None:
+                entry.update(ok=False, error=f"试运行超过 {RULE_PATTERN_TIMEOUT:g} 秒，可能存在灾难性回溯")
+            else:
+                ms_per_mb, adversarial_ms = timing
+                entry.update(ms_per_mb=round(ms_per_mb, 2), adversarial_ms=round(adversarial_ms, 2))
+                if ms_per_mb > RULE_MAX_MS_PER_MB:
+                    entry.update(ok=False, error=f"每 MB 日志耗时 {ms_per_mb:.1f}ms，超过上限 {RULE_MAX_MS_PER_MB:g}ms")
+                elif adversarial_ms > RULE_ADVERSARIAL_BUDGET_MS:
+                    entry.update(ok=False, error=f"构造行耗时 {adversarial_ms:.1f}ms，超过上限 "
+                                                 f"{RULE_ADVERSARIAL_BUDGET_MS:g}ms，可能存在回溯问题")
+            results.append(entry)
+
+    return {
+        "ok": all(r["ok"] for r in results),
+        "sample_bytes": len(text.encode("utf-8")),
+        "max_ms_per_mb": RULE_MAX_MS_PER_MB,
+        "adversarial_budget_ms": RULE_ADVERSARIAL_BUDGET_MS,
+        "results": results
+    }
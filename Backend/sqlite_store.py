@@ -0,0 +1,362 @@
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from models import BoardStatus, RigReport, TemperatureData
+from timeseries import TemperatureSeries
+from write_behind import DirtyRigs, WriteBehind
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rigs (
+    rig_id TEXT PRIMARY KEY,
+    last_report_at TEXT
+);
+CREATE TABLE IF NOT EXISTS boards (
+    rig_id TEXT NOT NULL,
+    board_id TEXT NOT NULL,
+    -- 板子在台架中的顺序，与 Agent 上报的顺序一致
+    position INTEGER NOT NULL,
+    status TEXT,
+    task_type TEXT,
+    -- BoardStatus 的完整 JSON
+    data TEXT NOT NULL,
+    PRIMARY KEY (rig_id, board_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_boards_status ON boards (status, rig_id);
+CREATE INDEX IF NOT EXISTS idx_boards_task_type ON boards (task_type, status);
+CREATE TABLE IF NOT EXISTS temperature (
+    rig_id TEXT NOT NULL,
+    board_id TEXT NOT NULL,
+    temp_min REAL,
+    temp_max REAL,
+    current_temp REAL,
+    last_updated TEXT,
+    PRIMARY KEY (rig_id, board_id)
+) WITHOUT ROWID;
+-- 每个温度窗口一行，(rig_id, board_id, ts) 上的主键同时用作时间范围查询的索引
+CREATE TABLE IF NOT EXISTS temperature_points (
+    rig_id TEXT NOT NULL,
+    board_id TEXT NOT NULL,
+    ts TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (rig_id, board_id, ts)
+) WITHOUT ROWID;
+"""
+
+
+class SqliteStore:
+    """SQLite 存储后端（WAL 模式）
+
+    台架、板子和温度点分表存储。台架的当前状态缓存在内存中（与板子数量成正比），温度
+    历史只保存在数据库中：按状态/任务类型筛选和温度时间范围查询都走索引。修改先记入内存，
+    由后台线程按 flush_interval 合并为一个事务写入，只写入有变化的行（见 write_behind.py）。
+
+    lock 保护内存状态，db_lock 串行化共用的数据库连接。落盘时只在 lock 内生成要执行的
+    语句，执行事务时不持有 lock，上报不会等待数据库写入；正在写入的温度数据保留在
+    flushing_temperature 中，有变化的台架记在 dirty_rigs / flushing_rigs 中，读取时与数据库
+    中的数据合并，查询不需要先落盘。
+    """
+
+    def __init__(self, path: str, flush_interval: float = 1.0, flush_max_dirty: int = 500):
+        self.path = path
+        self.lock = threading.RLock()
+        self.db_lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        # WAL 模式下 NORMAL 在进程崩溃时不会丢失已提交的事务，只在断电时可能丢失最近的事务
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        # key: rig_id
+        self.rigs: Dict[str, RigReport] = self._load_rigs()
+        self.dirty_rigs = DirtyRigs()
+        # 正在写入（已从 dirty_rigs 取出、事务尚未提交）的台架
+        self.flushing_rigs = set()
+        # 只有 last_report_at 变化的台架
+        self.touched_rigs = set()
+        # 已有温度曲线的板子 (rig_id, board_id)，用于判断增量上报是否需要全量重传
+        self.temperature_keys = {key for key in self.conn.execute("SELECT rig_id, board_id FROM temperature")}
+        # 尚未写入的温度数据，同一块板子的多次上报合并；incremental 为 False 时替换整条曲线
+        self.pending_temperature: Dict[Tuple[str, str], TemperatureData] = {}
+        self.flushing_temperature: Dict[Tuple[str, str], TemperatureData] = {}
+        self.writer = WriteBehind(self.flush, flush_interval, flush_max_dirty, "sqlite-store")
+
+    def _transaction(self):
+        return _Transaction(self)
+
+    def flush(self):
+        """把上次落盘以来的修改在一个事务中写入（由后台线程调用）"""
+        statements: List[Tuple[str, list]] = []
+        with self.lock:
+            full, boards = self.dirty_rigs.take()
+            self.flushing_rigs = full | set(boards)
+            for rig_id in full:
+                self._write_rig(statements, rig_id)
+            for rig_id, board_ids in boards.items():
+                self._write_boards(statements, rig_id, board_ids)
+            for rig_id in self.touched_rigs - full - set(boards):
+                self._write_report_at(statements, rig_id)
+            self.touched_rigs = set()
+            self.flushing_temperature, self.pending_temperature = self.pending_temperature, {}
+        # 待写入的温度数据不会再被修改（新的上报会替换 pending_temperature 中的对象），在锁外序列化
+        for temp_data in self.flushing_temperature.values():
+            self._write_temperature(statements, temp_data)
+        try:
+            with self.db_lock, self._transaction():
+                for sql, rows in statements:
+                    self.conn.executemany(sql, rows)
+        except Exception:
+            # 事务已回滚：重新标记这些修改，下次落盘时再写入
+            with self.lock:
+                for rig_id in full | set(boards):
+                    self.dirty_rigs.put(rig_id)
+                for key, temp_data in self.pending_temperature.items():
+                    self.flushing_temperature[key] = self._merge_temperature(self.flushing_temperature.get(key),
+                                                                             temp_data)
+                self.pending_temperature, self.flushing_temperature = self.flushing_temperature, {}
+                self.flushing_rigs = set()
+            raise
+        with self.lock:
+            self.flushing_temperature = {}
+            self.flushing_rigs = set()
+
+    # ===== 台架状态 =====
+
+    @staticmethod
+    def _board_row(rig_id: str, position: int, board: BoardStatus) -> tuple:
+        return rig_id, board.board_id, position, board.status, board.task_type, board.model_dump_json()
+
+    def _load_rigs(self) -> Dict[str, RigReport]:
+        boards: Dict[str, List[BoardStatus]] = {}
+        for rig_id, data in self.conn.execute("SELECT rig_id, data FROM boards ORDER BY rig_id, position"):
+            boards.setdefault(rig_id, []).append(BoardStatus.model_validate_json(data))
+        return {
+            rig_id: RigReport(rig_id=rig_id, boards=boards.get(rig_id, []),
+                              last_report_at=datetime.fromisoformat(at) if at else None)
+            for rig_id, at in self.conn.execute("SELECT rig_id, last_report_at FROM rigs")
+        }
+
+    def _write_report_at(self, statements: list, rig_id: str):
+        report = self.rigs.get(rig_id)
+        if report is not None:
+            statements.append(("UPDATE rigs SET last_report_at = ? WHERE rig_id = ?",
+                               [(report.last_report_at.isoformat(), rig_id)]))
+
+    def _write_rig(self, statements: list, rig_id: str):
+        """替换台架的全部板子；台架已删除时删除"""
+        statements.append(("DELETE FROM boards WHERE rig_id = ?", [(rig_id,)]))
+        report = self.rigs.get(rig_id)
+        if report is None:
+            statements.append(("DELETE FROM rigs WHERE rig_id = ?", [(rig_id,)]))
+            return
+        statements.append(("INSERT OR REPLACE INTO rigs (rig_id, last_report_at) VALUES (?, ?)",
+                           [(rig_id, report.last_report_at.isoformat() if report.last_report_at else None)]))
+        statements.append(("INSERT INTO boards VALUES (?, ?, ?, ?, ?, ?)",
+                           [self._board_row(rig_id, i, board) for i, board in enumerate(report.boards)]))
+
+    def _write_boards(self, statements: list, rig_id: str, board_ids):
+        """写入有变化的板子的当前状态，删除已移除的板子"""
+        report = self.rigs.get(rig_id)
+        if report is None:
+            return
+        self._write_report_at(statements, rig_id)
+        current = {board.board_id: board for board in report.boards if board.board_id in board_ids}
+        # 已有的板子保留原来的位置，新板子排在最后
+        statements.append((
+            "INSERT INTO boards VALUES (?, ?, (SELECT COALESCE(MAX(position) + 1, 0) FROM boards WHERE rig_id = ?), "
+            "?, ?, ?) ON CONFLICT (rig_id, board_id) DO UPDATE SET "
+            "status = excluded.status, task_type = excluded.task_type, data = excluded.data",
+            [(rig_id, board.board_id, rig_id, board.status, board.task_type, board.model_dump_json())
+             for board in current.values()]
+        ))
+        statements.append(("DELETE FROM boards WHERE rig_id = ? AND board_id = ?",
+                           [(rig_id, board_id) for board_id in set(board_ids) - set(current)]))
+
+    def get_rig(self, rig_id: str) -> Optional[RigReport]:
+        return self.rigs.get(rig_id)
+
+    def list_rigs(self) -> List[RigReport]:
+        return list(self.rigs.values())
+
+    def put_rig(self, report: RigReport):
+        """全量上报：替换台架的全部板子"""
+        with self.lock:
+            self.rigs[report.rig_id] = report
+            self.dirty_rigs.put(report.rig_id)
+        self.writer.mark(len(report.boards) or 1)
+
+    def put_boards(self, rig_id: str, boards: Dict[str, BoardStatus], removed: List[str], at: datetime):
+        """增量上报：只写入有变化的板子"""
+        with self.lock:
+            report = self.rigs[rig_id]
+            merged = {board.board_id: board for board in report.boards}
+            merged.update(boards)
+            for board_id in removed:
+                merged.pop(board_id, None)
+            report.boards = list(merged.values())
+            report.last_report_at = at
+            self.dirty_rigs.patch(rig_id, list(boards) + list(removed))
+            self.touched_rigs.add(rig_id)
+        self.writer.mark(len(boards) + len(removed) or 1)
+
+    def delete_rig(self, rig_id: str) -> bool:
+        with self.lock:
+            if self.rigs.pop(rig_id, None) is None:
+                return False
+            self.dirty_rigs.put(rig_id)
+        self.writer.mark()
+        return True
+
+    def find_boards(self, status: Optional[str] = None, task_type: Optional[str] = None,
+                    rig_id: Optional[str] = None) -> List[Tuple[str, BoardStatus]]:
+        conditions, params = [], []
+        for column, value in (("status", status), ("task_type", task_type), ("rig_id", rig_id)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        sql = "SELECT rig_id, data FROM boards"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        # 尚未落盘的台架：数据库中的行可能已过期，这些台架的板子改从内存中的当前状态筛选
+        with self.lock:
+            unwritten = self.flushing_rigs | self.dirty_rigs.full | set(self.dirty_rigs.boards)
+            if rig_id is not None:
+                unwritten &= {rig_id}
+            boards = [
+                (rid, board)
+                for rid in unwritten if rid in self.rigs
+                for board in self.rigs[rid].boards
+                if (status is None or board.status == status) and (task_type is None or board.task_type == task_type)
+            ]
+        with self.db_lock:
+            boards += [(rid, BoardStatus.model_validate_json(data))
+                       for rid, data in self.conn.execute(sql + " ORDER BY rig_id, position", params)
+                       if rid not in unwritten]
+        # 稳定排序，同一台架内保持板子顺序
+        boards.sort(key=lambda item: item[0])
+        return boards
+
+    # ===== 温度数据 =====
+
+    def _unwritten(self, key: Tuple[str, str]) -> List[TemperatureData]:
+        """尚未写入数据库的温度数据，按写入顺序（正在写入的在前）"""
+        with self.lock:
+            return [layer[key] for layer in (self.flushing_temperature, self.pending_temperature) if key in layer]
+
+    def get_temperature(self, rig_id: str, board_id: str) -> Optional[TemperatureData]:
+        temp_data = self.temperature_summary(rig_id, board_id)
+        if temp_data is not None:
+            temp_data.temp_points = self.temperature_range(rig_id, board_id)
+        return temp_data
+
+    def temperature_summary(self, rig_id: str, board_id: str) -> Optional[TemperatureData]:
+        """温度汇总（temp_points 为空）"""
+        unwritten = self._unwritten((rig_id, board_id))
+        if unwritten:
+            return unwritten[-1].model_copy(update={"temp_points": [], "incremental": False})
+        with self.db_lock:
+            row = self.conn.execute(
+                "SELECT temp_min, temp_max, current_temp, last_updated FROM temperature WHERE rig_id = ? AND board_id = ?",
+                (rig_id, board_id)
+            ).fetchone()
+        if row is None:
+            return None
+        return TemperatureData(
+            rig_id=rig_id, board_id=board_id,
+            temp_min=row[0], temp_max=row[1], current_temp=row[2],
+            last_updated=datetime.fromisoformat(row[3]) if row[3] else datetime.now()
+        )
+
+    def put_temperature(self, reports: List[TemperatureData]) -> List[str]:
+        """保存一批温度数据：全量上报替换整条曲线，增量上报按 timestamp 写入有变化的窗口；
+        返回没有已有曲线、需要全量重传的板子"""
+        resync = []
+        with self.lock:
+            for temp_data in reports:
+                key = (temp_data.rig_id, temp_data.board_id)
+                if temp_data.incremental and key not in self.temperature_keys:
+                    resync.append(temp_data.board_id)
+                    temp_data.incremental = False
+                self.temperature_keys.add(key)
+                self.pending_temperature[key] = self._merge_temperature(self.pending_temperature.get(key), temp_data)
+        self.writer.mark(len(reports))
+        return resync
+
+    @staticmethod
+    def _merge_temperature(older: Optional[TemperatureData], newer: TemperatureData) -> TemperatureData:
+        """合并同一块板子两次尚未写入的上报：增量上报合并到之前的上报中，保留其是否替换整条曲线"""
+        if older is None or not newer.incremental:
+            return newer
+        merged = {p.get("timestamp"): p for p in older.temp_points}
+        merged.update((p.get("timestamp"), p) for p in newer.temp_points)
+        newer.temp_points = [merged[ts] for ts in sorted(merged)]
+        newer.incremental = older.incremental
+        return newer
+
+    def _write_temperature(self, statements: list, temp_data: TemperatureData):
+        key = (temp_data.rig_id, temp_data.board_id)
+        if not temp_data.incremental:
+            statements.append(("DELETE FROM temperature_points WHERE rig_id = ? AND board_id = ?", [key]))
+        statements.append((
+            "INSERT OR REPLACE INTO temperature VALUES (?, ?, ?, ?, ?, ?)",
+            [key + (temp_data.temp_min, temp_data.temp_max, temp_data.current_temp, temp_data.last_updated.isoformat())]
+        ))
+        statements.append((
+            "INSERT OR REPLACE INTO temperature_points VALUES (?, ?, ?, ?)",
+            [key + (p.get("timestamp", ""), json.dumps(p, ensure_ascii=False)) for p in temp_data.temp_points]
+        ))
+
+    def temperature_range(self, rig_id: str, board_id: str, start: Optional[str] = None,
+                          end: Optional[str] = None) -> List[dict]:
+        """[start, end] 范围内的温度点，按时间排序（包含尚未写入的点）"""
+        sql = "SELECT data FROM temperature_points WHERE rig_id = ? AND board_id = ?"
+        params: list = [rig_id, board_id]
+        if start is not None:
+            sql += " AND ts >= ?"
+            params.append(start)
+        if end is not None:
+            sql += " AND ts <= ?"
+            params.append(end)
+        unwritten = self._unwritten((rig_id, board_id))
+        if not unwritten:
+            with self.db_lock:
+                return [json.loads(data) for (data,) in self.conn.execute(sql + " ORDER BY ts", params)]
+        points = {}
+        if all(temp_data.incremental for temp_data in unwritten):
+            with self.db_lock:
+                stored = [json.loads(data) for (data,) in self.conn.execute(sql, params)]
+            points = {p.get("timestamp", ""): p for p in stored}
+        # 从最后一次全量上报开始，按顺序合并尚未写入的数据
+        for temp_data in unwritten:
+            if not temp_data.incremental:
+                points = {}
+            points.update(
+                (p.get("timestamp", ""), p) for p in temp_data.temp_points
+                if (start is None or p.get("timestamp", "") >= start) and (end is None or p.get("timestamp", "") <= end)
+            )
+        return [points[ts] for ts in sorted(points)]
+
+    def temperature_series(self, rig_id: str, board_id: str, start: Optional[str] = None,
+                           end: Optional[str] = None) -> TemperatureSeries:
+        return TemperatureSeries.from_points(self.temperature_range(rig_id, board_id, start, end))
+
+    def close(self):
+        """停止后台线程，落盘尚未写入的修改"""
+        self.writer.close()
+        with self.db_lock:
+            self.conn.close()
+
+
+class _Transaction:
+    """BEGIN / COMMIT，异常时 ROLLBACK（连接为 autocommit 模式，事务显式管理）"""
+
+    def __init__(self, store: SqliteStore):
+        self.conn = store.conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN")
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
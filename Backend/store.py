@@ -1,150 +1,227 @@
+import atexit
+import hashlib
 import json
 import os
-from typing import Dict, List
-from models import RigReport, RuleConfig, TemperatureData
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from pydantic import ValidationError
+from models import BoardStatus, RigReport, RuleConfig, TemperatureData
+from timeseries import timestamp_iso, timestamp_us
 
 # 持久化文件路径
 STATE_FILE = "rig_status_v1.json"
 RULES_FILE = "rules_config.json"
+# 台架状态的追加写日志：每次上报追加一条记录，累计 WAL_COMPACT_RECORDS 条或 WAL_COMPACT_MB 后合并进 STATE_FILE 快照
+STATE_WAL_FILE = "rig_status_v1.wal"
+WAL_COMPACT_RECORDS = int(os.environ.get("WAL_COMPACT_RECORDS", 1000))
+WAL_COMPACT_MB = float(os.environ.get("WAL_COMPACT_MB", 32))
+# 每条记录写入后 fsync，断电时也不丢失已确认的上报（默认只保证进程崩溃时不丢失）
+WAL_FSYNC = os.environ.get("WAL_FSYNC", "").lower() in ("1", "true", "yes")
+# 温度汇总的快照与追加写日志（只记录有变化的板子，与台架状态共用合并阈值），以及每块板子一个的温度曲线分段文件所在目录
+TEMPERATURE_FILE = "temperature_data.json"
+TEMPERATURE_WAL_FILE = "temperature_data.wal"
+TEMPERATURE_DIR = os.environ.get("TEMPERATURE_DIR", "temperature_series")
+
+# 台架状态和温度数据的存储后端：json（默认，内存 + 文件）或 sqlite（STORE_SQLITE_FILE）
+STORE_BACKEND = os.environ.get("STORE_BACKEND", "json").lower()
+STORE_SQLITE_FILE = os.environ.get("STORE_SQLITE_FILE", "titan_node.db")
+# 后台落盘：修改先记入内存，每 PERSIST_INTERVAL 秒或累计 PERSIST_MAX_DIRTY 处修改后合并写入磁盘；
+# 进程崩溃时最多丢失最近 PERSIST_INTERVAL 秒的上报。设为 0 时每次上报同步写入
+PERSIST_INTERVAL = float(os.environ.get("PERSIST_INTERVAL", 1.0))
+PERSIST_MAX_DIRTY = int(os.environ.get("PERSIST_MAX_DIRTY", 500))
+
+def create_backend():
+    if STORE_BACKEND == "sqlite":
+        from sqlite_store import SqliteStore
+        return SqliteStore(STORE_SQLITE_FILE, PERSIST_INTERVAL, PERSIST_MAX_DIRTY)
+    if STORE_BACKEND != "json":
+        raise ValueError(f"Unknown STORE_BACKEND: {STORE_BACKEND}")
+    from json_store import JsonStore
+    # Vercel Serverless环境是只读的，只读取已有文件
+    return JsonStore(STATE_FILE, STATE_WAL_FILE, TEMPERATURE_FILE, TEMPERATURE_WAL_FILE, TEMPERATURE_DIR,
+                     WAL_COMPACT_RECORDS,
+                     int(WAL_COMPACT_MB * 1024 * 1024), WAL_FSYNC, readonly=bool(os.environ.get("VERCEL")),
+                     flush_interval=PERSIST_INTERVAL, flush_max_dirty=PERSIST_MAX_DIRTY)
+
+backend = create_backend()
+_closed = False
+
+def close():
+    """落盘尚未写入的修改并关闭存储后端（服务退出时调用，可重复调用）"""
+    global _closed
+    if not _closed:
+        _closed = True
+        backend.close()
+
+atexit.register(close)
 
-# key: rig_id, value: RigReport
-data_store: Dict[str, RigReport] = {}
+# key: rig_id, value: 最近一次成功应用的上报序号（仅在内存中，重启后要求 Agent 全量重传）
+rig_sequences: Dict[str, int] = {}
 
 # key: task_type, value: RuleConfig
 rules_store: Dict[str, RuleConfig] = {}
 
-def save_to_disk():
-    """将内存数据序列化到磁盘（Vercel环境跳过）"""
-    # Vercel Serverless环境是只读的，跳过文件写入
-    import os
-    if os.environ.get("VERCEL"):
-        return  # Vercel环境不写入文件
-    
-    try:
-        serializable_data = {}
-        for rid, report in data_store.items():
-            report_dict = report.dict()
-            # 处理datetime对象的序列化
-            if hasattr(report, 'last_report_at') and report.last_report_at:
-                report_dict["last_report_at"] = report.last_report_at.isoformat()
-            # 处理boards列表中的datetime对象
-            if "boards" in report_dict and report_dict["boards"]:
-                for board in report_dict["boards"]:
-                    if hasattr(board, 'kernel_heartbeat') and board.kernel_heartbeat:
-                        board.kernel_heartbeat = board.kernel_heartbeat.isoformat()
-                    if hasattr(board, 'cm55_heartbeat') and board.cm55_heartbeat:
-                        board.cm55_heartbeat = board.cm55_heartbeat.isoformat()
-            serializable_data[rid] = report_dict
-            
-        with open(STATE_FILE, "w", encoding="utf-8") as f:
-            json.dump(serializable_data, f, ensure_ascii=False, indent=4, default=str)
-    except Exception as e:
-        print(f"Failed to save state: {e}")
+def update_rig_data(report: RigReport, seq: Optional[int] = None):
+    from datetime import datetime
+    report.last_report_at = datetime.now()
+    if seq is None:
+        rig_sequences.pop(report.rig_id, None)
+    else:
+        rig_sequences[report.rig_id] = seq
+    backend.put_rig(report)
 
-def load_from_disk():
-    """从磁盘恢复数据"""
-    global data_store
-    if not os.path.exists(STATE_FILE):
-        return
-    
+def apply_rig_patch(rig_id: str, seq: int, patches: Dict[str, Dict[str, Any]], removed: List[str]) -> bool:
+    """把增量上报合并到已存储的台架状态
+
+    只校验和替换有变化的板子。没有全量基线或序号不连续时不做修改并返回 False，
+    由 Agent 下一轮全量重传。
+    """
+    from datetime import datetime
+    if rig_sequences.get(rig_id) != seq - 1:
+        return False
+    report = backend.get_rig(rig_id)
+    if report is None:
+        return False
+
+    now = datetime.now()
+    boards = {board.board_id: board for board in report.boards}
     try:
-        from datetime import datetime
-        with open(STATE_FILE, "r", encoding="utf-8") as f:
-            raw_data = json.load(f)
-            new_store = {}
-            for rid, item in raw_data.items():
-                # 恢复 datetime
-                if item.get("last_report_at"):
-                    item["last_report_at"] = datetime.fromisoformat(item["last_report_at"])
-                new_store[rid] = RigReport(**item)
-            data_store = new_store
-    except Exception as e:
-        print(f"Failed to load state: {e}")
+        updated = {}
+        for board_id, patch in patches.items():
+            base = boards[board_id].dict() if board_id in boards else {}
+            base.update(patch)
+            base["board_id"] = board_id
+            base["last_updated"] = now
+            updated[board_id] = BoardStatus(**base)
+    except ValidationError as e:
+        print(f"Invalid board patch from {rig_id}: {e}")
+        return False
 
-# 初始加载
-load_from_disk()
+    backend.put_boards(rig_id, updated, removed, now)
+    rig_sequences[rig_id] = seq
+    return True
 
-def update_rig_data(report: RigReport):
-    from datetime import datetime
-    report.last_report_at = datetime.now()
-    data_store[report.rig_id] = report
-    save_to_disk() # 每次更新都保存
+def _set_seconds_since_report(report: RigReport, now) -> RigReport:
+    if report.last_report_at:
+        report.seconds_since_report = (now - report.last_report_at).total_seconds()
+    return report
 
 def get_all_rigs():
     from datetime import datetime
     now = datetime.now()
-    for report in data_store.values():
-        if report.last_report_at:
-            report.seconds_since_report = (now - report.last_report_at).total_seconds()
-    
     # 按SIP01 SIP02从左往右排序
-    sorted_rigs = sorted(data_store.values(), key=lambda x: x.rig_id)
-    return sorted_rigs
+    return sorted((_set_seconds_since_report(r, now) for r in backend.list_rigs()), key=lambda x: x.rig_id)
 
 def get_rig_by_id(rig_id: str):
     from datetime import datetime
-    # 尝试再次加载，防止其它实例更新了磁盘（虽然 Serverless 内存不共享，但文件系统如果是持久卷则有效）
-    # 在 Vercel 的 /tmp 下，这仅限于单实例生存期
-    report = data_store.get(rig_id)
-    if report and report.last_report_at:
-        report.seconds_since_report = (datetime.now() - report.last_report_at).total_seconds()
+    report = backend.get_rig(rig_id)
+    if report:
+        _set_seconds_since_report(report, datetime.now())
     return report
 
 def delete_rig(rig_id: str) -> bool:
     """从存储中删除指定台架"""
-    if rig_id in data_store:
-        del data_store[rig_id]
-        save_to_disk()
-        return True
-    return False
+    rig_sequences.pop(rig_id, None)
+    return backend.delete_rig(rig_id)
 
-# ===== 温度数据管理 =====
-TEMPERATURE_FILE = "temperature_data.json"
-temperature_store: Dict[str, TemperatureData] = {}  # key: f"{rig_id}_{board_id}"
+def find_boards(status: Optional[str] = None, task_type: Optional[str] = None,
+                rig_id: Optional[str] = None) -> List[dict]:
+    """按状态 / 任务类型 / 台架筛选板子（SQLite 后端走索引）"""
+    return [{"rig_id": rid, **board.model_dump(mode="json")}
+            for rid, board in backend.find_boards(status, task_type, rig_id)]
 
-def save_temperature_to_disk():
-    """保存温度数据到磁盘"""
-    try:
-        serializable_data = {}
-        for key, temp_data in temperature_store.items():
-            serializable_data[key] = temp_data.dict()
-        with open(TEMPERATURE_FILE, "w", encoding="utf-8") as f:
-            json.dump(serializable_data, f, indent=2, default=str)
-    except Exception as e:
-        print(f"Failed to save temperature data: {e}")
+# ===== Agent 性能指标 =====
+# key: rig_id，value: 最近一次上报的 agent_metrics（仅保存在内存中，只反映最新一轮）
+agent_metrics_store: Dict[str, dict] = {}
 
-def load_temperature_from_disk():
-    """从磁盘加载温度数据"""
-    global temperature_store
-    try:
-        with open(TEMPERATURE_FILE, "r", encoding="utf-8") as f:
-            raw_data = json.load(f)
-            new_store = {}
-            for key, item in raw_data.items():
-                new_store[key] = TemperatureData(**item)
-            temperature_store = new_store
-    except FileNotFoundError:
-        temperature_store = {}
-    except Exception as e:
-        print(f"Failed to load temperature data: {e}")
-        temperature_store = {}
+def update_agent_metrics(rig_id: str, metrics: dict):
+    from datetime import datetime
+    agent_metrics_store[rig_id] = {**metrics, "received_at": datetime.now().isoformat()}
 
-def update_temperature_data(temp_reports: List[TemperatureData]):
-    """更新温度数据"""
+def get_agent_metrics(rig_id: str) -> Optional[dict]:
+    return agent_metrics_store.get(rig_id)
+
+def get_slowest_boards(limit: int = 10) -> List[dict]:
+    """全部台架中最近一轮解析最慢的板子，附带各阶段耗时和所用规则版本"""
+    boards = []
+    for rig_id, metrics in agent_metrics_store.items():
+        for board_id, board in metrics.get("boards", {}).items():
+            boards.append({
+                "rig_id": rig_id,
+                "board_id": board_id,
+                "total_ms": round(sum(board.get("ms", {}).values()), 1),
+                "ms": board.get("ms", {}),
+                "bytes": board.get("bytes", 0),
+                "matches": board.get("matches", 0),
+                "rules": metrics.get("rules", {})
+            })
+    boards.sort(key=lambda b: b["total_ms"], reverse=True)
+    return boards[:limit]
+
+# ===== 温度数据管理 =====
+def update_temperature_data(temp_reports: List[TemperatureData]) -> List[str]:
+    """更新温度数据
+
+    增量上报按 timestamp 合并到已有曲线；若后端没有该板子的曲线（如重启后），
+    返回这些板子的 board_id，由 Agent 下一轮全量重传。
+    """
     from datetime import datetime
     for temp_data in temp_reports:
-        key = f"{temp_data.rig_id}_{temp_data.board_id}"
         temp_data.last_updated = datetime.now()
-        temperature_store[key] = temp_data
-    save_temperature_to_disk()
+    resync = backend.put_temperature(temp_reports)
+    for temp_data in temp_reports:
+        temperature_query_cache.pop((temp_data.rig_id, temp_data.board_id), None)
+    return resync
 
 def get_temperature_data(rig_id: str, board_id: str) -> TemperatureData:
     """获取指定板子的温度数据"""
-    key = f"{rig_id}_{board_id}"
-    return temperature_store.get(key)
+    return backend.get_temperature(rig_id, board_id)
+
+def get_temperature_range(rig_id: str, board_id: str, start: Optional[str] = None,
+                          end: Optional[str] = None) -> List[dict]:
+    """指定板子在 [start, end] 时间范围内的温度点（ISO 格式时间字符串）"""
+    return backend.temperature_range(rig_id, board_id, start, end)
 
-# 初始化温度数据
-load_temperature_from_disk()
+# 温度曲线查询结果缓存：key: (rig_id, board_id)，value: {(from, to, max_points): 响应}
+# 该板子有新的温度上报时整体失效；每块板子只保留最近的 TEMPERATURE_CACHE_PER_BOARD 种查询
+TEMPERATURE_CACHE_PER_BOARD = 8
+temperature_query_cache: Dict[Tuple[str, str], "OrderedDict[tuple, dict]"] = {}
+
+def query_temperature(rig_id: str, board_id: str, start: Optional[str] = None, end: Optional[str] = None,
+                      max_points: Optional[int] = None) -> Optional[dict]:
+    """查询温度曲线：可按 [start, end] 截取时间范围（ISO 格式，格式错误时抛出 ValueError），
+    max_points 限制返回的点数（超过时按时间分段合并，保留峰值）。
+
+    返回温度汇总及 temp_points，另附 total_points（范围内的原始点数）和 bucket_seconds
+    （每个返回点合并的时长，未降采样时为 0）。
+    """
+    start = timestamp_iso(timestamp_us(start)) if start else None
+    end = timestamp_iso(timestamp_us(end)) if end else None
+    key, params = (rig_id, board_id), (start, end, max_points)
+    cached = temperature_query_cache.get(key)
+    if cached is not None and params in cached:
+        cached.move_to_end(params)
+        return cached[params]
+
+    summary = backend.temperature_summary(rig_id, board_id)
+    if summary is None:
+        return None
+    series = backend.temperature_series(rig_id, board_id, start, end)
+    if max_points is None:
+        points, bucket_seconds = series.points(), 0.0
+    else:
+        points, bucket_seconds = series.downsample(max_points)
+    result = {
+        **summary.model_dump(mode="json", exclude={"temp_points"}),
+        "temp_points": points,
+        "total_points": len(series),
+        "bucket_seconds": bucket_seconds
+    }
+    cached = temperature_query_cache.setdefault(key, OrderedDict())
+    cached[params] = result
+    if len(cached) > TEMPERATURE_CACHE_PER_BOARD:
+        cached.popitem(last=False)
+    return result
 
 def save_rules_to_disk():
     """将规则配置序列化到磁盘（Vercel环境跳过）"""
@@ -252,6 +329,13 @@ def get_rules_by_task_type(task_type: str) -> RuleConfig:
         raise ValueError(f"No rules found for task type: {task_type}")
     return rules_store[task_type]
 
+def get_rules_etag(task_type: str) -> str:
+    """规则的 ETag：由版本号和规则内容共同决定，内容变化但未改版本号时同样会变化"""
+    rule = get_rules_by_task_type(task_type)
+    payload = json.dumps(rule.rules, sort_keys=True, ensure_ascii=False)
+    digest = hashlib.md5(payload.encode("utf-8")).hexdigest()[:16]
+    return f'"{rule.version}-{digest}"'
+
 def get_all_rules() -> Dict[str, RuleConfig]:
     """获取所有规则配置"""
     return rules_store
@@ -320,8 +404,7 @@ def ensure_default_rules():
         for task_type, rule_config in default_rules.items():
             rules_store[task_type] = rule_config
 
-# 初始化时从磁盘加载数据
-load_from_disk()
+# 初始化时从磁盘加载规则（台架状态和温度数据由存储后端在创建时加载）
 load_rules_from_disk()
 
 # 确保Vercel环境有默认规则
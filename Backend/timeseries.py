@@ -0,0 +1,230 @@
+import math
+import os
+import struct
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import quote
+
+# 温度曲线每个窗口的数值字段（与 Agent temperature.py 中的温度点一致）
+FIELDS = ("max_temperature", "min_temperature", "ddr_temperature", "avg_temperature")
+
+# 时间戳统一按不带时区的本地时间处理，存为距 EPOCH 的微秒数，转换回 ISO 字符串时与原值一致
+EPOCH = datetime(1970, 1, 1)
+
+# 分段文件：8 字节文件头 + 定长记录（时间戳 int64 + 各字段 float64，小端）
+SEGMENT_MAGIC = b"TITANTS1"
+RECORD = struct.Struct("<q" + "d" * len(FIELDS))
+
+Row = Tuple[float, ...]
+
+
+def timestamp_us(value: str) -> int:
+    """ISO 时间字符串 -> 微秒；带时区的时间按其本地时间处理"""
+    dt = datetime.fromisoformat(value).replace(tzinfo=None)
+    return (dt - EPOCH) // timedelta(microseconds=1)
+
+
+def timestamp_iso(us: int) -> str:
+    return (EPOCH + timedelta(microseconds=us)).isoformat()
+
+
+def _nan_max(current: float, value: float) -> float:
+    """忽略 NaN（缺少的字段）的 max"""
+    return value if math.isnan(current) or value > current else current
+
+
+def _nan_min(current: float, value: float) -> float:
+    return value if math.isnan(current) or value < current else current
+
+
+def point_row(point: dict) -> Tuple[int, Row]:
+    """温度点 -> (时间戳, 各字段值)，缺少的字段记为 NaN"""
+    values = []
+    for field in FIELDS:
+        value = point.get(field)
+        values.append(math.nan if value is None else float(value))
+    return timestamp_us(point["timestamp"]), tuple(values)
+
+
+class TemperatureSeries:
+    """单块板子的温度曲线，按列存储
+
+    每个时间窗口一行：时间戳与各字段分别保存在 array 中（每个点 40 字节，dict 形式的
+    温度点约 340 字节），按时间戳有序。写入按窗口时间戳去重，同一窗口的新值覆盖旧值；
+    新窗口通常在末尾，追加即可。
+    """
+
+    __slots__ = ("ts", "columns")
+
+    def __init__(self):
+        self.ts = array("q")
+        self.columns = [array("d") for _ in FIELDS]
+
+    def __len__(self):
+        return len(self.ts)
+
+    def upsert(self, ts: int, row: Row):
+        index = bisect_left(self.ts, ts)
+        if index < len(self.ts) and self.ts[index] == ts:
+            for column, value in zip(self.columns, row):
+                column[index] = value
+        elif index == len(self.ts):
+            self.ts.append(ts)
+            for column, value in zip(self.columns, row):
+                column.append(value)
+        else:
+            self.ts.insert(index, ts)
+            for column, value in zip(self.columns, row):
+                column.insert(index, value)
+
+    def upsert_points(self, points: Iterable[dict]) -> List[Tuple[int, Row]]:
+        """写入一批温度点，返回写入的行（用于落盘）"""
+        rows = []
+        for point in points:
+            try:
+                ts, row = point_row(point)
+            except (KeyError, TypeError, ValueError):
+                continue
+            self.upsert(ts, row)
+            rows.append((ts, row))
+        return rows
+
+    def index_range(self, start: Optional[str] = None, end: Optional[str] = None) -> Tuple[int, int]:
+        """[start, end] 时间范围对应的行下标区间 [lo, hi)"""
+        lo = 0 if start is None else bisect_left(self.ts, timestamp_us(start))
+        hi = len(self.ts) if end is None else bisect_right(self.ts, timestamp_us(end))
+        return lo, max(lo, hi)
+
+    def point(self, index: int) -> dict:
+        point = {"timestamp": timestamp_iso(self.ts[index])}
+        for field, column in zip(FIELDS, self.columns):
+            value = column[index]
+            if not math.isnan(value):
+                point[field] = value
+        return point
+
+    def points(self, start: Optional[str] = None, end: Optional[str] = None) -> List[dict]:
+        lo, hi = self.index_range(start, end)
+        return [self.point(i) for i in range(lo, hi)]
+
+    def copy(self) -> "TemperatureSeries":
+        return self.slice()
+
+    def slice(self, start: Optional[str] = None, end: Optional[str] = None) -> "TemperatureSeries":
+        """[start, end] 时间范围内的行（复制）"""
+        lo, hi = self.index_range(start, end)
+        series = TemperatureSeries()
+        series.ts = self.ts[lo:hi]
+        series.columns = [column[lo:hi] for column in self.columns]
+        return series
+
+    def downsample(self, max_points: int) -> Tuple[List[dict], float]:
+        """把曲线按时间等分为 max_points 段，每段合并为一个点，返回 (温度点, 每段秒数)
+
+        合并方式与 Agent 按窗口聚合一致：最高温度取段内最大值、最低温度取最小值，DDR 温度
+        取最大值，平均温度取平均值，短时的温度尖峰不会被平滑掉。点数不超过 max_points 时
+        原样返回，每段秒数为 0。
+        """
+        if len(self.ts) <= max_points:
+            return self.points(), 0.0
+        first, span = self.ts[0], (self.ts[-1] - self.ts[0]) / max_points
+        # key: 段序号，value: [段内第一个点的时间戳, max, min, ddr, avg 之和, avg 个数]
+        buckets: Dict[int, list] = {}
+        for ts, high, low, ddr, avg in zip(self.ts, *self.columns):
+            index = min(int((ts - first) / span), max_points - 1)
+            bucket = buckets.get(index)
+            if bucket is None:
+                bucket = buckets[index] = [ts, math.nan, math.nan, math.nan, 0.0, 0]
+            bucket[1] = _nan_max(bucket[1], high)
+            bucket[2] = _nan_min(bucket[2], low)
+            bucket[3] = _nan_max(bucket[3], ddr)
+            if not math.isnan(avg):
+                bucket[4] += avg
+                bucket[5] += 1
+        points = []
+        for index in sorted(buckets):
+            ts, high, low, ddr, avg_sum, avg_count = buckets[index]
+            point = {"timestamp": timestamp_iso(ts)}
+            avg = round(avg_sum / avg_count, 2) if avg_count else math.nan
+            for field, value in zip(FIELDS, (high, low, ddr, avg)):
+                if not math.isnan(value):
+                    point[field] = value
+            points.append(point)
+        return points, span / 1_000_000
+
+    def records(self) -> bytes:
+        """全部行编码为分段文件记录"""
+        return b"".join(RECORD.pack(ts, *row) for ts, row in zip(self.ts, zip(*self.columns)))
+
+    @classmethod
+    def from_points(cls, points: Iterable[dict]) -> "TemperatureSeries":
+        series = cls()
+        series.upsert_points(points)
+        return series
+
+
+class SegmentStore:
+    """温度曲线的二进制分段文件，每块板子一个文件
+
+    增量上报只把写入的行追加到文件末尾（同一窗口可能出现多次，加载时以最后一次为准），
+    不重写历史；全量上报或文件中的记录数超过曲线行数的 compact_ratio 倍时，先写临时
+    文件再原子替换为只含当前曲线的文件。崩溃时写了一半的最后一条记录会被截掉。
+    """
+
+    def __init__(self, directory: str, compact_ratio: float = 2.0):
+        self.directory = directory
+        self.compact_ratio = compact_ratio
+        # key -> 文件中的记录数
+        self.records: Dict[Tuple[str, str], int] = {}
+
+    def path(self, rig_id: str, board_id: str) -> str:
+        # quote 会转义 "@"，作为分隔符不会与 ID 中的字符混淆
+        return os.path.join(self.directory, f"{quote(rig_id, safe='')}@{quote(board_id, safe='')}.tseg")
+
+    def load(self, rig_id: str, board_id: str) -> Optional[TemperatureSeries]:
+        path = self.path(rig_id, board_id)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        if not data.startswith(SEGMENT_MAGIC):
+            print(f"Invalid temperature segment file: {path}")
+            return None
+        count = (len(data) - len(SEGMENT_MAGIC)) // RECORD.size
+        end = len(SEGMENT_MAGIC) + count * RECORD.size
+        if end != len(data):
+            print(f"{path}: 丢弃末尾不完整的记录")
+            try:
+                os.truncate(path, end)
+            except OSError as e:
+                print(f"Failed to truncate {path}: {e}")
+        series = TemperatureSeries()
+        for ts, *row in RECORD.iter_unpack(memoryview(data)[len(SEGMENT_MAGIC):end]):
+            series.upsert(ts, row)
+        self.records[(rig_id, board_id)] = count
+        return series
+
+    def append(self, rig_id: str, board_id: str, rows: List[Tuple[int, Row]]):
+        path = self.path(rig_id, board_id)
+        key = (rig_id, board_id)
+        with open(path, "ab") as f:
+            if f.tell() == 0:
+                f.write(SEGMENT_MAGIC)
+            f.write(b"".join(RECORD.pack(ts, *row) for ts, row in rows))
+        self.records[key] = self.records.get(key, 0) + len(rows)
+
+    def needs_compact(self, rig_id: str, board_id: str, rows: int, appending: int = 0) -> bool:
+        """追加 appending 条记录后，文件中的记录数是否超过曲线行数 rows 的 compact_ratio 倍"""
+        return self.records.get((rig_id, board_id), 0) + appending > max(rows, 1) * self.compact_ratio
+
+    def write(self, rig_id: str, board_id: str, series: TemperatureSeries):
+        """用当前曲线替换文件"""
+        path = self.path(rig_id, board_id)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(SEGMENT_MAGIC + series.records())
+        os.replace(tmp_path, path)
+        self.records[(rig_id, board_id)] = len(series)
@@ -0,0 +1,87 @@
+import json
+import os
+from typing import Any, Iterator, Optional
+
+
+class WriteAheadLog:
+    """追加写日志 + 快照
+
+    每次修改以一行 JSON 记录追加到 wal_path，写入成本只与本次修改的大小有关；记录数或
+    文件大小超过阈值时把完整状态写成快照（先写临时文件再原子替换），然后清空日志。
+    启动时先读快照再按顺序重放日志。记录必须是幂等的（写入的是修改后的值而不是差值），
+    这样在快照已替换、日志尚未清空时崩溃，重放也会得到同样的状态；崩溃时写了一半的
+    最后一行会被丢弃。
+    """
+
+    def __init__(self, snapshot_path: str, wal_path: str, compact_records: int = 1000,
+                 compact_bytes: int = 32 * 1024 * 1024, fsync: bool = False):
+        self.snapshot_path = snapshot_path
+        self.wal_path = wal_path
+        self.compact_records = compact_records
+        self.compact_bytes = compact_bytes
+        self.fsync = fsync
+        # 当前日志中的记录数和字节数
+        self.records = 0
+        self.size = 0
+        self._file = None
+
+    def load_snapshot(self) -> Optional[Any]:
+        try:
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def replay(self) -> Iterator[dict]:
+        """按写入顺序产出日志中的记录；末尾不完整的记录被截掉"""
+        self.records, self.size = 0, 0
+        try:
+            f = open(self.wal_path, "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if not line.endswith(b"\n"):
+                    break
+                self.records += 1
+                self.size += len(line)
+                yield record
+        if os.path.getsize(self.wal_path) != self.size:
+            print(f"WAL {self.wal_path}: 丢弃末尾不完整的记录")
+            os.truncate(self.wal_path, self.size)
+
+    def append(self, record: dict):
+        if self._file is None:
+            self._file = open(self.wal_path, "ab")
+        line = (json.dumps(record, ensure_ascii=False, separators=(",", ":"), default=str) + "\n").encode("utf-8")
+        self._file.write(line)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self.records += 1
+        self.size += len(line)
+
+    def should_compact(self) -> bool:
+        return self.records >= self.compact_records or self.size >= self.compact_bytes
+
+    def compact(self, snapshot: Any):
+        """写入完整状态的快照并清空日志"""
+        tmp_path = self.snapshot_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, ensure_ascii=False, separators=(",", ":"), default=str)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        self.close()
+        with open(self.wal_path, "wb"):
+            pass
+        self.records, self.size = 0, 0
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
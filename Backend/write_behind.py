@@ -0,0 +1,93 @@
+import threading
+import time
+from typing import Callable, Dict, Set, Tuple
+
+
+class DirtyRigs:
+    """自上次落盘以来有变化的台架和板子
+
+    只记录 ID，不记录修改内容：落盘时按内存中的当前状态生成写入，同一台架/板子在一个
+    周期内的多次修改合并为一次写入。
+    """
+
+    def __init__(self):
+        # 需要整体写入的台架（全量上报或删除，落盘时台架已不存在即为删除）
+        self.full: Set[str] = set()
+        # rig_id -> 有变化的 board_id（落盘时板子已不存在即为删除）
+        self.boards: Dict[str, Set[str]] = {}
+
+    def put(self, rig_id: str):
+        self.full.add(rig_id)
+        self.boards.pop(rig_id, None)
+
+    def patch(self, rig_id: str, board_ids):
+        if rig_id not in self.full:
+            self.boards.setdefault(rig_id, set()).update(board_ids)
+
+    def take(self) -> Tuple[Set[str], Dict[str, Set[str]]]:
+        full, boards = self.full, self.boards
+        self.full, self.boards = set(), {}
+        return full, boards
+
+    def __len__(self):
+        return len(self.full) + sum(len(ids) for ids in self.boards.values())
+
+
+class WriteBehind:
+    """后台落盘线程
+
+    上报只修改内存并调用 mark() 记录脏数据；后台线程每 interval 秒，或脏数据累计达到
+    max_dirty 时调用一次 flush，把这段时间内的修改合并写入磁盘，请求处理不再等待磁盘 I/O。
+    close() 停止线程并最后落盘一次。interval 为 0 时不启动线程，每次 mark() 立即落盘。
+    """
+
+    def __init__(self, flush: Callable[[], None], interval: float = 1.0, max_dirty: int = 500,
+                 name: str = "write-behind"):
+        self._flush = flush
+        self.interval = interval
+        self.max_dirty = max_dirty
+        self.dirty = 0
+        self.flushes = 0
+        self.last_flush_ms = 0.0
+        # 同一时刻只有一个 flush 在执行（后台线程与 close() 中的最后一次落盘）
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = None
+        if interval > 0:
+            self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+            self._thread.start()
+
+    def mark(self, count: int = 1):
+        self.dirty += count
+        if self._thread is None:
+            self.flush()
+        elif self.dirty >= self.max_dirty:
+            self._wake.set()
+
+    def flush(self):
+        with self._flush_lock:
+            self.dirty = 0
+            started = time.perf_counter()
+            try:
+                self._flush()
+            except Exception as e:
+                print(f"Failed to flush pending writes: {e}")
+            self.flushes += 1
+            self.last_flush_ms = round((time.perf_counter() - started) * 1000, 2)
+
+    def _run(self):
+        while not self._stopped:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self.dirty and not self._stopped:
+                self.flush()
+
+    def close(self):
+        if self._stopped:
+            return
+        self._stopped = True
+        if self._thread is not None:
+            self._wake.set()
+            self._thread.join()
+        self.flush()
@@ -260,7 +260,7 @@ export default function BoardDetailPage() {
   const fetchTemperatureData = async () => {
     setLoadingTemperature(true);
     try {
-      const res = await fetch(`${CONFIG.API_BASE_URL}/api/temperature/${rigId}/${boardId}`);
+      const res = await fetch(`${CONFIG.API_BASE_URL}/api/temperature/${rigId}/${boardId}?max_points=${CONFIG.TEMPERATURE_MAX_POINTS}`);
       if (res.ok) {
         const data = await res.json();
         setTemperatureData(data);
@@ -9,4 +9,7 @@ export const CONFIG = {
   
   // 状态轮询间隔 (毫秒)
   POLLING_INTERVAL: 30000,
+
+  // 温度曲线最多请求的点数，后端按时间分段合并（保留峰值），数据量不随测试时长增长
+  TEMPERATURE_MAX_POINTS: 600,
 };